@@ -0,0 +1,155 @@
+"""In-process stand-in for the parts of the Ollama HTTP API the AI service uses.
+
+``/api/embed`` returns deterministic hashed bag-of-words vectors, so similar
+texts get similar vectors and retrieval still behaves sensibly. ``/api/chat``
+streams a canned, LaTeX-heavy answer at a fixed token rate after a
+first-token delay, and ends with the same counters Ollama reports
+(``prompt_eval_count``, ``eval_count``, ``eval_duration``, ...).
+
+``ServerThread`` runs any ASGI app under uvicorn on its own thread and event
+loop; the load test uses it for this fake and for the service itself.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORD_RE = re.compile(r"\w+")
+
+ANSWER = (
+    "By the fundamental theorem of calculus, if F is an antiderivative of f on [a, b], then "
+    "\\[ \\int_a^b f(x)\\,dx = F(b) - F(a) \\] [S1]. For example, with f(x) = x^2 we get "
+    "\\( \\int_0^1 x^2\\,dx = \\frac{1}{3} \\) [S2]. The same idea gives the average value "
+    "\\( \\frac{1}{b-a}\\int_a^b f \\) and, for a continuous f, the mean value theorem for integrals [S1]."
+)
+
+def embed_text(text: str, dim: int) -> List[float]:
+    vec = [0.0] * dim
+    for word in WORD_RE.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+def answer_tokens(n: int) -> List[str]:
+    words = re.findall(r"\S+\s*", ANSWER)
+    return [words[i % len(words)] for i in range(n)]
+
+def create_app(
+    dim: int = 256,
+    embed_latency_ms: float = 15.0,
+    embed_per_text_ms: float = 0.5,
+    first_token_ms: float = 250.0,
+    tokens_per_s: float = 40.0,
+    answer_len: int = 120,
+) -> FastAPI:
+    app = FastAPI(title="fake-ollama")
+    app.state.calls = {"embed": 0, "embed_texts": 0, "chat": 0}
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        texts = body.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        app.state.calls["embed"] += 1
+        app.state.calls["embed_texts"] += len(texts)
+        await asyncio.sleep((embed_latency_ms + embed_per_text_ms * len(texts)) / 1000.0)
+        return {"model": body.get("model"), "embeddings": [embed_text(t, dim) for t in texts]}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        app.state.calls["chat"] += 1
+        prompt = "".join(m.get("content") or "" for m in body.get("messages") or [])
+        prompt_tokens = max(1, len(prompt) // 4)
+        tokens = answer_tokens(answer_len)
+        started = time.perf_counter()
+
+        def frame(content: str, done: bool, eval_s: float = 0.0) -> Dict[str, Any]:
+            out: Dict[str, Any] = {
+                "model": body.get("model"),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": content},
+                "done": done,
+            }
+            if done:
+                out.update(
+                    done_reason="stop",
+                    total_duration=int((time.perf_counter() - started) * 1e9),
+                    load_duration=0,
+                    prompt_eval_count=prompt_tokens,
+                    prompt_eval_duration=int(first_token_ms * 1e6),
+                    eval_count=len(tokens),
+                    eval_duration=int(eval_s * 1e9),
+                )
+            return out
+
+        if not body.get("stream", True):
+            await asyncio.sleep(first_token_ms / 1000.0 + len(tokens) / tokens_per_s)
+            return JSONResponse(frame("".join(tokens), True, len(tokens) / tokens_per_s))
+
+        async def frames():
+            await asyncio.sleep(first_token_ms / 1000.0)
+            eval_started = time.perf_counter()
+            for i, token in enumerate(tokens):
+                # Pace against the wall clock so slow consumers don't slow the rate down further.
+                delay = eval_started + (i + 1) / tokens_per_s - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield json.dumps(frame(token, False)) + "\n"
+            yield json.dumps(frame("", True, time.perf_counter() - eval_started)) + "\n"
+
+        return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+    return app
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class ServerThread:
+    """Serve an ASGI app with uvicorn on a background thread."""
+
+    def __init__(self, app: Any, port: Optional[int] = None):
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=self.port, log_level="warning", loop="asyncio", lifespan="on",
+        ))
+        self.thread = threading.Thread(target=self.server.run, name=f"uvicorn-{self.port}", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 15.0) -> "ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"server on port {self.port} did not start")
+            time.sleep(0.02)
+        return self
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
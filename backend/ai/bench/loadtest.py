@@ -0,0 +1,321 @@
+"""Replay recorded traffic against the AI service with fake Ollama and a local Chroma.
+
+Run from backend/ai:
+
+    python bench/loadtest.py                                  # bench/traffic_sample.jsonl, 8 clients
+    python bench/loadtest.py --concurrency 32 --repeat 5 --mixed
+    python bench/loadtest.py --traffic my.jsonl --json out.json --env LLM_MAX_CONCURRENT=4
+
+Everything runs on this machine:
+- A fake Ollama (see fake_ollama.py) whose latency and token rate are set by flags.
+- A throwaway Chroma started with ``chroma run``, or an existing one given with ``--chroma``.
+- The FastAPI app itself, served by uvicorn on its own thread with a fresh AI_STATE_DIR.
+
+Traffic is JSONL, one request per line:
+
+    {"endpoint": "/ingest", "collection": "calc", "filename": "ftc.pdf", "pages": ["...", "..."]}
+    {"endpoint": "/query", "payload": {"query": "...", "collection": "calc"}}
+    {"endpoint": "/ask", "payload": {"question": "...", "collection": "calc"}}
+    {"endpoint": "/ask/stream", "payload": {"question": "...", "collection": "calc"}}
+
+Ingest requests are sent first, once each; their PDFs are generated from
+``pages``. The other requests are then replayed ``--repeat`` times by
+``--concurrency`` closed-loop clients, either one endpoint at a time or all
+mixed together with ``--mixed``.
+
+For each endpoint the report gives:
+- p50/p95/p99 latency, and time to first line for streams
+- throughput
+- growth and peak of this process's RSS (the Chroma server is a separate process)
+- the service event loop's worst scheduling lag, which exposes blocking calls on the loop
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_ollama import ServerThread, create_app, free_port
+
+DEFAULT_TRAFFIC = os.path.join(HERE, "traffic_sample.jsonl")
+
+def load_traffic(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def make_pdf(pages: List[str]) -> bytes:
+    import fitz
+
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class RssSampler:
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_rss = self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self) -> Tuple[int, int, int]:
+        self._stop.set()
+        self._thread.join()
+        end = rss_bytes()
+        return self.start_rss, end, max(self.peak, end)
+
+class LoopLag:
+    """Scheduling lag of the service's event loop, sampled every ``interval`` seconds."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - started - self.interval)
+
+    def take(self) -> List[float]:
+        samples, self.samples = self.samples, []
+        return samples
+
+def start_chroma(path: str) -> Tuple[subprocess.Popen, int]:
+    port = free_port()
+    proc = subprocess.Popen(
+        ["chroma", "run", "--path", path, "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/v2/heartbeat", timeout=1).status_code == 200:
+                return proc, port
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("local Chroma did not start (is the chromadb CLI installed?)")
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+class Result:
+    __slots__ = ("endpoint", "status", "latency", "ttfb")
+
+    def __init__(self, endpoint: str, status: int, latency: float, ttfb: Optional[float] = None):
+        self.endpoint = endpoint
+        self.status = status
+        self.latency = latency
+        self.ttfb = ttfb
+
+async def send(client: httpx.AsyncClient, entry: Dict[str, Any], pdfs: Dict[int, bytes]) -> Result:
+    endpoint = entry["endpoint"]
+    started = time.perf_counter()
+    try:
+        if endpoint == "/ingest":
+            data = {"collection": entry.get("collection")} if entry.get("collection") else {}
+            if entry.get("metadata"):
+                data["metadata_json"] = json.dumps(entry["metadata"])
+            files = {"file": (entry.get("filename", "doc.pdf"), pdfs[id(entry)], "application/pdf")}
+            response = await client.post(endpoint, data=data, files=files)
+            return Result(endpoint, response.status_code, time.perf_counter() - started)
+        if endpoint == "/ask/stream":
+            ttfb = None
+            async with client.stream("POST", endpoint, json=entry["payload"]) as response:
+                async for line in response.aiter_lines():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - started
+                    if line and json.loads(line).get("type") == "error":
+                        return Result(endpoint, 599, time.perf_counter() - started, ttfb)
+            return Result(endpoint, response.status_code, time.perf_counter() - started, ttfb)
+        response = await client.post(endpoint, json=entry["payload"])
+        return Result(endpoint, response.status_code, time.perf_counter() - started)
+    except httpx.HTTPError:
+        return Result(endpoint, 0, time.perf_counter() - started)
+
+async def run_phase(
+    name: str,
+    client: httpx.AsyncClient,
+    entries: List[Dict[str, Any]],
+    concurrency: int,
+    pdfs: Dict[int, bytes],
+    lag: LoopLag,
+) -> Dict[str, Any]:
+    queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    for entry in entries:
+        queue.put_nowait(entry)
+    results: List[Result] = []
+
+    async def worker() -> None:
+        while not queue.empty():
+            results.append(await send(client, queue.get_nowait(), pdfs))
+
+    lag.take()
+    memory = RssSampler()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    wall = time.perf_counter() - started
+    rss_start, rss_end, rss_peak = memory.stop()
+    lags = lag.take()
+
+    report = {"phase": name, "wall_s": round(wall, 3), "loop_lag_max_ms": round(max(lags, default=0.0) * 1000, 1),
+              "loop_lag_p99_ms": round(percentile(lags, 99) * 1000, 1),
+              "rss_start_mb": round(rss_start / 2**20, 1), "rss_end_mb": round(rss_end / 2**20, 1),
+              "rss_peak_mb": round(rss_peak / 2**20, 1), "endpoints": {}}
+    for endpoint in sorted({r.endpoint for r in results}):
+        rows = [r for r in results if r.endpoint == endpoint]
+        ok = [r.latency for r in rows if 200 <= r.status < 300]
+        statuses: Dict[str, int] = {}
+        for r in rows:
+            statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+        stats = {
+            "requests": len(rows),
+            "statuses": statuses,
+            "throughput_rps": round(len(rows) / wall, 2) if wall else 0.0,
+            "p50_ms": round(percentile(ok, 50) * 1000, 1),
+            "p95_ms": round(percentile(ok, 95) * 1000, 1),
+            "p99_ms": round(percentile(ok, 99) * 1000, 1),
+        }
+        ttfb = [r.ttfb for r in rows if r.ttfb is not None]
+        if ttfb:
+            stats["ttfb_p50_ms"] = round(percentile(ttfb, 50) * 1000, 1)
+            stats["ttfb_p95_ms"] = round(percentile(ttfb, 95) * 1000, 1)
+        report["endpoints"][endpoint] = stats
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n== {report['phase']}  wall {report['wall_s']}s  loop lag p99 {report['loop_lag_p99_ms']}ms "
+          f"max {report['loop_lag_max_ms']}ms  rss {report['rss_start_mb']}->{report['rss_end_mb']}MB "
+          f"(peak {report['rss_peak_mb']}MB)")
+    print(f"{'endpoint':<12} {'reqs':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttfb p50':>9}  statuses")
+    for endpoint, s in report["endpoints"].items():
+        ttfb = s.get("ttfb_p50_ms", "")
+        print(f"{endpoint:<12} {s['requests']:>5} {s['throughput_rps']:>8} {s['p50_ms']:>9} {s['p95_ms']:>9} "
+              f"{s['p99_ms']:>9} {ttfb:>9}  {s['statuses']}")
+
+async def replay(args: argparse.Namespace, base_url: str, lag: LoopLag) -> List[Dict[str, Any]]:
+    traffic = load_traffic(args.traffic)
+    ingest = [e for e in traffic if e["endpoint"] == "/ingest"]
+    others = [e for e in traffic if e["endpoint"] != "/ingest"]
+    pdfs = {id(e): make_pdf(e["pages"]) for e in ingest}
+
+    reports = []
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        if ingest:
+            reports.append(await run_phase("ingest", client, ingest, args.concurrency, pdfs, lag))
+        if args.mixed:
+            entries = others * args.repeat
+            random.Random(args.seed).shuffle(entries)
+            reports.append(await run_phase("mixed", client, entries, args.concurrency, pdfs, lag))
+        else:
+            for endpoint in dict.fromkeys(e["endpoint"] for e in others):
+                entries = [e for e in others if e["endpoint"] == endpoint] * args.repeat
+                reports.append(await run_phase(endpoint, client, entries, args.concurrency, pdfs, lag))
+        reports.append({"phase": "server", "metrics_bytes": len((await client.get("/metrics")).text)})
+    return reports
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--traffic", default=DEFAULT_TRAFFIC, help="JSONL traffic file")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed-loop clients")
+    parser.add_argument("--repeat", type=int, default=3, help="times each non-ingest request is replayed")
+    parser.add_argument("--mixed", action="store_true", help="replay all endpoints together instead of one at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request (s)")
+    parser.add_argument("--chroma", help="host:port of an existing Chroma instead of a throwaway one")
+    parser.add_argument("--embed-latency-ms", type=float, default=15.0)
+    parser.add_argument("--embed-per-text-ms", type=float, default=0.5)
+    parser.add_argument("--first-token-ms", type=float, default=250.0)
+    parser.add_argument("--tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra service settings")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ai-loadtest-")
+    chroma = None
+    ollama = ServerThread(create_app(
+        embed_latency_ms=args.embed_latency_ms,
+        embed_per_text_ms=args.embed_per_text_ms,
+        first_token_ms=args.first_token_ms,
+        tokens_per_s=args.tokens_per_s,
+        answer_len=args.answer_tokens,
+    )).start()
+    try:
+        if args.chroma:
+            chroma_host, chroma_port = args.chroma.rsplit(":", 1)
+        else:
+            chroma, port = start_chroma(os.path.join(workdir, "chroma"))
+            chroma_host, chroma_port = "127.0.0.1", str(port)
+        os.environ.update({
+            "OLLAMA_BASE_URL": ollama.url,
+            "CHROMA_HOST": chroma_host,
+            "CHROMA_PORT": chroma_port,
+            "AI_STATE_DIR": os.path.join(workdir, "state"),
+        })
+        os.environ.update(dict(kv.split("=", 1) for kv in args.env))
+
+        # Import only now: the service reads its settings and connects to Chroma at import time.
+        from src.main import app
+
+        lag = LoopLag()
+        lag_task: List[asyncio.Task] = []
+        app.add_event_handler("startup", lambda: lag_task.append(asyncio.get_running_loop().create_task(lag.run())))
+        service = ServerThread(app).start()
+        try:
+            reports = asyncio.run(replay(args, service.url, lag))
+        finally:
+            service.stop()
+        for report in reports[:-1]:
+            print_report(report)
+        print(f"\nfake Ollama calls: {ollama.server.config.app.state.calls}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "phases": reports}, f, indent=2)
+    finally:
+        ollama.stop()
+        if chroma is not None:
+            chroma.terminate()
+            chroma.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
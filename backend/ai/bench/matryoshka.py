@@ -0,0 +1,129 @@
+"""Recall and latency of two-stage (truncated prefilter + full rerank) search, to pick PREFILTER_DIM.
+
+Run from backend/ai:
+
+    python bench/matryoshka.py --collection state/vectors/my_collection     # vectors of a real collection
+    python bench/matryoshka.py --synthetic 200000 --dims 64,128,256 --candidates 100,400
+
+The vectors are copied into a throwaway local collection. Queries are
+stored vectors with Gaussian noise added. Every configuration (dimension x
+int8/float32 x candidate count) answers the same queries. The report
+compares each one with the exact full-vector scan:
+- recall@k: the fraction of the exact top-k that it finds
+- p50 and p95 latency per query
+- the size of the compact matrix, the part that is scanned in full
+
+Synthetic vectors only mimic Matryoshka embeddings: their variance
+decays along the dimensions. Use ``--collection`` on real data before
+choosing a setting.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.local_vectors import LocalCollection  # noqa: E402
+
+def load_collection(path: str) -> np.ndarray:
+    with sqlite3.connect(os.path.join(path, "rows.sqlite")) as conn:
+        info = dict(conn.execute("SELECT key, value FROM info").fetchall())
+        slots = [s for s, in conn.execute("SELECT slot FROM rows ORDER BY slot")]
+    dtype = np.float16 if info["dtype"] == "float16" else np.float32
+    dim = int(info["dim"])
+    matrix = np.memmap(os.path.join(path, "vectors.f16" if dtype is np.float16 else "vectors.f32"), dtype=dtype, mode="r")
+    return np.asarray(matrix.reshape(-1, dim)[slots], dtype=np.float32)
+
+def synthetic(n: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    # Leading components carry most of the variance, as in Matryoshka-trained models.
+    scale = (1.0 / np.sqrt(1.0 + np.arange(dim) / 16.0)).astype(np.float32)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32) * scale
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32) * scale
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def fill(root: str, vectors: np.ndarray) -> None:
+    collection = LocalCollection(root, "bench")
+    for i in range(0, len(vectors), 5000):
+        batch = vectors[i:i + 5000]
+        collection.upsert([str(j) for j in range(i, i + len(batch))], batch, [""] * len(batch), [{}] * len(batch))
+
+def run(collection: LocalCollection, queries: np.ndarray, k: int) -> Dict[str, Any]:
+    ids, times = [], []
+    for q in queries:
+        started = time.perf_counter()
+        got = collection.query([q], n_results=k, include=[])
+        times.append((time.perf_counter() - started) * 1000)
+        ids.append(got["ids"][0])
+    return {"ids": ids, "p50_ms": round(float(np.percentile(times, 50)), 2), "p95_ms": round(float(np.percentile(times, 95)), 2)}
+
+def recall(found: List[List[str]], exact: List[List[str]]) -> float:
+    return round(float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact) if e])), 4)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--collection", help="directory of a local collection (LOCAL_VECTOR_PATH/<name>)")
+    source.add_argument("--synthetic", type=int, metavar="N", help="generate N Matryoshka-like vectors")
+    parser.add_argument("--dim", type=int, default=768, help="dimension of synthetic vectors")
+    parser.add_argument("--clusters", type=int, default=500, help="topics in the synthetic vectors")
+    parser.add_argument("--dims", default="64,128,256", help="prefilter dimensions to try")
+    parser.add_argument("--candidates", default="100,200,500", help="prefilter candidate counts to try")
+    parser.add_argument("--float32", action="store_true", help="also try float32 compact vectors (default int8 only)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.3, help="relative noise added to the query vectors")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = load_collection(args.collection) if args.collection else synthetic(args.synthetic, args.dim, args.clusters, rng)
+    picks = vectors[rng.integers(0, len(vectors), args.queries)]
+    noise = rng.standard_normal(picks.shape).astype(np.float32)
+    queries = picks + args.noise * noise * np.linalg.norm(picks, axis=1, keepdims=True) / np.sqrt(picks.shape[1])
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dims, {args.queries} queries, k={args.k}")
+
+    root = tempfile.mkdtemp(prefix="matryoshka-")
+    try:
+        fill(root, vectors)
+        exact = run(LocalCollection(root, "bench"), queries, args.k)
+        rows = [{"dim": vectors.shape[1], "type": "float32", "candidates": None, "recall": 1.0,
+                 "p50_ms": exact["p50_ms"], "p95_ms": exact["p95_ms"], "scanned_mb": round(vectors.nbytes / 2**20, 1)}]
+        for dim in [int(d) for d in args.dims.split(",")]:
+            for int8 in ([True, False] if args.float32 else [True]):
+                for candidates in [int(c) for c in args.candidates.split(",")]:
+                    collection = LocalCollection(
+                        root, "bench", prefilter_dim=dim, prefilter_int8=int8, prefilter_candidates=candidates,
+                    )
+                    collection.query([queries[0]], n_results=args.k)  # builds the compact matrix
+                    result = run(collection, queries, args.k)
+                    rows.append({
+                        "dim": dim,
+                        "type": "int8" if int8 else "float32",
+                        "candidates": candidates,
+                        "recall": recall(result["ids"], exact["ids"]),
+                        "p50_ms": result["p50_ms"],
+                        "p95_ms": result["p95_ms"],
+                        "scanned_mb": round(len(vectors) * dim * (1 if int8 else 4) / 2**20, 1),
+                    })
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"\n{'dim':>5} {'type':>8} {'cands':>6} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'scan MB':>8}")
+    for r in rows:
+        print(f"{r['dim']:>5} {r['type']:>8} {r['candidates'] or 'exact':>6} {r['recall']:>10} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['scanned_mb']:>8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"vectors": len(vectors), "k": args.k, "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Production serving: ``gunicorn -c gunicorn.conf.py src.main:app``.
+
+Pre-forks ``WEB_CONCURRENCY`` uvicorn workers from one preloaded app. Send
+HUP to restart the workers gracefully (in-flight requests finish first),
+USR2 followed by TERM to the old master to load new code without downtime.
+"""
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Import the app (langchain, numpy, pymupdf) once in the master; workers fork with it loaded.
+# Clients, pools and SQLite handles are all created lazily, so nothing is shared across the fork.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Answers can take minutes on a busy model; the worker heartbeat must outlast REQUEST_TIMEOUT_S.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+accesslog = "-"
+errorlog = "-"
+
+if workers > 1:
+    # Answer cache, sessions and job status must be visible to whichever worker gets the next request.
+    os.environ.setdefault("SHARED_STATE", "true")
+    # Every worker gets its own PDF pool; split the cores instead of multiplying them.
+    os.environ.setdefault("PDF_PARSE_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
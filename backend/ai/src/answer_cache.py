@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .sqlite_util import transaction
+
+Scope = Tuple[str, int, str, str, str]
+
+def normalize_question(question: str) -> str:
+    q = unicodedata.normalize("NFKC", question).lower()
+    q = re.sub(r"\s+", " ", q).strip()
+    return q.rstrip("?!. ")
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def make_scope(
+    collection: str,
+    k: int,
+    metadata_filter: Optional[Dict[str, Any]],
+    history_text: str,
+    retrieval: Optional[Dict[str, Any]] = None,
+) -> Scope:
+    """Everything besides the question that determines an answer."""
+    filter_key = json.dumps(metadata_filter, sort_keys=True, default=str) if metadata_filter else ""
+    retrieval_key = json.dumps(retrieval, sort_keys=True, default=str) if retrieval else ""
+    return (collection, k, filter_key, fingerprint(history_text), retrieval_key)
+
+def _collections(scope: Scope) -> List[str]:
+    # A multi-collection scope names all of its collections, joined by commas.
+    return scope[0].split(",")
+
+class _Entry:
+    __slots__ = ("scope", "value", "vector", "expires", "size")
+
+    def __init__(self, scope: Scope, value: Dict[str, Any], vector: Optional[np.ndarray], expires: float):
+        self.scope = scope
+        self.value = value
+        self.vector = vector
+        self.expires = expires
+        self.size = len(json.dumps(value, default=str)) + (vector.nbytes if vector is not None else 0)
+
+class AnswerCache:
+    """Two-layer cache for /ask answers.
+
+    The exact layer is keyed on (scope, normalized question). The optional
+    semantic layer compares the query embedding against cached entries of the
+    same scope and hits when cosine similarity reaches ``semantic_threshold``.
+    Entries are evicted LRU-first once ``max_entries`` or ``max_bytes`` is
+    exceeded, and expire after ``ttl`` seconds.
+
+    Every ``invalidate`` bumps the collection's generation. An answer
+    generated while its collection changed is not stored if ``put`` gets
+    the ``generation`` taken before retrieval.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600.0,
+        semantic_threshold: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._entries: "OrderedDict[Tuple[Scope, str], _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "stale_puts": 0,
+        }
+
+    @property
+    def semantic(self) -> bool:
+        return bool(self.semantic_threshold)
+
+    def _drop(self, key: Tuple[Scope, str]) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def get(self, scope: Scope, question: str) -> Optional[Dict[str, Any]]:
+        key = (scope, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._stats["exact_hits"] += 1
+            return entry.value
+
+    def get_similar(self, scope: Scope, vector: List[float]) -> Optional[Dict[str, Any]]:
+        if not self.semantic:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            keys, vectors = [], []
+            for key, entry in self._entries.items():
+                if entry.scope == scope and entry.vector is not None and entry.expires >= now:
+                    keys.append(key)
+                    vectors.append(entry.vector)
+            if vectors:
+                q = np.asarray(vector, dtype=np.float32)
+                q /= (np.linalg.norm(q) or 1.0)
+                sims = np.stack(vectors) @ q
+                best = int(np.argmax(sims))
+                if sims[best] >= self.semantic_threshold:
+                    self._entries.move_to_end(keys[best])
+                    self._stats["semantic_hits"] += 1
+                    return self._entries[keys[best]].value
+            return None
+
+    def miss(self) -> None:
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def _generation(self, scope: Scope) -> Tuple[int, ...]:
+        return tuple(self._generations.get(name, 0) for name in _collections(scope))
+
+    def generation(self, scope: Scope) -> Tuple[int, ...]:
+        """Invalidation count of each collection behind ``scope``."""
+        with self._lock:
+            return self._generation(scope)
+
+    def put(
+        self,
+        scope: Scope,
+        question: str,
+        value: Dict[str, Any],
+        vector: Optional[List[float]] = None,
+        generation: Optional[Tuple[int, ...]] = None,
+    ) -> None:
+        """Store an answer; with ``generation`` it is dropped if a collection was invalidated since."""
+        vec = None
+        if vector is not None and self.semantic:
+            vec = np.asarray(vector, dtype=np.float32)
+            vec /= (np.linalg.norm(vec) or 1.0)
+        entry = _Entry(scope, value, vec, time.monotonic() + self.ttl)
+        if entry.size > self.max_bytes:
+            return
+        key = (scope, normalize_question(question))
+        with self._lock:
+            if generation is not None and generation != self._generation(scope):
+                self._stats["stale_puts"] += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate(self, collection: str) -> int:
+        """Drop the answers drawn from ``collection``, including multi-collection ones ("a,b")."""
+        with self._lock:
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+            stale = [key for key, entry in self._entries.items() if collection in _collections(entry.scope)]
+            for key in stale:
+                self._drop(key)
+            self._stats["invalidations"] += len(stale)
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["exact_hits"] + self._stats["semantic_hits"] + self._stats["misses"]
+            hits = lookups - self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "semantic_threshold": self.semantic_threshold,
+            }
+
+class SqliteAnswerCache:
+    """``AnswerCache`` in a SQLite file, shared by every worker process on the host.
+
+    Same interface and limits. A hit in one worker serves all of them, and
+    ``invalidate`` removes a collection's answers for everyone at once. Hit
+    and miss counters are per process; entries and bytes are for the file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600.0,
+        semantic_threshold: Optional[float] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " scope TEXT NOT NULL, question TEXT NOT NULL, collection TEXT NOT NULL,"
+            " value TEXT NOT NULL, vector BLOB, size INTEGER NOT NULL,"
+            " expires REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (scope, question));"
+            "CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used);"
+            "CREATE INDEX IF NOT EXISTS answers_collection ON answers(collection);"
+            "CREATE TABLE IF NOT EXISTS generations (collection TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+        )
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "stale_puts": 0,
+        }
+
+    @property
+    def semantic(self) -> bool:
+        return bool(self.semantic_threshold)
+
+    @staticmethod
+    def _scope_key(scope: Scope) -> str:
+        return json.dumps(scope)
+
+    def _generation(self, scope: Scope) -> Tuple[int, ...]:
+        names = _collections(scope)
+        rows = dict(self._conn.execute(
+            f"SELECT collection, value FROM generations WHERE collection IN ({','.join('?' * len(names))})", names,
+        ).fetchall())
+        return tuple(rows.get(name, 0) for name in names)
+
+    def _touch(self, scope_key: str, question: str) -> None:
+        self._conn.execute(
+            "UPDATE answers SET last_used = ? WHERE scope = ? AND question = ?", (time.time(), scope_key, question),
+        )
+
+    def get(self, scope: Scope, question: str) -> Optional[Dict[str, Any]]:
+        key = (self._scope_key(scope), normalize_question(question))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM answers WHERE scope = ? AND question = ? AND expires >= ?", (*key, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(*key)
+            self._stats["exact_hits"] += 1
+            return json.loads(row[0])
+
+    def get_similar(self, scope: Scope, vector: List[float]) -> Optional[Dict[str, Any]]:
+        if not self.semantic:
+            return None
+        scope_key = self._scope_key(scope)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT question, vector FROM answers WHERE scope = ? AND vector IS NOT NULL AND expires >= ?",
+                (scope_key, time.time()),
+            ).fetchall()
+            if not rows:
+                return None
+            q = np.asarray(vector, dtype=np.float32)
+            q /= (np.linalg.norm(q) or 1.0)
+            sims = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows]) @ q
+            best = int(np.argmax(sims))
+            if sims[best] < self.semantic_threshold:
+                return None
+            row = self._conn.execute(
+                "SELECT value FROM answers WHERE scope = ? AND question = ?", (scope_key, rows[best][0]),
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(scope_key, rows[best][0])
+            self._stats["semantic_hits"] += 1
+            return json.loads(row[0])
+
+    def miss(self) -> None:
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def generation(self, scope: Scope) -> Tuple[int, ...]:
+        with self._lock:
+            return self._generation(scope)
+
+    def put(
+        self,
+        scope: Scope,
+        question: str,
+        value: Dict[str, Any],
+        vector: Optional[List[float]] = None,
+        generation: Optional[Tuple[int, ...]] = None,
+    ) -> None:
+        blob = None
+        if vector is not None and self.semantic:
+            vec = np.asarray(vector, dtype=np.float32)
+            blob = (vec / (np.linalg.norm(vec) or 1.0)).tobytes()
+        text = json.dumps(value, default=str)
+        size = len(text) + (len(blob) if blob else 0)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            with transaction(self._conn, immediate=True):
+                # Checked in the same transaction as the insert, so no invalidate can slip in between.
+                if generation is not None and generation != self._generation(scope):
+                    self._stats["stale_puts"] += 1
+                    return
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self._scope_key(scope), normalize_question(question), scope[0], text, blob, size, now + self.ttl, now),
+                )
+                self._conn.execute("DELETE FROM answers WHERE expires < ?", (now,))
+                entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+                evicted = 0
+                if entries > self.max_entries or total > self.max_bytes:
+                    for rowid, row_size in self._conn.execute("SELECT rowid, size FROM answers ORDER BY last_used").fetchall():
+                        if entries <= self.max_entries and total <= self.max_bytes:
+                            break
+                        self._conn.execute("DELETE FROM answers WHERE rowid = ?", (rowid,))
+                        entries -= 1
+                        total -= row_size
+                        evicted += 1
+            self._stats["evictions"] += evicted
+
+    def invalidate(self, collection: str) -> int:
+        with self._lock:
+            with transaction(self._conn, immediate=True):
+                self._conn.execute(
+                    "INSERT INTO generations VALUES (?, 1) ON CONFLICT (collection) DO UPDATE SET value = value + 1",
+                    (collection,),
+                )
+                dropped = self._conn.execute(
+                    "DELETE FROM answers WHERE instr(',' || collection || ',', ',' || ? || ',') > 0", (collection,),
+                ).rowcount
+            self._stats["invalidations"] += dropped
+            return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+            lookups = self._stats["exact_hits"] + self._stats["semantic_hits"] + self._stats["misses"]
+            hits = lookups - self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "entries": entries,
+                "bytes": total,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "semantic_threshold": self.semantic_threshold,
+                "path": self.path,
+            }
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+from .sqlite_util import transaction
+
+_RUN_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+def parse_questions(spec: Sequence[Any], max_questions: int = 0) -> List[Dict[str, str]]:
+    """Questions of a batch: strings, or objects with ``question`` and an optional ``id`` (default: the index).
+
+    Raises ValueError for a malformed entry or a repeated id.
+    """
+    if not isinstance(spec, (list, tuple)) or not spec:
+        raise ValueError("'questions' must be a non-empty list.")
+    if max_questions and len(spec) > max_questions:
+        raise ValueError(f"At most {max_questions} questions can be sent in one batch.")
+    questions: List[Dict[str, str]] = []
+    for i, item in enumerate(spec):
+        if isinstance(item, str):
+            item = {"question": item}
+        if not isinstance(item, dict) or not isinstance(item.get("question"), str) or not item["question"].strip():
+            raise ValueError(f"Entry {i} of 'questions' must be a question or an object with a 'question'.")
+        questions.append({"id": str(item.get("id", i)), "question": item["question"]})
+    ids = [q["id"] for q in questions]
+    if len(set(ids)) != len(ids):
+        raise ValueError("'questions' repeats an id.")
+    return questions
+
+def chunk_key(source: Dict[str, Any]) -> str:
+    """Stable id of a source chunk (snippet and metadata), so each one is sent once per batch."""
+    data = json.dumps([source["snippet"], source["metadata"]], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+class BatchRunStore:
+    """Questions and finished answers of batch runs in SQLite.
+
+    A run is created with its full request (questions, collections, k,
+    filter, retrieval settings) and every answer is saved as soon as it is
+    generated, so an interrupted run can be resumed by id, on any worker,
+    without repeating the questions already answered.
+    """
+
+    def __init__(self, path: str, keep_runs: int = 50):
+        self.keep_runs = keep_runs
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs (id TEXT PRIMARY KEY, created REAL NOT NULL, spec TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "run_id TEXT NOT NULL, idx INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (run_id, idx))"
+        )
+        self._lock = threading.Lock()
+
+    def open(self, spec: Optional[Dict[str, Any]], run_id: Optional[str] = None) -> Dict[str, Any]:
+        """The run ``run_id`` (created from ``spec`` if new) as ``{"id", "spec", "results"}``.
+
+        ``results`` maps question index to saved answer. Raises KeyError for an
+        unknown run without a ``spec``, ValueError for a malformed id or a
+        ``spec`` that differs from the stored one.
+        """
+        if run_id is not None and not _RUN_ID_RE.match(run_id):
+            raise ValueError("'run_id' may only use letters, digits, '_', '.' and '-' (at most 64).")
+        run_id = run_id or uuid.uuid4().hex
+        encoded = json.dumps(spec, sort_keys=True, ensure_ascii=False) if spec is not None else None
+        with self._lock, transaction(self._conn, immediate=True):
+            row = self._conn.execute("SELECT spec FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if row is None:
+                if encoded is None:
+                    raise KeyError(run_id)
+                self._conn.execute("INSERT INTO runs VALUES (?, ?, ?)", (run_id, time.time(), encoded))
+                self._conn.execute(
+                    "DELETE FROM runs WHERE id NOT IN (SELECT id FROM runs ORDER BY created DESC LIMIT ?)",
+                    (self.keep_runs,),
+                )
+                self._conn.execute("DELETE FROM results WHERE run_id NOT IN (SELECT id FROM runs)")
+            elif encoded is not None and encoded != row[0]:
+                raise ValueError(f"Run '{run_id}' was started with different questions or settings.")
+            else:
+                encoded = row[0]
+            rows = self._conn.execute("SELECT idx, data FROM results WHERE run_id = ?", (run_id,)).fetchall()
+        return {"id": run_id, "spec": json.loads(encoded), "results": {idx: json.loads(data) for idx, data in rows}}
+
+    def save(self, run_id: str, indices: Sequence[int], result: Dict[str, Any]) -> None:
+        data = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)", [(run_id, i, data) for i in indices],
+            )
+
+    def status(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT created, spec FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            answered = self._conn.execute("SELECT COUNT(*) FROM results WHERE run_id = ?", (run_id,)).fetchone()[0]
+        spec = json.loads(row[1])
+        total = len(spec["questions"])
+        return {
+            "run_id": run_id,
+            "created": row[0],
+            "collection": spec["collection"],
+            "collections": [t["name"] for t in spec["collections"]] if spec["collections"] else None,
+            "total": total,
+            "answered": answered,
+            "pending": total - answered,
+        }
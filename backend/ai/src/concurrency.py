@@ -0,0 +1,58 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from fastapi import HTTPException, Request
+
+T = TypeVar("T")
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+def get_executor() -> ThreadPoolExecutor:
+    """Bounded pool for blocking work (Chroma HTTP calls, PDF parsing, enforce_tex)."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(
+            max_workers=int(os.getenv("AI_BLOCKING_THREADS", "8")),
+            thread_name_prefix="ai-blocking",
+        )
+    return _EXECUTOR
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+async def _cancel_on_disconnect(request: Request, task: asyncio.Task, poll_interval: float) -> None:
+    while not task.done():
+        if await request.is_disconnected():
+            task.cancel()
+            return
+        await asyncio.sleep(poll_interval)
+
+async def run_request(
+    request: Request,
+    coro: Awaitable[T],
+    timeout: Optional[float] = None,
+    poll_interval: float = 0.5,
+) -> T:
+    """Await ``coro`` on behalf of ``request``.
+
+    The work is cancelled when it exceeds ``timeout`` seconds (504) or when the
+    client goes away. Native async calls (Ollama) are aborted immediately;
+    work already handed to the thread pool finishes in the background but its
+    result is discarded.
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, task, poll_interval))
+    try:
+        return await asyncio.wait_for(task, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Request timed out after {timeout:g}s.")
+    except asyncio.CancelledError:
+        if not watcher.done():
+            raise
+        raise HTTPException(status_code=499, detail="Client disconnected.")
+    finally:
+        watcher.cancel()
@@ -0,0 +1,51 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+def select_diverse(
+    query_vector: Sequence[float],
+    candidate_vectors: Sequence[Sequence[float]],
+    k: int,
+    lambda_mult: float = 1.0,
+    dedup_threshold: float = 0.95,
+) -> Tuple[List[int], int]:
+    """Pick up to ``k`` of the ranked candidates by maximal marginal relevance.
+
+    Each step scores all remaining candidates at once as
+    ``lambda * relevance - (1 - lambda) * max_similarity_to_selected``; after
+    a pick, candidates whose cosine similarity to it reaches
+    ``dedup_threshold`` are pruned. With ``lambda_mult=1`` the incoming order
+    is kept and only near-duplicates are dropped.
+
+    Returns (indices in selection order, number of pruned candidates).
+    """
+    n = len(candidate_vectors)
+    if n == 0 or k <= 0:
+        return [], 0
+    cands = _normalize(np.asarray(candidate_vectors, dtype=np.float32))
+    if lambda_mult < 1.0:
+        relevance = cands @ _normalize(np.asarray(query_vector, dtype=np.float32))
+    else:
+        relevance = -np.arange(n, dtype=np.float32)
+    sims = cands @ cands.T
+
+    redundancy = np.full(n, -1.0, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: List[int] = []
+    pruned = 0
+    while len(selected) < k and available.any():
+        penalty = redundancy if selected else 0.0
+        scores = np.where(available, lambda_mult * relevance - (1.0 - lambda_mult) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, sims[:, best])
+        duplicates = available & (redundancy >= dedup_threshold)
+        pruned += int(duplicates.sum())
+        available &= ~duplicates
+    return selected, pruned
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from .sqlite_util import transaction
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(source: str, text: str) -> str:
+    """Deterministic chunk ID: the same text from the same source always maps to the same ID."""
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class DocumentRegistry:
+    """Per-collection map of source file -> chunk IDs, pages and content hashes."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " collection TEXT NOT NULL, source TEXT NOT NULL, file_hash TEXT,"
+            " chunks INTEGER NOT NULL, page_min INTEGER, page_max INTEGER, updated REAL NOT NULL,"
+            " PRIMARY KEY (collection, source));"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " collection TEXT NOT NULL, id TEXT NOT NULL, source TEXT NOT NULL,"
+            " content_hash TEXT NOT NULL, page INTEGER,"
+            " PRIMARY KEY (collection, id));"
+            "CREATE INDEX IF NOT EXISTS chunks_source ON chunks(collection, source);"
+        )
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Lock and write transaction, rolled back if the body raises."""
+        with self._lock, transaction(self._conn):
+            yield
+
+    def file_hash(self, collection: str, source: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_hash FROM documents WHERE collection = ? AND source = ?", (collection, source)
+            ).fetchone()
+        return row[0] if row else None
+
+    def chunk_ids(self, collection: str, source: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM chunks WHERE collection = ? AND source = ?", (collection, source)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def replace(
+        self,
+        collection: str,
+        source: str,
+        digest: Optional[str],
+        chunks: Iterable[Tuple[str, str, Optional[int]]],
+    ) -> None:
+        """Record ``chunks`` as (id, content_hash, page) rows of ``source``, replacing the old ones."""
+        rows = [(collection, cid, source, h, page) for cid, h, page in chunks]
+        pages = [r[4] for r in rows if r[4] is not None]
+        with self._transaction():
+            self._conn.execute("DELETE FROM chunks WHERE collection = ? AND source = ?", (collection, source))
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (collection, source, digest, len(rows), min(pages, default=None), max(pages, default=None), time.time()),
+            )
+
+    def remove(self, collection: str, sources: List[str]) -> List[str]:
+        """Forget ``sources`` and return the chunk IDs they owned."""
+        ids: List[str] = []
+        with self._transaction():
+            for source in sources:
+                ids += [r[0] for r in self._conn.execute(
+                    "SELECT id FROM chunks WHERE collection = ? AND source = ?", (collection, source)
+                )]
+                self._conn.execute("DELETE FROM chunks WHERE collection = ? AND source = ?", (collection, source))
+                self._conn.execute("DELETE FROM documents WHERE collection = ? AND source = ?", (collection, source))
+        return ids
+
+    def forget_chunks(self, collection: str, ids: List[str]) -> None:
+        """Drop individual chunk rows (after a delete by ID) and refresh the owning documents."""
+        with self._transaction():
+            sources = set()
+            for cid in ids:
+                row = self._conn.execute(
+                    "SELECT source FROM chunks WHERE collection = ? AND id = ?", (collection, cid)
+                ).fetchone()
+                if row:
+                    sources.add(row[0])
+                    self._conn.execute("DELETE FROM chunks WHERE collection = ? AND id = ?", (collection, cid))
+            for source in sources:
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM chunks WHERE collection = ? AND source = ?", (collection, source)
+                ).fetchone()[0]
+                if count:
+                    self._conn.execute(
+                        "UPDATE documents SET chunks = ?, file_hash = NULL WHERE collection = ? AND source = ?",
+                        (count, collection, source),
+                    )
+                else:
+                    self._conn.execute("DELETE FROM documents WHERE collection = ? AND source = ?", (collection, source))
+
+    def drop_collection(self, collection: str) -> None:
+        with self._transaction():
+            self._conn.execute("DELETE FROM chunks WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM documents WHERE collection = ?", (collection,))
+
+    def documents(self, collection: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, file_hash, chunks, page_min, page_max, updated FROM documents"
+                " WHERE collection = ? ORDER BY source", (collection,)
+            ).fetchall()
+        return [
+            {"source": r[0], "file_hash": r[1], "chunks": r[2], "page_min": r[3], "page_max": r[4], "updated": r[5]}
+            for r in rows
+        ]
+
+class SourceSync:
+    """Diffs a (re-)ingested source against the registry, one batch of chunks at a time.
+
+    ``assign`` gives every chunk its deterministic ID and splits it into
+    chunks the store does not have yet and chunks it already holds. Once all
+    chunks were assigned, ``removed`` lists the IDs that disappeared from the
+    source and ``commit`` records the new chunk set.
+    """
+
+    def __init__(self, registry: DocumentRegistry, collection: str, source: str):
+        self.registry = registry
+        self.collection = collection
+        self.source = source
+        self.existing = set(registry.chunk_ids(collection, source))
+        self.seen: Dict[str, Tuple[str, Optional[int]]] = {}
+
+    def assign(self, docs: List[Document]) -> Tuple[List[Document], List[Document]]:
+        """Return (new, kept) chunks; duplicates within the source are dropped."""
+        new, kept = [], []
+        for d in docs:
+            cid = chunk_id(self.source, d.page_content)
+            if cid in self.seen:
+                continue
+            d.id = cid
+            self.seen[cid] = (content_hash(d.page_content), (d.metadata or {}).get("page"))
+            (kept if cid in self.existing else new).append(d)
+        return new, kept
+
+    def removed(self) -> List[str]:
+        return sorted(self.existing - set(self.seen))
+
+    def added(self) -> List[str]:
+        return sorted(set(self.seen) - self.existing)
+
+    def commit(self, digest: Optional[str]) -> None:
+        self.registry.replace(
+            self.collection, self.source, digest,
+            ((cid, h, page) for cid, (h, page) in self.seen.items()),
+        )
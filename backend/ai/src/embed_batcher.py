@@ -0,0 +1,93 @@
+import asyncio
+import time
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from .metrics import Histogram
+
+_Pending = Tuple[str, asyncio.Future, float]
+
+class EmbeddingBatcher:
+    """Merges concurrent ``aembed_query`` calls into one ``aembed_documents`` call.
+
+    The first query opens a window of ``window_ms``; everything that arrives
+    before it closes, up to ``max_batch`` texts, is embedded in one request and
+    each caller gets its own vector back. A full batch is sent right away.
+    With ``slot``, each merged call holds one ``slot()`` while it runs.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch: int = 32,
+        window_ms: float = 5.0,
+        slot: Optional[Callable[[], AsyncContextManager[Any]]] = None,
+    ):
+        self.embeddings = embeddings
+        self.slot = slot
+        self.max_batch = max(max_batch, 1)
+        self.window = window_ms / 1000.0
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+        self.queue_wait_ms = Histogram([0.5, 1, 2, 5, 10, 25, 50, 100])
+        self.embed_ms = Histogram([5, 10, 25, 50, 100, 250, 500, 1000, 2500])
+
+    async def embed_query(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            # Keep a reference so the task isn't garbage-collected mid-flight.
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[_Pending]) -> None:
+        started = time.perf_counter()
+        for _, _, queued in batch:
+            self.queue_wait_ms.observe((started - queued) * 1000.0)
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self.batch_sizes.observe(len(texts))
+        try:
+            vectors = dict(zip(texts, await self._embed(texts)))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.embed_ms.observe((time.perf_counter() - started) * 1000.0)
+        for text, future, _ in batch:
+            # A caller that was cancelled (timeout, disconnect) no longer waits.
+            if not future.done():
+                future.set_result(vectors[text])
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        if self.slot is None:
+            return await self.embeddings.aembed_documents(texts)
+        async with self.slot():
+            return await self.embeddings.aembed_documents(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "window_ms": self.window * 1000.0,
+            "pending": len(self._pending),
+            "batch_size": self.batch_sizes.to_dict(),
+            "queue_wait_ms": self.queue_wait_ms.to_dict(),
+            "embed_ms": self.embed_ms.to_dict(),
+        }
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .concurrency import run_blocking
+from .sqlite_util import transaction
+
+_SQL_BATCH = 500
+
+def embedding_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+class EmbeddingStore:
+    """Content-addressed float32 vectors in a SQLite file, bounded by ``max_entries``.
+
+    Least recently used rows are evicted in batches once the bound is exceeded.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._lock = threading.Lock()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.evictions = 0
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, List[float]]:
+        found: Dict[bytes, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = list(keys[i:i + _SQL_BATCH])
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})", [now, *batch]
+                    )
+        return found
+
+    def put_many(self, items: Dict[bytes, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes(), now) for key, vec in items.items()]
+        with self._lock:
+            with transaction(self._conn):
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._count > self.max_entries:
+                # Evict a little more than needed so we don't evict on every insert.
+                excess = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self._count -= excess
+                self.evictions += excess
+
+    def __len__(self) -> int:
+        return self._count
+
+class CachedEmbeddings(Embeddings):
+    """Transparent persistent cache under ``embed_documents`` / ``embed_query``.
+
+    Only texts whose (model, text) hash is unknown are sent to ``inner``, so
+    re-ingesting a revised document pays only for the changed chunks.
+    """
+
+    def __init__(self, inner: Embeddings, model: str, store: EmbeddingStore):
+        self.inner = inner
+        self.model = model
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, texts: List[str]):
+        keys = [embedding_key(self.model, t) for t in texts]
+        found = self.store.get_many(list(dict.fromkeys(keys)))
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+        return keys, found, missing
+
+    @staticmethod
+    def _merge(keys: List[bytes], found: Dict[bytes, List[float]], missing_keys: List[bytes], vectors) -> List[List[float]]:
+        fresh = dict(zip(missing_keys, vectors))
+        return [found[key] if key in found else fresh[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        vectors: List[List[float]] = []
+        if missing:
+            vectors = self.inner.embed_documents(list(missing.values()))
+            self.store.put_many(dict(zip(missing, vectors)))
+        return self._merge(keys, found, list(missing), vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = await run_blocking(self._lookup, texts)
+        vectors: List[List[float]] = []
+        if missing:
+            vectors = await self.inner.aembed_documents(list(missing.values()))
+            await run_blocking(self.store.put_many, dict(zip(missing, vectors)))
+        return self._merge(keys, found, list(missing), vectors)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.store),
+            "max_entries": self.store.max_entries,
+            "evictions": self.store.evictions,
+            "path": self.store.path,
+        }
@@ -0,0 +1,71 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+class Target:
+    """One collection of a fan-out query, with its own candidate count and filter."""
+
+    def __init__(self, name: str, k: int, metadata_filter: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.k = k
+        self.metadata_filter = metadata_filter
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "k": self.k, "filter": self.metadata_filter}
+
+def parse_targets(
+    spec: Sequence[Any],
+    k: int,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    max_targets: int = 0,
+) -> List[Target]:
+    """Targets from a request's ``collections``: names, or objects with ``name`` and optional ``k``/``filter``.
+
+    ``k`` and ``metadata_filter`` are the defaults for entries that don't set
+    their own. Raises ValueError for a malformed or duplicate entry.
+    """
+    if not isinstance(spec, (list, tuple)) or not spec:
+        raise ValueError("'collections' must be a non-empty list.")
+    if max_targets and len(spec) > max_targets:
+        raise ValueError(f"At most {max_targets} collections can be searched at once.")
+    targets: List[Target] = []
+    for item in spec:
+        if isinstance(item, str):
+            item = {"name": item}
+        if not isinstance(item, dict) or not isinstance(item.get("name"), str) or not item["name"]:
+            raise ValueError("Each entry of 'collections' must be a name or an object with a 'name'.")
+        target_k = int(item["k"]) if item.get("k") is not None else k
+        if target_k < 1:
+            raise ValueError(f"'k' of collection '{item['name']}' must be positive.")
+        targets.append(Target(item["name"], target_k, item.get("filter", metadata_filter)))
+    names = [t.name for t in targets]
+    if len(set(names)) != len(names):
+        raise ValueError("'collections' lists a collection twice.")
+    return targets
+
+def cosine_scores(query_vector: Sequence[float], vectors: Sequence[Sequence[float]]) -> List[float]:
+    if not len(vectors):
+        return []
+    m = np.asarray(vectors, dtype=np.float32)
+    q = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1) * (np.linalg.norm(q) or 1.0)
+    norms[norms == 0] = 1.0
+    return ((m @ q) / norms).tolist()
+
+def rank_scores(n: int) -> List[float]:
+    """Scores for a ranking without comparable raw scores: 1.0 for the first hit down to 1/n for the last."""
+    return [(n - i) / n for i in range(n)]
+
+def merge_hits(hits: Sequence[Tuple[str, List[Document], List[float]]], k: int) -> List[Tuple[str, Document, float]]:
+    """Single top-``k`` over every collection's (name, docs, scores), best score first.
+
+    Ties keep the order of ``hits``, then each collection's own order.
+    """
+    merged = [
+        (score, i, j, name, doc)
+        for i, (name, docs, scores) in enumerate(hits)
+        for j, (doc, score) in enumerate(zip(docs, scores))
+    ]
+    merged.sort(key=lambda hit: (-hit[0], hit[1], hit[2]))
+    return [(name, doc, score) for score, _, _, name, doc in merged[:k]]
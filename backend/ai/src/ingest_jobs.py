@@ -0,0 +1,352 @@
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .doc_registry import DocumentRegistry, SourceSync, file_hash
+
+_DONE = object()
+
+class FileProgress:
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.status = "queued"
+        self.pages = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.upserted = 0
+        self.error: Optional[str] = None
+        self.kept = 0
+        self.removed = 0
+        self.digest: Optional[str] = None
+        self.sync: Optional[SourceSync] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "embedded": self.embedded,
+            "upserted": self.upserted,
+            "kept": self.kept,
+            "removed": self.removed,
+            "error": self.error,
+        }
+
+class IngestJob:
+    def __init__(self, collection: str, files: List[FileProgress], workdir: str, metadata: Optional[Dict[str, Any]]):
+        self.id = uuid.uuid4().hex
+        self.collection = collection
+        self.files = files
+        self.workdir = workdir
+        self.metadata = metadata
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0.0
+        pages = sum(f.pages for f in self.files)
+        upserted = sum(f.upserted for f in self.files)
+        return {
+            "id": self.id,
+            "collection": self.collection,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed_s": round(elapsed, 3),
+            "pages": pages,
+            "chunks": sum(f.chunks for f in self.files),
+            "upserted": upserted,
+            "pages_per_s": round(pages / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_s": round(upserted / elapsed, 2) if elapsed else 0.0,
+            "files": [f.to_dict() for f in self.files],
+        }
+
+class JobStore:
+    """Snapshots of job status in SQLite, so any worker process can answer ``GET /jobs/{id}``."""
+
+    def __init__(self, path: str, keep_jobs: int = 100):
+        self.keep_jobs = keep_jobs
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, created REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def save(self, job: IngestJob) -> None:
+        data = json.dumps(job.to_dict())
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)", (job.id, job.created, data))
+
+    def prune(self) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE id NOT IN (SELECT id FROM jobs ORDER BY created DESC LIMIT ?)",
+                (self.keep_jobs,),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM jobs ORDER BY created").fetchall()
+        return [json.loads(data) for data, in rows]
+
+class IngestJobManager:
+    """Runs bulk PDF ingestion in the background as a three-stage pipeline.
+
+    A parser thread turns pages into chunks and groups them into batches of
+    ``batch_size``; an embedder thread embeds each batch; the calling worker
+    upserts embedded batches into the store. Stages are connected by queues
+    of ``queue_size`` batches, so they overlap while memory stays bounded.
+
+    Files are diffed against the document registry: unchanged files are
+    skipped, only chunks the store does not hold yet are embedded, and chunks
+    that disappeared from a file are deleted once the file is done.
+
+    With a ``store``, job status is also written there on every state change
+    and batch, so workers other than the one running a job can report it.
+    """
+
+    def __init__(
+        self,
+        iter_pages: Callable[[str], Iterable[Document]],
+        embed: Callable[[str, List[str]], List[List[float]]],
+        upsert: Callable[[str, List[Document], List[List[float]], List[Document]], None],
+        delete: Callable[[str, List[str]], None],
+        registry: DocumentRegistry,
+        on_change: Callable[[str], None],
+        batch_size: int = 64,
+        queue_size: int = 4,
+        max_jobs: int = 2,
+        keep_jobs: int = 100,
+        store: Optional[JobStore] = None,
+    ):
+        self.iter_pages = iter_pages
+        self.embed = embed
+        self.upsert = upsert
+        self.delete = delete
+        self.registry = registry
+        self.on_change = on_change
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.keep_jobs = keep_jobs
+        self.store = store
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="ingest-job")
+
+    def submit(
+        self,
+        collection: str,
+        files: List[FileProgress],
+        workdir: str,
+        splitter: RecursiveCharacterTextSplitter,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> IngestJob:
+        job = IngestJob(collection, files, workdir, metadata)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep_jobs:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status in ("queued", "running"):
+                    break
+                self._jobs.popitem(last=False)
+        if self.store is not None:
+            self._save(job)
+            self.store.prune()
+        self._pool.submit(self._run, job, splitter)
+        return job
+
+    def _save(self, job: IngestJob) -> None:
+        if self.store is not None:
+            self.store.save(job)
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job run by this process, or by another one sharing the store."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.store.get(job_id) if self.store is not None else None
+
+    def statuses(self) -> List[Dict[str, Any]]:
+        local = {job.id: job.to_dict() for job in self.list()}
+        if self.store is None:
+            return list(local.values())
+        shared = {d["id"]: d for d in self.store.list()}
+        shared.update(local)
+        return sorted(shared.values(), key=lambda d: d["created"])
+
+    def _parse(self, job: IngestJob, splitter: RecursiveCharacterTextSplitter, out: queue.Queue, stop: threading.Event) -> None:
+        try:
+            for f in job.files:
+                if stop.is_set():
+                    break
+                f.status = "parsing"
+                try:
+                    f.digest = file_hash(f.path)
+                    if self.registry.file_hash(job.collection, f.name) == f.digest:
+                        f.status = "unchanged"
+                        continue
+                    f.sync = SourceSync(self.registry, job.collection, f.name)
+                    new: List[Document] = []
+                    kept: List[Document] = []
+                    for page in self.iter_pages(f.path):
+                        if stop.is_set():
+                            break
+                        f.pages += 1
+                        chunks = splitter.split_documents([page])
+                        for d in chunks:
+                            md = d.metadata or {}
+                            md["source"] = f.name
+                            md.pop("file_path", None)
+                            if job.metadata:
+                                md = {**job.metadata, **md}
+                            d.metadata = md
+                        f.chunks += len(chunks)
+                        page_new, page_kept = f.sync.assign(chunks)
+                        new += page_new
+                        kept += page_kept
+                        if len(new) + len(kept) >= self.batch_size:
+                            out.put((f, new, kept))
+                            new, kept = [], []
+                    if new or kept:
+                        out.put((f, new, kept))
+                    f.status = "embedding"
+                    out.put((f, None, None))
+                except Exception as e:
+                    f.status = "failed"
+                    f.error = str(e)
+                    if f.sync is not None:
+                        # Batches sent before the failure may already be stored; the end marker takes them out.
+                        out.put((f, None, None))
+        finally:
+            out.put(_DONE)
+
+    def _embed(self, job: IngestJob, inbox: queue.Queue, out: queue.Queue, stop: threading.Event) -> None:
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    break
+                f, new, kept = item
+                if new is None or stop.is_set():
+                    out.put((f, None, None, None))
+                    continue
+                vectors = self.embed(job.collection, [d.page_content for d in new]) if new else []
+                f.embedded += len(new)
+                out.put((f, new, vectors, kept))
+        except Exception as e:
+            stop.set()
+            out.put(e)
+        finally:
+            out.put(_DONE)
+
+    def _discard(self, job: IngestJob, f: FileProgress) -> None:
+        """Delete the chunks a failed file added; the registry still lists only its previous ones."""
+        if f.sync is None:
+            return
+        added, f.sync = f.sync.added(), None
+        if added:
+            self.delete(job.collection, added)
+            self.on_change(job.collection)
+
+    def _run(self, job: IngestJob, splitter: RecursiveCharacterTextSplitter) -> None:
+        job.status = "running"
+        job.started = time.time()
+        self._save(job)
+        parsed: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        embedded: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        parser = threading.Thread(target=self._parse, args=(job, splitter, parsed, stop), daemon=True)
+        embedder = threading.Thread(target=self._embed, args=(job, parsed, embedded, stop), daemon=True)
+        parser.start()
+        embedder.start()
+        try:
+            while True:
+                item = embedded.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if stop.is_set():
+                    continue
+                f, new, vectors, kept = item
+                if new is None:
+                    if f.status == "failed":
+                        self._discard(job, f)
+                    else:
+                        removed = f.sync.removed()
+                        if removed:
+                            self.delete(job.collection, removed)
+                        f.sync.commit(f.digest)
+                        f.removed = len(removed)
+                        f.status = "done"
+                        self.on_change(job.collection)
+                    self._save(job)
+                    continue
+                self.upsert(job.collection, new, vectors, kept)
+                f.upserted += len(new)
+                f.kept += len(kept)
+                self.on_change(job.collection)
+                self._save(job)
+            failed = [f for f in job.files if f.status == "failed"]
+            if not failed:
+                job.status = "done"
+            else:
+                job.status = "failed" if len(failed) == len(job.files) else "partial"
+                job.error = f"{len(failed)} of {len(job.files)} files failed."
+        except Exception as e:
+            stop.set()
+            job.status = "failed"
+            job.error = str(e)
+            # Unblock the producers so they can exit.
+            while parser.is_alive() or embedder.is_alive():
+                for q in (parsed, embedded):
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+                time.sleep(0.01)
+            for f in job.files:
+                if f.status == "queued":
+                    f.status = "skipped"
+                elif f.status not in ("done", "unchanged"):
+                    f.status = "failed"
+                    f.error = f.error or str(e)
+                    self._discard(job, f)
+        finally:
+            job.finished = time.time()
+            shutil.rmtree(job.workdir, ignore_errors=True)
+            self._save(job)
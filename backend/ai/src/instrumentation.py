@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from .metrics import SECONDS_BUCKETS, CounterFamily, HistogramFamily
+
+STAGE_SECONDS = HistogramFamily(SECONDS_BUCKETS)
+REQUEST_SECONDS = HistogramFamily(SECONDS_BUCKETS)
+LLM_TOKENS = CounterFamily()
+LLM_TOKENS_PER_SECOND = HistogramFamily([1, 2, 5, 10, 20, 40, 80, 160, 320])
+
+# Stage durations of the current request, for its Server-Timing header.
+_TIMINGS: ContextVar[Optional[Dict[str, float]]] = ContextVar("ai_stage_timings", default=None)
+
+def start_timings() -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    _TIMINGS.set(timings)
+    return timings
+
+def record_stage(op: str, stage: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(op=op, stage=stage).observe(seconds)
+    timings = _TIMINGS.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def stage(op: str, name: str) -> Iterator[None]:
+    """Time a block as stage ``name`` of operation ``op`` (works around ``await`` too)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(op, name, time.perf_counter() - started)
+
+def record_generation(op: str, model: str, metadata: Dict[str, Any]) -> None:
+    """Count tokens from an Ollama response's metadata (``prompt_eval_count``, ``eval_count``, ``eval_duration``)."""
+    prompt_tokens = metadata.get("prompt_eval_count")
+    completion_tokens = metadata.get("eval_count")
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, op=op, model=model, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, op=op, model=model, kind="completion")
+        duration_ns = metadata.get("eval_duration")
+        if duration_ns:
+            LLM_TOKENS_PER_SECOND.labels(op=op, model=model).observe(completion_tokens / (duration_ns / 1e9))
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    entries = [f"{name};dur={seconds * 1000.0:.1f}" for name, seconds in timings.items()]
+    return ", ".join(entries + [f"total;dur={total * 1000.0:.1f}"])
+
+class SamplingProfiler:
+    """Samples the Python stack of every thread while a recording is open.
+
+    One background thread serves all open recordings, and each sample is
+    added to every one of them. Stacks are stored in the folded format
+    (``thread;outer;inner count``) that flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval = interval_s
+        self._recordings: List[Counter] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> Counter:
+        recording: Counter = Counter()
+        with self._lock:
+            self._recordings.append(recording)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ai-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return recording
+
+    def stop(self, recording: Counter) -> None:
+        with self._lock:
+            self._recordings = [r for r in self._recordings if r is not recording]
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                active = list(self._recordings)
+                if not active:
+                    self._wake.clear()
+            if not active:
+                self._wake.wait()
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                folded = ";".join([names.get(ident, str(ident)), *reversed(stack)])
+                for recording in active:
+                    recording[folded] += 1
+            time.sleep(self.interval)
+
+    @staticmethod
+    def dump(recording: Counter, directory: str, name: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in recording.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
@@ -1,62 +1,107 @@
 import re
 import unicodedata
+from bisect import bisect_right
 
+# ``.*?`` under re.S matches exactly what the former ``(?:.|\n)*?`` did, without
+# the exponential backtracking that alternation caused on an unclosed opener
+# followed by many newlines.
 MATH_BLOCK_RE = re.compile(
-    r"(\\\((?:.|\n)*?\\\))"
+    r"(\\\(.*?\\\))"
     r"|"
-    r"(\\\[(?:.|\n)*?\\\])"
+    r"(\\\[.*?\\\])"
     r"|"
-    r"(\$\$(?:.|\n)*?\$\$)"
+    r"(\$\$.*?\$\$)"
     r"|"
-    r"(\$(?:.|\n)*?\$)",
+    r"(\$.*?\$)",
     re.S,
 )
 
+MATH_ENVS = (
+    r"align\*?|equation\*?|gather\*?|multline\*?|aligned|split|cases|"
+    r"pmatrix|bmatrix|matrix|vmatrix|Vmatrix|smallmatrix|array"
+)
+
 ENV_BLOCK_RE = re.compile(
-    r"\\begin\{(?P<env>align\*?|equation\*?|gather\*?|multline\*?|aligned|split|cases|"
-    r"pmatrix|bmatrix|matrix|vmatrix|Vmatrix|smallmatrix|array)\}"
-    r"(?P<body>(?:.|\n)*?)"
+    r"\\begin\{(?P<env>" + MATH_ENVS + r")\}"
+    r"(?P<body>.*?)"
     r"\\end\{(?P=env)\}",
     re.S,
 )
 
 CMD_RE = re.compile(r"\\[A-Za-z]+(?:\s*\{[^{}]*\}|[A-Za-z])?")
 
-def _inside_any(span_list, idx: int) -> bool:
-    for a, b in span_list:
-        if a <= idx < b:
-            return True
-    return False
-
-def _line_intersects_spans(spans, start: int, end: int) -> bool:
-    for a, b in spans:
-        if start < b and end > a:
-            return True
-    return False
-
-def _all_math_spans(s: str):
-    spans = [(m.start(), m.end()) for m in MATH_BLOCK_RE.finditer(s)]
-    spans += [(m.start(), m.end()) for m in ENV_BLOCK_RE.finditer(s)]
-    return spans
+class SpanIndex:
+    """Math regions of one text, merged and sorted for O(log n) lookups.
+
+    Built once per pass by segmenting the text into math and prose; replaces
+    the linear scans over the raw span list for every regex match.
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, spans):
+        starts, ends = [], []
+        for a, b in sorted(spans):
+            if ends and a <= ends[-1]:
+                if b > ends[-1]:
+                    ends[-1] = b
+            else:
+                starts.append(a)
+                ends.append(b)
+        self.starts = starts
+        self.ends = ends
+
+    def __bool__(self) -> bool:
+        return bool(self.starts)
+
+    def contains(self, idx: int) -> bool:
+        i = bisect_right(self.starts, idx) - 1
+        return i >= 0 and idx < self.ends[i]
+
+    def intersects(self, start: int, end: int) -> bool:
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+def _all_math_spans(s: str) -> SpanIndex:
+    spans = []
+    if "\\" in s or "$" in s:
+        spans = [m.span() for m in MATH_BLOCK_RE.finditer(s)]
+        if "\\begin{" in s:
+            spans += [m.span() for m in ENV_BLOCK_RE.finditer(s)]
+    return SpanIndex(spans)
+
+DISPLAY_DOLLARS_RE = re.compile(r"\$\$(.*?)\$\$", re.S)
+DOUBLE_ESCAPED_CMD_RE = re.compile(r"\\\\([A-Za-z])")
+DOUBLE_ESCAPED_DELIM_RE = re.compile(r"\\\\([()\[\]])")
+BOLDSYMBOL_RE = re.compile(r"\\boldsymbol\s*\{?\s*([A-Za-z])\s*\}?")
+MATHBF_RE = re.compile(r"\\mathbf\s*\{?\s*([A-Za-z])\s*\}?")
+VEC_SPACE_RE = re.compile(r"\\vec\s+([A-Za-z])")
+DELIMITER_TOKENS = (r"\(", r"\)", r"\[", r"\]")
 
 def normalize_latex_core(s: str) -> str:
-    s = re.sub(r"\$\$(.*?)\$\$", r"\\[\1\\]", s, flags=re.S)
+    if "$$" in s:
+        s = DISPLAY_DOLLARS_RE.sub(r"\\[\1\\]", s)
+    if "\\" not in s:
+        return s
 
-    s = re.sub(r"\\\\([A-Za-z])", r"\\\1", s)
-    s = re.sub(r"\\\\([()\[\]])", r"\\\1", s)
+    s = DOUBLE_ESCAPED_CMD_RE.sub(r"\\\1", s)
+    s = DOUBLE_ESCAPED_DELIM_RE.sub(r"\\\1", s)
 
-    s = re.sub(r"\\boldsymbol\s*\{?\s*([A-Za-z])\s*\}?", r"\\vec{\1}", s)
-    s = re.sub(r"\\mathbf\s*\{?\s*([A-Za-z])\s*\}?", r"\\vec{\1}", s)
-    s = re.sub(r"\\vec\s+([A-Za-z])", r"\\vec{\1}", s)
+    if "\\boldsymbol" in s:
+        s = BOLDSYMBOL_RE.sub(r"\\vec{\1}", s)
+    if "\\mathbf" in s:
+        s = MATHBF_RE.sub(r"\\vec{\1}", s)
+    if "\\vec" in s:
+        s = VEC_SPACE_RE.sub(r"\\vec{\1}", s)
 
     spans = _all_math_spans(s)
     out, last = [], 0
     for m in CMD_RE.finditer(s):
         i = m.start()
         token = m.group()
-        if _inside_any(spans, i):
+        if spans.contains(i):
             continue
-        if token in (r"\(", r"\)", r"\[", r"\]"):
+        if token in DELIMITER_TOKENS:
             continue
         out.append(s[last:i])
         out.append(r"\(" + token + r"\)")
@@ -87,37 +132,70 @@ UNICODE_TO_TEX = {
 UNICODE_RE = re.compile("|".join(map(re.escape, UNICODE_TO_TEX.keys())))
 
 def unicode_to_latex(text: str) -> str:
+    if text.isascii():
+        return text
     return UNICODE_RE.sub(lambda m: UNICODE_TO_TEX[m.group(0)], text)
 
 SINGLE_DOLLAR_INLINE_RE = re.compile(r"(?<!\$)\$(?!\$)(.*?)(?<!\$)\$(?!\$)", re.S)
 
 def convert_single_dollar_inline(s: str) -> str:
+    if "$" not in s:
+        return s
     return SINGLE_DOLLAR_INLINE_RE.sub(r"\\(\1\\)", s)
 
+SUPERSCRIPT_RE = re.compile(r"\^([A-Za-z0-9])")
+SUBSCRIPT_RE = re.compile(r"_([A-Za-z0-9])")
+
 def _brace_simple_exponents_and_subscripts(block: str) -> str:
-    block = re.sub(r"\^([A-Za-z0-9])", r"^{\1}", block)
-    block = re.sub(r"_([A-Za-z0-9])", r"_{\1}", block)
+    if "^" in block:
+        block = SUPERSCRIPT_RE.sub(r"^{\1}", block)
+    if "_" in block:
+        block = SUBSCRIPT_RE.sub(r"_{\1}", block)
     return block
 
+SUM_UPPER_FIRST_RE = re.compile(r"(\b\w+)\s*\\sum\s*([A-Za-z])\s*=\s*([-\w]+)")
+PROD_UPPER_FIRST_RE = re.compile(r"(\b\w+)\s*\\prod\s*([A-Za-z])\s*=\s*([-\w]+)")
+SUM_RANGE_RE = re.compile(r"\\sum\s*([A-Za-z])\s*=\s*([-\w]+)\s*\^\s*([-\w]+)")
+PROD_RANGE_RE = re.compile(r"\\prod\s*([A-Za-z])\s*=\s*([-\w]+)\s*\^\s*([-\w]+)")
+
 def _fix_sum_prod_ranges(block: str) -> str:
-    block = re.sub(r"(\b\w+)\s*\\sum\s*([A-Za-z])\s*=\s*([-\w]+)", r"\\sum_{\2=\3}^{\1}", block)
-    block = re.sub(r"(\b\w+)\s*\\prod\s*([A-Za-z])\s*=\s*([-\w]+)", r"\\prod_{\2=\3}^{\1}", block)
-    block = re.sub(r"\\sum\s*([A-Za-z])\s*=\s*([-\w]+)\s*\^\s*([-\w]+)", r"\\sum_{\1=\2}^{\3}", block)
-    block = re.sub(r"\\prod\s*([A-Za-z])\s*=\s*([-\w]+)\s*\^\s*([-\w]+)", r"\\prod_{\1=\2}^{\3}", block)
+    if "\\sum" in block:
+        block = SUM_UPPER_FIRST_RE.sub(r"\\sum_{\2=\3}^{\1}", block)
+    if "\\prod" in block:
+        block = PROD_UPPER_FIRST_RE.sub(r"\\prod_{\2=\3}^{\1}", block)
+    if "\\sum" in block:
+        block = SUM_RANGE_RE.sub(r"\\sum_{\1=\2}^{\3}", block)
+    if "\\prod" in block:
+        block = PROD_RANGE_RE.sub(r"\\prod_{\1=\2}^{\3}", block)
     return block
 
+MINUS_ONE_PLUS_RE = re.compile(r"\(-1\)\s*([A-Za-z])\s*\+\s*([0-9]+)")
+MINUS_ONE_CARET_PLUS_RE = re.compile(r"\(-1\)\s*\^\s*([A-Za-z])\s*\+\s*([0-9]+)")
+MINUS_ONE_LETTER_RE = re.compile(r"\(-1\)\s*([A-Za-z])")
+
 def _fix_minus_one_power(block: str) -> str:
-    block = re.sub(r"\(-1\)\s*([A-Za-z])\s*\+\s*([0-9]+)", r"(-1)^{\1+\2}", block)
-    block = re.sub(r"\(-1\)\s*\^\s*([A-Za-z])\s*\+\s*([0-9]+)", r"(-1)^{\1+\2}", block)
-    block = re.sub(r"\(-1\)\s*([A-Za-z])", r"(-1)^{\1}", block)
+    if "(-1)" not in block:
+        return block
+    block = MINUS_ONE_PLUS_RE.sub(r"(-1)^{\1+\2}", block)
+    block = MINUS_ONE_CARET_PLUS_RE.sub(r"(-1)^{\1+\2}", block)
+    block = MINUS_ONE_LETTER_RE.sub(r"(-1)^{\1}", block)
     return block
 
+MINOR_SPACED_RE = re.compile(r"\b([Aa])\s*([a-z])\s*(\d+)\b")
+MINOR_RE = re.compile(r"\b([Aa])([a-z])(\d+)\b")
+BARE_DET_RE = re.compile(r"(?<!\\)\bdet\b")
+L_SPACED_N_RE = re.compile(r"\bL\s*n\s*(?=\()")
+LN_RE = re.compile(r"\bLn(?=\()")
+
 def _fix_matrix_minors_and_symbols(block: str) -> str:
-    block = re.sub(r"\b([Aa])\s*([a-z])\s*(\d+)\b", r"\1_{\2\3}", block)
-    block = re.sub(r"\b([Aa])([a-z])(\d+)\b", r"\1_{\2\3}", block)
-    block = re.sub(r"(?<!\\)\bdet\b", r"\\det", block)
-    block = re.sub(r"\bL\s*n\s*(?=\()", r"L_n", block)
-    block = re.sub(r"\bLn(?=\()", r"L_n", block)
+    if "a" in block or "A" in block:
+        block = MINOR_SPACED_RE.sub(r"\1_{\2\3}", block)
+        block = MINOR_RE.sub(r"\1_{\2\3}", block)
+    if "det" in block:
+        block = BARE_DET_RE.sub(r"\\det", block)
+    if "L" in block:
+        block = L_SPACED_N_RE.sub(r"L_n", block)
+        block = LN_RE.sub(r"L_n", block)
     return block
 
 ENGLISH_TO_TEX_IN_MATH = {
@@ -133,45 +211,66 @@ ENGLISH_TO_TEX_IN_MATH = {
 }
 ENGLISH_WORD_RE = re.compile(r"\b([A-Za-z]+)\b")
 
+def _english_word_to_tex(m: re.Match) -> str:
+    w = m.group(1)
+    if w == "sgn":
+        return r"\operatorname{sgn}"
+    return ENGLISH_TO_TEX_IN_MATH.get(w, w)
+
 def _english_to_tex_inside_math(block: str) -> str:
-    def repl(m: re.Match) -> str:
-        w = m.group(1)
-        if w == "sgn":
-            return r"\operatorname{sgn}"
-        return ENGLISH_TO_TEX_IN_MATH.get(w, w)
-    return ENGLISH_WORD_RE.sub(repl, block)
+    return ENGLISH_WORD_RE.sub(_english_word_to_tex, block)
+
+SUM_O_BEFORE_CMD_IN_RE = re.compile(r"(\\sum_\{)\s*o\s*(?=\\in)")
+SUM_O_BEFORE_IN_RE = re.compile(r"(\\sum_\{)\s*o\s*(?=in)")
+SYMMETRIC_GROUP_RE = re.compile(r"(?<=\\in\s)S\s*([A-Za-z])\b")
 
 def _targeted_sigma_in_sum(block: str) -> str:
-    block = re.sub(r"(\\sum_\{)\s*o\s*(?=\\in)", r"\1\\sigma", block)
-    block = re.sub(r"(\\sum_\{)\s*o\s*(?=in)", r"\1\\sigma", block)
-    block = re.sub(r"(?<=\\in\s)S\s*([A-Za-z])\b", r"S_{\1}", block)
+    if "\\sum_{" in block:
+        block = SUM_O_BEFORE_CMD_IN_RE.sub(r"\1\\sigma", block)
+        block = SUM_O_BEFORE_IN_RE.sub(r"\1\\sigma", block)
+    if "\\in" in block:
+        block = SYMMETRIC_GROUP_RE.sub(r"S_{\1}", block)
     return block
 
+ELLIPSIS_RE = re.compile(r"(?<!\.)\.\.\.(?!\.)")
+
 def _fix_ellipsis(block: str) -> str:
-    return re.sub(r"(?<!\.)\.\.\.(?!\.)", r"\\cdots", block)
+    if "..." not in block:
+        return block
+    return ELLIPSIS_RE.sub(r"\\cdots", block)
 
 ASTERISK_BETWEEN_TOKENS_RE = re.compile(r"(?<=\S)\s*\\?\*\s*(?=\S)")
 def _fix_ascii_times(block: str) -> str:
+    if "*" not in block:
+        return block
     return ASTERISK_BETWEEN_TOKENS_RE.sub(r" \\cdot ", block)
 
 PAREN_DIV_RE = re.compile(r"\(\s*([^()]+?)\s*\)\s*/\s*\(\s*([^()]+?)\s*\)")
 BRACK_DIV_RE = re.compile(r"\[\s*([^\[\]]+?)\s*\]\s*/\s*\[\s*([^\[\]]+?)\s*\]")
 
 def _slash_to_frac(block: str) -> str:
-    changed = True
-    while changed:
+    # Each pass rewrites the innermost fractions, which can expose new ones;
+    # a block without "/" can never change.
+    while "/" in block:
         new = PAREN_DIV_RE.sub(r"\\frac{\1}{\2}", block)
         new = BRACK_DIV_RE.sub(r"\\frac{\1}{\2}", new)
-        changed = (new != block)
+        if new == block:
+            break
         block = new
     return block
 
+K_PLUS_I_SIGN_RE = re.compile(r"\(-?1\)\s*\^\s*\{?(?:k\+i|i\+k)\}?")
+BRACED_K1_RE = re.compile(r"([aA])_\{\s*k\s*1\s*\}")
+BRACED_1K_RE = re.compile(r"([aA])_\{\s*1\s*k\s*\}")
+BARE_K1_RE = re.compile(r"([aA])\s*_\s*k1\b")
+BARE_1K_RE = re.compile(r"([aA])\s*_\s*1k\b")
+
 def _align_indices_with_k_plus_i(block: str) -> str:
-    if re.search(r"\(-?1\)\s*\^\s*\{?(?:k\+i|i\+k)\}?", block):
-        block = re.sub(r"([aA])_\{\s*k\s*1\s*\}", r"\1_{ki}", block)
-        block = re.sub(r"([aA])_\{\s*1\s*k\s*\}", r"\1_{ik}", block)
-        block = re.sub(r"([aA])\s*_\s*k1\b", r"\1_{ki}", block)
-        block = re.sub(r"([aA])\s*_\s*1k\b", r"\1_{ik}", block)
+    if "1)" in block and K_PLUS_I_SIGN_RE.search(block):
+        block = BRACED_K1_RE.sub(r"\1_{ki}", block)
+        block = BRACED_1K_RE.sub(r"\1_{ik}", block)
+        block = BARE_K1_RE.sub(r"\1_{ki}", block)
+        block = BARE_1K_RE.sub(r"\1_{ik}", block)
     return block
 
 def _fix_inside_math(block: str) -> str:
@@ -187,18 +286,23 @@ def _fix_inside_math(block: str) -> str:
     block = _fix_ellipsis(block)
     return block
 
+DISPLAY_DELIM_RE = re.compile(r"\\\[|\\\]")
+
+def _repair_inline_display(m: re.Match) -> str:
+    return _fix_inside_math(m.group(0))
+
+def _repair_env(m: re.Match) -> str:
+    env = m.group("env")
+    body = DISPLAY_DELIM_RE.sub("", m.group("body"))
+    body = _fix_inside_math(body)
+    return f"\\begin{{{env}}}{body}\\end{{{env}}}"
+
 def _repair_math_blocks(s: str) -> str:
-    def repl_inline_display(m: re.Match) -> str:
-        return _fix_inside_math(m.group(0))
-    s = MATH_BLOCK_RE.sub(repl_inline_display, s)
-
-    def repl_env(m: re.Match) -> str:
-        env = m.group("env")
-        body = m.group("body")
-        body = re.sub(r"\\\[|\\\]", "", body)
-        body = _fix_inside_math(body)
-        return f"\\begin{{{env}}}{body}\\end{{{env}}}"
-    s = ENV_BLOCK_RE.sub(repl_env, s)
+    if "\\" not in s and "$" not in s:
+        return s
+    s = MATH_BLOCK_RE.sub(_repair_inline_display, s)
+    if "\\begin{" in s:
+        s = ENV_BLOCK_RE.sub(_repair_env, s)
     return s
 
 CMD_ANY_RE = re.compile(
@@ -206,9 +310,13 @@ CMD_ANY_RE = re.compile(
 )
 WORD_RE = re.compile(r"[A-Za-z]{2,}")
 UNICODE_MATH_RE = re.compile(r"[∑∏∫√≤≥≠×·→↦⇔ℝℤℕℚℂ]")
+CMD_WITH_ARG_RE = re.compile(r"\\[A-Za-z]+(\s*\{[^{}]*\})?")
+OPERATOR_SYMBOL_RE = re.compile(r"[+\-*/=^_]")
+LEADING_DET_RE = re.compile(r"^\s*det\b")
+BRACED_INDEX_RE = re.compile(r"_[{].*?[}]|[\^][{].*?[}]")
 
 def _is_prose_heavy(line: str) -> bool:
-    tmp = re.sub(r"\\[A-Za-z]+(\s*\{[^{}]*\})?", " ", line)
+    tmp = CMD_WITH_ARG_RE.sub(" ", line) if "\\" in line else line
     words = WORD_RE.findall(tmp)
     return len(words) >= 8 or sum(len(w) for w in words) >= 30
 
@@ -216,7 +324,7 @@ def _is_formula_like(line: str) -> bool:
     cmd_count = len(CMD_ANY_RE.findall(line))
     uni_count = len(UNICODE_MATH_RE.findall(line))
     has_eq = "=" in line
-    sym_count = len(re.findall(r"[+\-*/=^_]", line))
+    sym_count = len(OPERATOR_SYMBOL_RE.findall(line))
 
     if cmd_count >= 2:
         return True
@@ -224,26 +332,26 @@ def _is_formula_like(line: str) -> bool:
         return True
     if (uni_count >= 1 and has_eq):
         return True
-    if re.search(r"^\s*det\b", line) and (has_eq or sym_count >= 2 or uni_count >= 1):
+    if LEADING_DET_RE.search(line) and (has_eq or sym_count >= 2 or uni_count >= 1):
         return True
     if sym_count >= 4 and cmd_count >= 1:
         return True
-    if len(re.findall(r"_[{].*?[}]|[\^][{].*?[}]", line)) >= 2:
+    if len(BRACED_INDEX_RE.findall(line)) >= 2:
         return True
     return False
 
-def wrap_mathy_lines(s: str) -> str:
+def wrap_mathy_lines(s: str, skip_first: bool = False) -> str:
     spans = _all_math_spans(s)
     out = []
     cursor = 0
     lines = s.splitlines(True)
-    for raw in lines:
+    for i, raw in enumerate(lines):
         line = raw.rstrip("\n")
         start = cursor
         end = cursor + len(raw)
         cursor = end
 
-        if _line_intersects_spans(spans, start, end):
+        if (skip_first and i == 0) or spans.intersects(start, end):
             out.append(raw)
             continue
 
@@ -268,50 +376,55 @@ INLINE_CMD_WHITELIST = {
 }
 
 def inline_wrap_prose_tokens(s: str) -> str:
+    if "\\" not in s:
+        return s
     spans = _all_math_spans(s)
     def repl(m: re.Match) -> str:
         name = m.group(1)
-        i = m.start()
-        if _inside_any(spans, i):
+        if name not in INLINE_CMD_WHITELIST or spans.contains(m.start()):
             return m.group(0)
-        if name in INLINE_CMD_WHITELIST:
-            return r"\(" + m.group(0) + r"\)"
-        return m.group(0)
+        return r"\(" + m.group(0) + r"\)"
     return CMD_FULL_RE.sub(repl, s)
 
-DISPLAY_NESTED_RE = re.compile(r"\\\[\s*(\\\[(?:.|\n)*?\\\])\s*\\\]", re.S)
+DISPLAY_NESTED_RE = re.compile(r"\\\[\s*(\\\[.*?\\\])\s*\\\]", re.S)
 EMPTY_DISPLAY_RE = re.compile(r"\\\[\s*\\\]", re.S)
 BARE_OPEN_RE  = re.compile(r"(?m)^\s*\\\[\s*$")
 BARE_CLOSE_RE = re.compile(r"(?m)^\s*\\\]\s*$")
+EXTRA_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+def _strip_in_env(m: re.Match) -> str:
+    env = m.group("env")
+    body = DISPLAY_DELIM_RE.sub("", m.group("body"))
+    body = EXTRA_BLANK_LINES_RE.sub("\n\n", body)
+    return f"\\begin{{{env}}}{body}\\end{{{env}}}"
 
 def cleanup_displays_and_envs(s: str) -> str:
-    s = EMPTY_DISPLAY_RE.sub("", s)
-    prev = None
-    while prev != s:
-        prev = s
-        s = DISPLAY_NESTED_RE.sub(r"\1", s)
-    s = BARE_OPEN_RE.sub("", s)
-    s = BARE_CLOSE_RE.sub("", s)
-
-    def strip_in_env(m: re.Match) -> str:
-        env = m.group("env")
-        body = m.group("body")
-        body = re.sub(r"\\\[|\\\]", "", body)
-        body = re.sub(r"\n{3,}", "\n\n", body)
-        return f"\\begin{{{env}}}{body}\\end{{{env}}}"
-    s = ENV_BLOCK_RE.sub(strip_in_env, s)
-
-    s = re.sub(r"\n{3,}", "\n\n", s)
+    if "\\[" in s or "\\]" in s:
+        s = EMPTY_DISPLAY_RE.sub("", s)
+        prev = None
+        while prev != s:
+            prev = s
+            s = DISPLAY_NESTED_RE.sub(r"\1", s)
+        s = BARE_OPEN_RE.sub("", s)
+        s = BARE_CLOSE_RE.sub("", s)
+
+    if "\\begin{" in s:
+        s = ENV_BLOCK_RE.sub(_strip_in_env, s)
+
+    if "\n\n\n" in s:
+        s = EXTRA_BLANK_LINES_RE.sub("\n\n", s)
     return s
 
 INDEX_TOKEN_RE = re.compile(r"\b([A-Za-z])\s*([_^])\s*(\{[^{}]+\}|[A-Za-z0-9])")
 
 def wrap_indices_outside_math(s: str) -> str:
+    if "_" not in s and "^" not in s:
+        return s
     spans = _all_math_spans(s)
     out, last = [], 0
     for m in INDEX_TOKEN_RE.finditer(s):
         i = m.start()
-        if _inside_any(spans, i):
+        if spans.contains(i):
             continue
         out.append(s[last:i])
         token = m.group(1) + m.group(2) + m.group(3)
@@ -321,6 +434,9 @@ def wrap_indices_outside_math(s: str) -> str:
     return "".join(out)
 
 def enforce_tex(raw_text: str) -> str:
+    return _enforce_tex(raw_text)
+
+def _enforce_tex(raw_text: str, wrap_first_line: bool = True) -> str:
     txt = unicodedata.normalize("NFC", raw_text)
 
     txt = unicode_to_latex(txt)
@@ -333,7 +449,7 @@ def enforce_tex(raw_text: str) -> str:
 
     txt = cleanup_displays_and_envs(txt)
 
-    txt = wrap_mathy_lines(txt)
+    txt = wrap_mathy_lines(txt, skip_first=not wrap_first_line)
 
     txt = _repair_math_blocks(txt)
 
@@ -342,3 +458,139 @@ def enforce_tex(raw_text: str) -> str:
     txt = inline_wrap_prose_tokens(txt)
 
     return unicodedata.normalize("NFC", txt)
+
+MATH_OPEN_RE = re.compile(r"\\\(|\\\[|\$|\\begin\{(?:" + MATH_ENVS + r")\}")
+STREAM_WORD_BREAK_RE = re.compile(r"\s+(?=\S)")
+# A bare command before a break may take the next word as its argument (``\\mathbf v``).
+STREAM_COMMAND_END_RE = re.compile(r"\\[A-Za-z]+$")
+STREAM_DISPLAY_RE = re.compile(r"\\\[|\\\]|\$\$|\\(?:begin|end)\{")
+
+def _open_math_start(s: str):
+    spans = _all_math_spans(s)
+    for m in MATH_OPEN_RE.finditer(s):
+        if not spans.contains(m.start()):
+            return m.start()
+    return None
+
+def _stream_cut(s: str):
+    """Return (cut, prose_tail) for a partially streamed answer.
+
+    ``s[:cut]`` holds only complete lines with their line breaks (plus, for a
+    line that is already prose-heavy, its complete words) and no unclosed
+    math span, so it can go through enforce_tex on its own and the rest
+    starts at a line start. ``prose_tail`` is True when the cut falls inside
+    such a prose line.
+    """
+    limit = _open_math_start(s)
+    if limit is None:
+        limit = len(s)
+    head = s[:limit]
+    # Newlines inside a closed span (a multi-line \[ .. \] or environment) are not line ends.
+    spans = _all_math_spans(head)
+
+    def line_break(end: int) -> int:
+        """End of the last run of line breaks before ``end`` that is safe to cut at, or 0.
+
+        The run must be complete and outside math. Runs next to a display
+        delimiter are skipped too: the bare-delimiter cleanup absorbs those
+        newlines, so it has to see both sides of them.
+        """
+        nl = head.rfind("\n", 0, end)
+        while nl >= 0:
+            start, stop = nl, nl + 1
+            while start > 0 and head[start - 1] == "\n":
+                start -= 1
+            while stop < len(s) and s[stop] == "\n":
+                stop += 1
+            if not (
+                stop == len(s)
+                or spans.contains(nl)
+                or head[:start].rstrip(" \t").endswith("\\]")
+                or s[stop:].lstrip(" \t").startswith("\\[")
+            ):
+                return stop
+            nl = head.rfind("\n", 0, start)
+        return 0
+
+    cut, line_start = line_break(len(head)), 0
+    nl = head.rfind("\n")
+    while nl >= 0 and spans.contains(nl):
+        nl = head.rfind("\n", 0, nl)
+    if nl >= 0:
+        line_start = nl + 1
+
+    if limit == len(s):
+        tail = head[line_start:]
+        # Display delimiters are cleaned up together with whatever follows
+        # them on the line (nested or doubled ones), so such a line is kept whole.
+        if STREAM_DISPLAY_RE.search(tail):
+            return cut, False
+        breaks = list(STREAM_WORD_BREAK_RE.finditer(tail))
+        for m in reversed(breaks):
+            if (
+                tail[m.end()] in "_^*/="
+                or spans.contains(line_start + m.start())
+                or STREAM_COMMAND_END_RE.search(tail, 0, m.start())
+            ):
+                continue
+            if _is_prose_heavy(tail[:m.start()]):
+                return line_start + m.end(), True
+            break
+    return cut, False
+
+def _trailing_newlines(s: str) -> int:
+    return len(s) - len(s.rstrip("\n"))
+
+def _trim_blank_run(newlines_before: int, text: str) -> str:
+    """Drop leading line breaks of ``text`` that would extend a run begun by ``newlines_before`` beyond two.
+
+    enforce_tex caps runs of blank lines at one; this applies the same cap
+    where two separately processed pieces meet.
+    """
+    lead = len(text) - len(text.lstrip("\n"))
+    excess = newlines_before + lead - 2
+    return text[min(excess, lead):] if excess > 0 else text
+
+class TexStreamer:
+    """Incremental enforce_tex for token streams.
+
+    Tokens are buffered and released as soon as they form closed text: whole
+    lines, or whole words of a line already known to be prose. Anything from
+    the first unclosed ``\\(``, ``\\[``, ``$`` or ``\\begin{..}`` onwards is
+    held back until the span closes or the stream ends.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._started = False
+        self._prose_line = False
+        # Line breaks at the end of the text released so far.
+        self._newlines = 0
+
+    def _emit(self, text: str) -> str:
+        # The rest of a line that was already judged prose must not be
+        # re-judged by wrap_mathy_lines on its own.
+        out = _trim_blank_run(self._newlines, _enforce_tex(text, wrap_first_line=not self._prose_line))
+        if not self._started:
+            out = out.lstrip()
+            self._started = bool(out)
+        self._newlines = self._newlines + len(out) if not out.strip("\n") else _trailing_newlines(out)
+        return out
+
+    def feed(self, token: str) -> str:
+        self._buf += token
+        if not token or not any(c.isspace() for c in token):
+            return ""
+        cut, prose_tail = _stream_cut(self._buf)
+        if cut <= 0:
+            return ""
+        head, self._buf = self._buf[:cut], self._buf[cut:]
+        out = self._emit(head)
+        self._prose_line = prose_tail or (self._prose_line and "\n" not in head)
+        return out
+
+    def flush(self) -> str:
+        head, self._buf = self._buf, ""
+        out = self._emit(head) if head else ""
+        self._prose_line = False
+        return out.rstrip()
@@ -0,0 +1,156 @@
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from .latex_postprocess import unicode_to_latex
+from .sqlite_util import transaction
+
+_SQL_BATCH = 500
+
+# LaTeX commands keep their backslash and case (\det, \Gamma), subscripted
+# symbols keep their index (S_n, a_{ij} -> a_ij), numbers keep their dots so
+# theorem numbers like 3.2.1 stay one token.
+TOKEN_RE = re.compile(
+    r"\\[A-Za-z]+"
+    r"|[A-Za-z][A-Za-z0-9]*(?:_\{?[A-Za-z0-9]+\}?)?"
+    r"|\d+(?:\.\d+)*"
+)
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this "
+    "to was were what when where which who why will with".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for tok in TOKEN_RE.findall(unicode_to_latex(text)):
+        if tok.startswith("\\"):
+            tokens.append(tok)
+            continue
+        tok = tok.replace("{", "").replace("}", "").lower()
+        if tok not in STOPWORDS:
+            tokens.append(tok)
+    return tokens
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = 60) -> List[str]:
+    """Merge ranked ID lists; an ID scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+class LexicalIndex:
+    """Per-collection BM25 inverted index stored in a SQLite file.
+
+    Chunks are added and removed by ID alongside the vector store, so the
+    index stays in sync with incremental ingestion and deletes.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " collection TEXT NOT NULL, id TEXT NOT NULL, length INTEGER NOT NULL,"
+            " PRIMARY KEY (collection, id));"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " collection TEXT NOT NULL, term TEXT NOT NULL, id TEXT NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (collection, term, id));"
+            "CREATE INDEX IF NOT EXISTS postings_id ON postings(collection, id);"
+        )
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Tuple[int, float]] = {}
+        self._version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def _transaction(self, collection: str) -> Iterator[None]:
+        """Lock and write transaction on ``collection``, rolled back if the body raises."""
+        with self._lock:
+            with transaction(self._conn):
+                yield
+            self._stats.pop(collection, None)
+
+    def _delete(self, collection: str, ids: List[str]) -> None:
+        for i in range(0, len(ids), _SQL_BATCH):
+            batch = ids[i:i + _SQL_BATCH]
+            marks = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM postings WHERE collection = ? AND id IN ({marks})", [collection, *batch])
+            self._conn.execute(f"DELETE FROM docs WHERE collection = ? AND id IN ({marks})", [collection, *batch])
+
+    def add(self, collection: str, ids: List[str], texts: List[str]) -> None:
+        """Index (or re-index) chunks by ID."""
+        if not ids:
+            return
+        docs, postings = [], []
+        for cid, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            docs.append((collection, cid, sum(counts.values())))
+            postings += [(collection, term, cid, tf) for term, tf in counts.items()]
+        with self._transaction(collection):
+            self._delete(collection, list(ids))
+            self._conn.executemany("INSERT INTO docs VALUES (?, ?, ?)", docs)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", postings)
+
+    def remove(self, collection: str, ids: List[str]) -> None:
+        if not ids:
+            return
+        with self._transaction(collection):
+            self._delete(collection, list(ids))
+
+    def drop_collection(self, collection: str) -> None:
+        with self._transaction(collection):
+            self._conn.execute("DELETE FROM postings WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM docs WHERE collection = ?", (collection,))
+
+    def _collection_stats(self, collection: str) -> Tuple[int, float]:
+        # data_version moves when another process (a second worker) commits; its writes make the cache stale.
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._version:
+            self._version = version
+            self._stats.clear()
+        if collection not in self._stats:
+            n, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE collection = ?", (collection,)
+            ).fetchone()
+            self._stats[collection] = (n, total / n if n else 0.0)
+        return self._stats[collection]
+
+    def count(self, collection: str) -> int:
+        with self._lock:
+            return self._collection_stats(collection)[0]
+
+    def search(self, collection: str, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return the top ``k`` (id, BM25 score) pairs for ``query``."""
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            n, avgdl = self._collection_stats(collection)
+            if not n:
+                return []
+            marks = ",".join("?" * len(terms))
+            rows = self._conn.execute(
+                "SELECT p.term, p.id, p.tf, d.length FROM postings p"
+                " JOIN docs d ON d.collection = p.collection AND d.id = p.id"
+                f" WHERE p.collection = ? AND p.term IN ({marks})",
+                [collection, *terms],
+            ).fetchall()
+        df = Counter(term for term, _, _, _ in rows)
+        scores: Dict[str, float] = defaultdict(float)
+        for term, cid, tf, length in rows:
+            idf = math.log(1.0 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf + self.k1 * (1.0 - self.b + self.b * length / (avgdl or 1.0))
+            scores[cid] += idf * tf * (self.k1 + 1.0) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,661 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from .sqlite_util import transaction
+
+try:
+    import hnswlib
+except ImportError:  # optional: exact search is used without it
+    hnswlib = None
+
+_SQL_BATCH = 500
+_BLOCK_ROWS = 65536
+# Compact rows are decoded to float32 per block; small blocks keep that copy in cache.
+_COMPACT_BLOCK_ROWS = 4096
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{1,61}[A-Za-z0-9]$")
+DTYPES = {"float32": np.float32, "float16": np.float16}
+
+def _compare(value: Any, op: str, expected: Any) -> bool:
+    if op == "$eq":
+        return value == expected
+    if op == "$ne":
+        return value != expected
+    if op == "$in":
+        return value in expected
+    if op == "$nin":
+        return value not in expected
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > expected
+    if op == "$gte":
+        return value >= expected
+    if op == "$lt":
+        return value < expected
+    if op == "$lte":
+        return value <= expected
+    raise ValueError(f"Unsupported operator '{op}' in where filter.")
+
+def matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Chroma-style ``where`` filter ($and/$or, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin)."""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(matches(metadata, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            if not all(_compare(metadata.get(key), op, expected) for op, expected in cond.items()):
+                return False
+        elif metadata.get(key) != cond:
+            return False
+    return True
+
+class _View:
+    """What a search reads, taken under the collection lock.
+
+    Writers replace the row lists, norms and alive mask instead of changing
+    them in place, so a search can run on a view without holding the lock.
+    """
+
+    __slots__ = ("ids", "metas", "matrix", "compact", "norms", "alive", "hnsw", "count")
+
+    def __init__(self, ids: List[Optional[str]], metas: List[Optional[Dict[str, Any]]], matrix: np.memmap,
+                 compact: Optional[np.memmap], norms: Optional[np.ndarray], alive: np.ndarray, hnsw: Any, count: int):
+        self.ids = ids
+        self.metas = metas
+        self.matrix = matrix
+        self.compact = compact
+        self.norms = norms
+        self.alive = alive
+        self.hnsw = hnsw
+        self.count = count
+
+class LocalCollection:
+    """One collection stored on local disk and searched in-process.
+
+    Embeddings live in a memory-mapped matrix file (float32, or float16 to
+    halve memory and disk); opening a collection maps the file without
+    copying it. Row ``slot`` of the matrix belongs to the row with the same
+    slot in the sidecar SQLite file, which holds IDs, documents and metadata.
+    Slots freed by deletes are reused. Row norms are computed on the first
+    exact search, not on open. Search is exact cosine top-k over the
+    matrix in blocks, unless ``hnsw_min_size`` is set, hnswlib is installed
+    and the collection has at least that many rows; then an HNSW index
+    (built in memory on first use) is queried instead.
+
+    With ``prefilter_dim`` set, a second, compact matrix holds every vector
+    cut to its first ``prefilter_dim`` components and re-normalized
+    (Matryoshka embeddings such as nomic-embed-text keep most of their
+    meaning in the leading dimensions), as int8 or float32. A search then
+    scans the compact matrix for the best ``prefilter_candidates`` rows and
+    reranks only those with their full vectors.
+
+    Searches run on a snapshot of the row map (``_View``) outside the lock,
+    so reads of one collection run in parallel; only HNSW lookups, which are
+    short, take a lock of their own.
+
+    The methods mirror the subset of the chromadb ``Collection`` API the
+    service uses, so callers don't need to know which backend they talk to.
+    """
+
+    def __init__(self, root: str, name: str, metadata: Optional[Dict[str, Any]] = None,
+                 dtype: str = "float32", hnsw_min_size: int = 0, prefilter_dim: int = 0,
+                 prefilter_int8: bool = True, prefilter_candidates: int = 200):
+        self.name = name
+        self.dir = os.path.join(root, name)
+        self.hnsw_min_size = hnsw_min_size
+        self.prefilter_dim = prefilter_dim
+        self.prefilter_int8 = prefilter_int8
+        self.prefilter_candidates = prefilter_candidates
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock = threading.RLock()
+        # hnswlib cannot resize or delete while it is being searched.
+        self._hnsw_lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.dir, "rows.sqlite"), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " slot INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, document TEXT, metadata TEXT);"
+            "CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+        # OR IGNORE: another worker may be creating the same collection right now.
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO info VALUES (?, ?)",
+            [("id", str(uuid.uuid4())), ("dtype", dtype), ("metadata", json.dumps(metadata or {}))],
+        )
+        info = dict(self._conn.execute("SELECT key, value FROM info").fetchall())
+        self.id = info["id"]
+        self.metadata = json.loads(info["metadata"]) or None
+        self.dtype = DTYPES[info["dtype"]]
+        self._matrix: Optional[np.memmap] = None
+        self._compact: Optional[np.memmap] = None
+        self._version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        self._load()
+
+    def _load(self) -> None:
+        info = dict(self._conn.execute("SELECT key, value FROM info").fetchall())
+        self.dim = int(info["dim"]) if "dim" in info else None
+        self._ids: List[Optional[str]] = []
+        self._metas: List[Optional[Dict[str, Any]]] = []
+        self._slot_of: Dict[str, int] = {}
+        for slot, cid, md in self._conn.execute("SELECT slot, id, metadata FROM rows ORDER BY slot"):
+            self._grow_lists(slot + 1)
+            self._ids[slot] = cid
+            self._metas[slot] = json.loads(md) if md else {}
+            self._slot_of[cid] = slot
+        self._free = [s for s, cid in enumerate(self._ids) if cid is None]
+        self._norms: Optional[np.ndarray] = None
+        self._hnsw = None
+        self._compact = None
+        self._alive: Optional[np.ndarray] = None
+        if self.dim is not None:
+            self._map(max(len(self._ids), 1))
+            if self.prefilter_dim and info.get("compact") == self._compact_name:
+                self._map_compact(len(self._ids))
+
+    def _sync(self) -> None:
+        """Reload the row map if another process (e.g. a second worker) committed to this collection."""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._version:
+            self._version = version
+            self._load()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Write transaction that also locks out other processes; state is synced first."""
+        with transaction(self._conn, immediate=True):
+            self._sync()
+            yield
+
+    # -- storage ---------------------------------------------------------
+
+    @property
+    def _path(self) -> str:
+        return os.path.join(self.dir, "vectors.f16" if self.dtype is np.float16 else "vectors.f32")
+
+    def _grow_lists(self, n: int) -> None:
+        while len(self._ids) < n:
+            self._ids.append(None)
+            self._metas.append(None)
+
+    def _map(self, rows: int) -> None:
+        """Map the matrix file with room for at least ``rows`` rows (growing it by doubling)."""
+        row_bytes = self.dim * np.dtype(self.dtype).itemsize
+        size = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        capacity = size // row_bytes
+        if capacity < rows:
+            capacity = max(rows, capacity * 2, 1024)
+            with open(self._path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        # Readers that still hold the old map keep a valid view: the file only grows.
+        self._matrix = np.memmap(self._path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+
+    @property
+    def _compact_name(self) -> str:
+        return f"compact.d{self.prefilter_dim}.{'i8' if self.prefilter_int8 else 'f32'}"
+
+    def _compact_rows(self, vectors: np.ndarray) -> np.ndarray:
+        head = np.array(vectors[:, :self.prefilter_dim], dtype=np.float32)
+        norms = np.linalg.norm(head, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        head /= norms
+        if self.prefilter_int8:
+            # Unit vectors: every component is in [-1, 1], so one fixed scale fits all rows.
+            return np.clip(np.rint(head * 127.0), -127, 127).astype(np.int8)
+        return head
+
+    def _map_compact(self, rows: int) -> None:
+        path = os.path.join(self.dir, self._compact_name)
+        dtype = np.int8 if self.prefilter_int8 else np.float32
+        row_bytes = self.prefilter_dim * np.dtype(dtype).itemsize
+        capacity = max(rows, len(self._matrix))
+        if (os.path.getsize(path) if os.path.exists(path) else 0) < capacity * row_bytes:
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self._compact = np.memmap(path, dtype=dtype, mode="r+", shape=(capacity, self.prefilter_dim))
+
+    def _ensure_compact(self) -> bool:
+        """Map the compact matrix, building it from the full vectors if it is missing or stale."""
+        if not self.prefilter_dim or self._matrix is None or self.prefilter_dim >= self.dim:
+            return False
+        if self._compact is not None:
+            return True
+        with self._transaction():
+            current = self._conn.execute("SELECT value FROM info WHERE key = 'compact'").fetchone()
+            self._map_compact(len(self._ids))
+            if current is None or current[0] != self._compact_name:
+                n = len(self._ids)
+                for i in range(0, n, _BLOCK_ROWS):
+                    self._compact[i:min(n, i + _BLOCK_ROWS)] = self._compact_rows(self._matrix[i:min(n, i + _BLOCK_ROWS)])
+                self._compact.flush()
+                self._conn.execute("INSERT OR REPLACE INTO info VALUES ('compact', ?)", (self._compact_name,))
+        return True
+
+    def _row_norms(self, start: int, stop: int) -> np.ndarray:
+        norms = np.zeros(stop - start, dtype=np.float32)
+        for i in range(start, stop, _BLOCK_ROWS):
+            block = np.asarray(self._matrix[i:min(stop, i + _BLOCK_ROWS)], dtype=np.float32)
+            norms[i - start:i - start + len(block)] = np.linalg.norm(block, axis=1)
+        return norms
+
+    def _all_norms(self) -> np.ndarray:
+        """Norms of every row, read from the matrix the first time an exact search needs them."""
+        if self._norms is None:
+            self._norms = self._row_norms(0, len(self._ids))
+        return self._norms
+
+    def _set_norms(self, slots: Sequence[int], norms: np.ndarray) -> None:
+        if self._norms is None:
+            return
+        grown = np.zeros(len(self._ids), dtype=np.float32)
+        grown[:len(self._norms)] = self._norms
+        grown[list(slots)] = norms
+        self._norms = grown
+
+    # -- writes ----------------------------------------------------------
+
+    def count(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._slot_of)
+
+    def upsert(self, ids: List[str], embeddings: Any = None, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Optional[Dict[str, Any]]]] = None, **_: Any) -> None:
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("upsert needs one embedding per id.")
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            dim = self.dim
+            try:
+                with self._transaction():
+                    if self.dim is None:
+                        self._conn.execute("INSERT OR REPLACE INTO info VALUES ('dim', ?)", (str(vectors.shape[1]),))
+                        self.dim = vectors.shape[1]
+                    elif vectors.shape[1] != self.dim:
+                        raise ValueError(
+                            f"Embedding dimension {vectors.shape[1]} does not match collection ({self.dim})."
+                        )
+                    # Slots come from a copy of the free list, which replaces it only once the rows are committed.
+                    free, slots, fresh, end = list(self._free), [], {}, len(self._ids)
+                    for cid in ids:
+                        slot = self._slot_of.get(cid, fresh.get(cid))
+                        if slot is None:
+                            if free:
+                                slot = free.pop()
+                            else:
+                                slot, end = end, end + 1
+                            fresh[cid] = slot
+                        slots.append(slot)
+                    if self._matrix is None or len(self._matrix) < end:
+                        self._map(end)
+                    # Vectors are written before the rows commit, so readers never see a row without its vector.
+                    self._matrix[slots] = vectors.astype(self.dtype)
+                    self._matrix.flush()
+                    if self._compact is not None:
+                        if len(self._compact) < len(self._matrix):
+                            self._map_compact(len(self._matrix))
+                        self._compact[slots] = self._compact_rows(vectors)
+                        self._compact.flush()
+                    else:
+                        # Written without the compact matrix: whoever uses it next has to rebuild it.
+                        self._conn.execute("DELETE FROM info WHERE key = 'compact'")
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)",
+                        [(s, cid, doc, json.dumps(md or {})) for s, cid, doc, md in zip(slots, ids, documents, metadatas)],
+                    )
+            except BaseException:
+                if dim is None:
+                    # The matrix was mapped for the rejected dimension; the next first write maps it anew.
+                    self._matrix = None
+                self.dim = dim
+                raise
+            self._free = free
+            # New lists rather than edits: searches still running on a view keep reading the old ones.
+            self._ids, self._metas = list(self._ids), list(self._metas)
+            self._grow_lists(end)
+            for slot, cid, md in zip(slots, ids, metadatas):
+                self._ids[slot] = cid
+                self._metas[slot] = dict(md or {})
+                self._slot_of[cid] = slot
+            self._set_norms(slots, np.linalg.norm(vectors, axis=1))
+            self._alive = None
+            if self._hnsw is not None:
+                with self._hnsw_lock:
+                    self._hnsw_add(slots, vectors)
+
+    add = upsert
+
+    def update(self, ids: List[str], embeddings: Any = None, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Optional[Dict[str, Any]]]] = None, **_: Any) -> None:
+        with self._lock:
+            self._sync()
+            slots = [self._slot_of[cid] for cid in ids if cid in self._slot_of]
+            if len(slots) != len(ids):
+                raise ValueError("update: some ids do not exist.")
+            if embeddings is not None:
+                got = self.get(ids=ids, include=["documents", "metadatas"])
+                by_id = {cid: (doc, md) for cid, doc, md in zip(got["ids"], got["documents"], got["metadatas"])}
+                self.upsert(
+                    ids, embeddings,
+                    documents or [by_id[cid][0] for cid in ids],
+                    metadatas or [by_id[cid][1] for cid in ids],
+                )
+                return
+            with self._transaction():
+                if documents is not None:
+                    self._conn.executemany("UPDATE rows SET document = ? WHERE id = ?", list(zip(documents, ids)))
+                if metadatas is not None:
+                    self._conn.executemany(
+                        "UPDATE rows SET metadata = ? WHERE id = ?",
+                        [(json.dumps(md or {}), cid) for md, cid in zip(metadatas, ids)],
+                    )
+            self._metas = list(self._metas)
+            for cid, md in zip(ids, metadatas or []):
+                if cid in self._slot_of:
+                    self._metas[self._slot_of[cid]] = dict(md or {})
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, **_: Any) -> None:
+        with self._lock:
+            with self._transaction():
+                slots = self._select(ids, where)
+                for i in range(0, len(slots), _SQL_BATCH):
+                    batch = slots[i:i + _SQL_BATCH]
+                    self._conn.execute(f"DELETE FROM rows WHERE slot IN ({','.join('?' * len(batch))})", batch)
+            self._ids, self._metas = list(self._ids), list(self._metas)
+            for slot in slots:
+                del self._slot_of[self._ids[slot]]
+                self._ids[slot] = None
+                self._metas[slot] = None
+                self._free.append(slot)
+            if self._hnsw is not None:
+                with self._hnsw_lock:
+                    for slot in slots:
+                        self._hnsw.mark_deleted(slot)
+            self._alive = None
+
+    # -- reads -----------------------------------------------------------
+
+    def _select(self, ids: Optional[List[str]], where: Optional[Dict[str, Any]]) -> List[int]:
+        if ids is not None:
+            slots = [self._slot_of[cid] for cid in ids if cid in self._slot_of]
+        else:
+            slots = [s for s, cid in enumerate(self._ids) if cid is not None]
+        if where:
+            slots = [s for s in slots if matches(self._metas[s], where)]
+        return slots
+
+    def _rows(self, slots: List[int], include: Sequence[str]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"ids": [self._ids[s] for s in slots]}
+        if "documents" in include:
+            docs: Dict[int, str] = {}
+            for i in range(0, len(slots), _SQL_BATCH):
+                batch = slots[i:i + _SQL_BATCH]
+                docs.update(self._conn.execute(
+                    f"SELECT slot, document FROM rows WHERE slot IN ({','.join('?' * len(batch))})", batch,
+                ).fetchall())
+            out["documents"] = [docs.get(s) for s in slots]
+        if "metadatas" in include:
+            out["metadatas"] = [dict(self._metas[s]) for s in slots]
+        if "embeddings" in include:
+            if self._matrix is None or not slots:
+                out["embeddings"] = np.zeros((len(slots), self.dim or 0), dtype=np.float32)
+            else:
+                out["embeddings"] = np.asarray(self._matrix[slots], dtype=np.float32)
+        if "uris" in include:
+            out["uris"] = [None] * len(slots)
+        return out
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas"), **_: Any) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            slots = self._select(ids, where)
+            start = offset or 0
+            slots = slots[start:start + limit] if limit is not None else slots[start:]
+            result = self._rows(slots, include)
+        for field in ("documents", "metadatas", "embeddings", "uris"):
+            result.setdefault(field, None)
+        result["included"] = list(include)
+        return result
+
+    def _view(self) -> _View:
+        """Snapshot for ``query``; call with the lock held. Builds what the search will use on first need."""
+        hnsw = self._hnsw if self._ensure_hnsw() else None
+        compact = None
+        if hnsw is None and len(self._slot_of) > self.prefilter_candidates and self._ensure_compact():
+            compact = self._compact
+        norms = self._all_norms() if hnsw is None and compact is None else None
+        n = len(self._ids)
+        if self._alive is None or len(self._alive) != n:
+            self._alive = np.fromiter((cid is not None for cid in self._ids), dtype=bool, count=n)
+        return _View(self._ids, self._metas, self._matrix, compact, norms, self._alive, hnsw, len(self._slot_of))
+
+    @staticmethod
+    def _alive_mask(view: _View, allowed: Optional[Callable[[int], bool]]) -> np.ndarray:
+        """Which slots of the view hold a row (that passes ``allowed``)."""
+        if allowed is None:
+            return view.alive
+        n = len(view.alive)
+        return np.fromiter((view.alive[s] and allowed(s) for s in range(n)), dtype=bool, count=n)
+
+    @staticmethod
+    def _scores(view: _View, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of ``query`` with every row of the view, computed block by block from the map."""
+        n = len(view.ids)
+        q = query / (np.linalg.norm(query) or 1.0)
+        scores = np.empty(n, dtype=np.float32)
+        # Without cached norms (an HNSW fallback) they come from the blocks being scanned anyway.
+        norms = view.norms[:n] if view.norms is not None else np.empty(n, dtype=np.float32)
+        for i in range(0, n, _BLOCK_ROWS):
+            block = view.matrix[i:min(n, i + _BLOCK_ROWS)]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores[i:i + len(block)] = block @ q
+            if view.norms is None:
+                norms[i:i + len(block)] = np.linalg.norm(block, axis=1)
+        return np.divide(scores, norms, out=np.zeros_like(scores), where=norms > 0)
+
+    def _exact(self, view: _View, query: np.ndarray, k: int, allowed: Optional[Callable[[int], bool]]) -> List[tuple]:
+        scores = self._scores(view, query)
+        alive = self._alive_mask(view, allowed)
+        scores[~alive] = -np.inf
+        k = min(k, int(alive.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(s), float(scores[s])) for s in top]
+
+    def _two_stage(self, view: _View, query: np.ndarray, k: int, allowed: Optional[Callable[[int], bool]]) -> List[tuple]:
+        """Top ``prefilter_candidates`` by the compact vectors, reranked by the full ones."""
+        n = len(view.ids)
+        compact, q = view.compact, query[:self.prefilter_dim]
+        scores = np.empty(n, dtype=np.float32)
+        for i in range(0, n, _COMPACT_BLOCK_ROWS):
+            stop = min(n, i + _COMPACT_BLOCK_ROWS)
+            block = compact[i:stop]
+            scores[i:stop] = (block.astype(np.float32) if block.dtype != np.float32 else block) @ q
+        alive = self._alive_mask(view, allowed)
+        scores[~alive] = -np.inf
+        m = min(max(self.prefilter_candidates, k), int(alive.sum()))
+        if m <= 0:
+            return []
+        candidates = np.sort(np.argpartition(-scores, m - 1)[:m])
+        rows = np.asarray(view.matrix[candidates], dtype=np.float32)
+        full = rows @ (query / (np.linalg.norm(query) or 1.0))
+        norms = np.linalg.norm(rows, axis=1)
+        full = np.divide(full, norms, out=np.zeros_like(full), where=norms > 0)
+        top = np.argsort(-full, kind="stable")[:k]
+        return [(int(candidates[i]), float(full[i])) for i in top]
+
+    def _hnsw_add(self, slots: List[int], vectors: np.ndarray) -> None:
+        index = self._hnsw
+        if max(slots) >= index.get_max_elements():
+            index.resize_index(max(max(slots) + 1, index.get_max_elements() * 2))
+        for slot in slots:
+            try:
+                index.unmark_deleted(slot)
+            except RuntimeError:
+                pass  # new label, or one that was never deleted
+        index.add_items(vectors, slots)
+
+    def _ensure_hnsw(self) -> bool:
+        if hnswlib is None or not self.hnsw_min_size or self.count() < self.hnsw_min_size:
+            return False
+        if self._hnsw is None:
+            slots = self._select(None, None)
+            index = hnswlib.Index(space="cosine", dim=self.dim)
+            index.init_index(max_elements=max(len(self._ids) * 2, 1024), ef_construction=200, M=16)
+            for i in range(0, len(slots), _BLOCK_ROWS):
+                batch = slots[i:i + _BLOCK_ROWS]
+                index.add_items(np.asarray(self._matrix[batch], dtype=np.float32), batch)
+            index.set_ef(128)
+            self._hnsw = index
+        return True
+
+    def _approximate(self, view: _View, query: np.ndarray, k: int,
+                     allowed: Optional[Callable[[int], bool]]) -> Optional[List[tuple]]:
+        k = min(k, view.count)
+        if k <= 0:
+            return []
+        try:
+            with self._hnsw_lock:
+                labels, distances = view.hnsw.knn_query(query, k=k, filter=allowed)
+        except RuntimeError:
+            # Fewer than k rows pass the filter within the search beam; the exact scan finds them all.
+            return None
+        return [(int(s), 1.0 - float(d)) for s, d in zip(labels[0], distances[0])]
+
+    def _search(self, view: _View, query: np.ndarray, k: int, allowed: Optional[Callable[[int], bool]]) -> List[tuple]:
+        hits = self._approximate(view, query, k, allowed) if view.hnsw is not None else None
+        if hits is None and view.compact is not None:
+            hits = self._two_stage(view, query, k, allowed)
+        if hits is None:
+            hits = self._exact(view, query, k, allowed)
+        return hits
+
+    def query(self, query_embeddings: Any, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Sequence[str] = ("documents", "metadatas", "distances"), **_: Any) -> Dict[str, Any]:
+        out: Dict[str, List[Any]] = {"ids": [], "distances": [], "documents": [], "metadatas": [], "embeddings": []}
+        with self._lock:
+            self._sync()
+            view = self._view() if self._matrix is not None else None
+        if view is None:
+            hits_per_query = [[] for _ in query_embeddings]
+        else:
+            # The HNSW index is shared with writers, so it may return slots the view doesn't cover.
+            allowed = (lambda s: s < len(view.metas) and matches(view.metas[s] or {}, where)) if where else None
+            hits_per_query = [
+                self._search(view, np.asarray(query, dtype=np.float32), n_results, allowed)
+                for query in query_embeddings
+            ]
+        with self._lock:
+            self._sync()
+            for hits in hits_per_query:
+                # Rows deleted or replaced since the view was taken are left out.
+                hits = [
+                    (s, score) for s, score in hits
+                    if s < min(len(view.ids), len(self._ids)) and view.ids[s] is not None and self._ids[s] == view.ids[s]
+                ]
+                rows = self._rows([s for s, _ in hits], include)
+                out["ids"].append(rows["ids"])
+                out["distances"].append([1.0 - score for _, score in hits])
+                for field in ("documents", "metadatas", "embeddings"):
+                    out[field].append(rows.get(field))
+        for field in ("documents", "metadatas", "embeddings", "distances"):
+            if field not in include:
+                out[field] = None
+        return out
+
+class LocalVectorClient:
+    """Collections under ``root``, including ones other processes create later; same lookups as a chromadb client."""
+
+    def __init__(self, root: str, dtype: str = "float32", hnsw_min_size: int = 0, prefilter_dim: int = 0,
+                 prefilter_int8: bool = True, prefilter_candidates: int = 200):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown vector dtype '{dtype}'; use one of {', '.join(DTYPES)}.")
+        self.root = root
+        self.dtype = dtype
+        self.hnsw_min_size = hnsw_min_size
+        self.prefilter = dict(
+            prefilter_dim=prefilter_dim, prefilter_int8=prefilter_int8, prefilter_candidates=prefilter_candidates,
+        )
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._collections: Dict[str, LocalCollection] = {}
+        self.list_collections()
+
+    def _open(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> LocalCollection:
+        return LocalCollection(
+            self.root, name, metadata, dtype=self.dtype, hnsw_min_size=self.hnsw_min_size, **self.prefilter,
+        )
+
+    def _exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.root, name, "rows.sqlite"))
+
+    def get_collection(self, name: str) -> LocalCollection:
+        with self._lock:
+            if name not in self._collections:
+                # Possibly created by another worker process.
+                if not self._exists(name):
+                    raise ValueError(f"Collection {name} does not exist.")
+                self._collections[name] = self._open(name)
+            return self._collections[name]
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> LocalCollection:
+        with self._lock:
+            if name not in self._collections:
+                if not _NAME_RE.match(name):
+                    raise ValueError(f"Invalid collection name '{name}'.")
+                self._collections[name] = self._open(name, metadata)
+            return self._collections[name]
+
+    def list_collections(self) -> List[LocalCollection]:
+        for name in sorted(os.listdir(self.root)):
+            if name not in self._collections and self._exists(name):
+                self.get_collection(name)
+        return list(self._collections.values())
+
+class LocalStore:
+    """The part of the langchain ``Chroma`` vector store the service uses, over a ``LocalCollection``."""
+
+    def __init__(self, collection: LocalCollection, embeddings: Embeddings):
+        self._collection = collection
+        self.embeddings = embeddings
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **_: Any) -> List[Document]:
+        got = self._collection.query([embedding], n_results=k, where=filter, include=["documents", "metadatas"])
+        return [
+            Document(page_content=text or "", metadata=md or {}, id=cid)
+            for cid, text, md in zip(got["ids"][0], got["documents"][0], got["metadatas"][0])
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k, filter=filter)
+
+    def delete(self, ids: Optional[List[str]] = None, **_: Any) -> None:
+        self._collection.delete(ids=ids)
@@ -1,17 +1,95 @@
 
+import asyncio
 import json
 import os
-from typing import Optional, Dict, Any, List
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+import re
+import time
+import zipfile
+from typing import Optional, Dict, Any, List, Tuple
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from .service import *
+from .concurrency import run_blocking, run_request
+from .batch_runs import parse_questions
+from .fanout import Target, parse_targets
+from .sessions import UnknownSession
+from .instrumentation import REQUEST_SECONDS, SamplingProfiler, server_timing, start_timings
  
 app = FastAPI(title="Chroma PDF Ingestion & RAG API")
 
+@app.on_event("startup")
+async def open_vector_store():
+    # The embedded backend maps every collection up front instead of on the first request.
+    if get_config()["vector_backend"] == "local":
+        await run_blocking(get_vector_client)
+
+@app.on_event("startup")
+def start_pdf_workers():
+    get_pdf_reader().warm()
+
+@app.on_event("shutdown")
+def stop_pdf_workers():
+    get_pdf_reader().shutdown()
+
+@app.on_event("startup")
+async def start_ollama_health_checks():
+    get_ollama_pool().start()
+
+@app.on_event("shutdown")
+async def stop_ollama_health_checks():
+    await get_ollama_pool().stop()
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """Request latency histogram, Server-Timing header and slow-request profiles."""
+    timings = start_timings()
+    profiler = get_profiler()
+    recording = profiler.start() if profiler is not None else None
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        elapsed = time.perf_counter() - started
+        if recording is not None:
+            profiler.stop(recording)
+    # Streaming responses are measured up to their first frame.
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    REQUEST_SECONDS.labels(method=request.method, route=route).observe(elapsed)
+    response.headers["Server-Timing"] = server_timing(timings, elapsed)
+    cfg = get_config()
+    if recording is not None and elapsed * 1000.0 >= cfg["profile_slow_ms"]:
+        name = f"{request.method}{re.sub(r'[^A-Za-z0-9]+', '_', route)}"
+        await run_blocking(SamplingProfiler.dump, recording, cfg["profile_dir"], name)
+    return response
+
+@app.get("/metrics")
+def fetch_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/healthz")
-def healthz():
+async def healthz():
     return {"status": "ok"}
 
+@app.get("/cache/stats")
+def fetch_cache_stats():
+    return cache_stats()
+
+@app.get("/embed/batcher/stats")
+def fetch_batcher_stats():
+    return batcher_stats()
+
+@app.get("/scheduler/stats")
+def fetch_scheduler_stats():
+    return scheduler_stats()
+
+@app.get("/ollama/stats")
+def fetch_ollama_stats():
+    return ollama_stats()
+
+@app.get("/sessions/stats")
+def fetch_session_stats():
+    return session_stats()
+
 @app.get("/collections")
 def fetch_collections():
     collections = get_collections()
@@ -26,33 +104,157 @@ def fetch_collections():
             for col in collections
         ]
 
+MAX_PAGE_SIZE = 1000
+
+def _collection_query(include: Optional[str], where: Optional[str]) -> Tuple[Optional[List[str]], Optional[Dict[str, Any]]]:
+    fields = [f.strip() for f in include.split(",") if f.strip()] if include else None
+    unknown = [f for f in fields or [] if f not in COLLECTION_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Use any of: {', '.join(COLLECTION_FIELDS)}.",
+        )
+    try:
+        metadata_filter = json.loads(where) if where else None
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="'where' must be valid JSON.")
+    return fields, metadata_filter
+
 @app.get("/collections/{collection_name}")
-def fetch_collection_data(collection_name):
-    return get_collection_data(str(collection_name))
+def fetch_collection_data(
+    collection_name: str,
+    limit: int = 100,
+    offset: int = 0,
+    include: Optional[str] = None,
+    where: Optional[str] = None,
+):
+    if not 1 <= limit <= MAX_PAGE_SIZE or offset < 0:
+        raise HTTPException(status_code=400, detail=f"'limit' must be 1-{MAX_PAGE_SIZE} and 'offset' >= 0.")
+    fields, metadata_filter = _collection_query(include, where)
+    return get_collection_data(collection_name, limit=limit, offset=offset, include=fields, where=metadata_filter)
+
+@app.get("/collections/{collection_name}/export")
+async def export_collection(
+    collection_name: str,
+    batch_size: int = 500,
+    include: Optional[str] = None,
+    where: Optional[str] = None,
+):
+    if not 1 <= batch_size <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"'batch_size' must be 1-{MAX_PAGE_SIZE}.")
+    fields, metadata_filter = _collection_query(include, where)
+    records = aexport_collection(collection_name, include=fields, where=metadata_filter, batch_size=batch_size)
+    return StreamingResponse(_ndjson(records, timeout=None), media_type="application/x-ndjson")
 
 @app.post("/collections")
 def create_collections(body: dict):
-    created_collection = create_collection(body["name"])
+    settings = {key: body.get(key) for key in COLLECTION_SETTINGS}
+    for key in ("chunk_size", "chunk_overlap"):
+        if settings[key] is not None and not isinstance(settings[key], int):
+            raise HTTPException(status_code=400, detail=f"'{key}' must be an integer.")
+    # A setting left out falls back to the global one, so check the pair the splitter will actually get.
+    cfg = get_config()
+    chunk_size = settings["chunk_size"] if settings["chunk_size"] is not None else cfg["chunk_size"]
+    chunk_overlap = settings["chunk_overlap"] if settings["chunk_overlap"] is not None else cfg["chunk_overlap"]
+    if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Need chunk_size > 0 and 0 <= chunk_overlap < chunk_size (got {chunk_size} and {chunk_overlap}).",
+        )
+    created_collection = create_collection(body["name"], settings)
     return created_collection
  
+def _parse_metadata(metadata_json: Optional[str]) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(metadata_json) if metadata_json else None
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="metadata_json must be valid JSON.")
+
+def _check_upload_size(file: UploadFile) -> None:
+    limit_mb = get_config()["max_upload_mb"]
+    if limit_mb and file.size is not None and file.size > limit_mb * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"'{file.filename}' is larger than {limit_mb:g} MB.")
+
 @app.post("/ingest")
 async def ingest_pdf(
+    request: Request,
     file: UploadFile = File(...),
     collection: Optional[str] = Form(None),
     metadata_json: Optional[str] = Form(None),
 ):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
-    try:
-        metadata: Optional[Dict[str, Any]] = json.loads(metadata_json) if metadata_json else None
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="metadata_json must be valid JSON.")
+    _check_upload_size(file)
+    metadata = _parse_metadata(metadata_json)
     content = await file.read()
-    res = ingest_pdf_bytes(content, file.filename, collection_name=collection, metadata=metadata)
+    res = await run_request(
+        request,
+        aingest_pdf_bytes(content, file.filename, collection_name=collection, metadata=metadata),
+        timeout=get_config()["ingest_timeout"],
+    )
     return JSONResponse(res)
+
+@app.post("/ingest/jobs", status_code=202)
+async def create_ingest_job(
+    files: List[UploadFile] = File(...),
+    collection: Optional[str] = Form(None),
+    metadata_json: Optional[str] = Form(None),
+):
+    for f in files:
+        _check_upload_size(f)
+    metadata = _parse_metadata(metadata_json)
+    uploads = [(f.filename, f.file) for f in files]
+    try:
+        return await run_blocking(start_ingest_job, uploads, collection_name=collection, metadata=metadata)
+    except (ValueError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/jobs")
+def fetch_jobs():
+    return list_ingest_jobs()
+
+@app.get("/jobs/{job_id}")
+def fetch_job(job_id: str):
+    job = get_ingest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'.")
+    return job
  
+def _retrieval_overrides(payload: Dict[str, Any]) -> Dict[str, Any]:
+    mode = payload.get("mode")
+    if mode is not None and mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"'mode' must be one of: {', '.join(RETRIEVAL_MODES)}.")
+    fetch_k = payload.get("fetch_k")
+    mmr_lambda = payload.get("mmr_lambda")
+    dedup_threshold = payload.get("dedup_threshold")
+    if mmr_lambda is not None and not 0.0 <= float(mmr_lambda) <= 1.0:
+        raise HTTPException(status_code=400, detail="'mmr_lambda' must be between 0 and 1.")
+    return {
+        "mode": mode,
+        "fetch_k": int(fetch_k) if fetch_k is not None else None,
+        "mmr_lambda": float(mmr_lambda) if mmr_lambda is not None else None,
+        "dedup_threshold": float(dedup_threshold) if dedup_threshold is not None else None,
+    }
+
+def _targets(payload: Dict[str, Any], k: int) -> Optional[List[Target]]:
+    """The collections of a fan-out request (``collections``), or None for a single-collection one."""
+    collections = payload.get("collections")
+    if collections is None:
+        return None
+    if payload.get("collection") is not None:
+        raise HTTPException(status_code=400, detail="Send either 'collection' or 'collections', not both.")
+    try:
+        return parse_targets(collections, k, payload.get("filter"), get_config()["fanout_max_collections"])
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _tenant(payload: Dict[str, Any], request: Request) -> Optional[str]:
+    """Who the request is queued for; the scheduler falls back to the collection."""
+    tenant = payload.get("user_id") or request.headers.get("x-user-id")
+    return str(tenant) if tenant else None
+
 @app.post("/query")
-async def query(payload: Dict[str, Any]):
+async def query(payload: Dict[str, Any], request: Request):
     query = payload.get("query")
     if not query:
         raise HTTPException(status_code=400, detail="Missing 'query' field.")
@@ -60,36 +262,149 @@ async def query(payload: Dict[str, Any]):
     collection = payload.get("collection")
     metadata_filter = payload.get("filter")
     by_vector = bool(payload.get("by_vector", False))
+    retrieval = _retrieval_overrides(payload)
+    targets = _targets(payload, k)
  
-    if by_vector:
-        return similarity_search_by_vector(query, k=k, collection_name=collection, metadata_filter=metadata_filter)
-    return similarity_search(query, k=k, collection_name=collection, metadata_filter=metadata_filter)
+    if targets is not None:
+        if by_vector:
+            raise HTTPException(status_code=400, detail="'by_vector' does not support 'collections'.")
+        search = asimilarity_search_many(
+            query, targets, k=k, retrieval=retrieval, tenant=_tenant(payload, request),
+        )
+    elif by_vector:
+        if not isinstance(query, list):
+            raise HTTPException(status_code=400, detail="'query' must be a list of floats when 'by_vector' is set.")
+        if retrieval["mode"] not in (None, "vector"):
+            raise HTTPException(status_code=400, detail="'by_vector' only supports the 'vector' mode.")
+        search = run_blocking(
+            similarity_search_by_vector, query, k=k, collection_name=collection, metadata_filter=metadata_filter,
+        )
+    else:
+        search = asimilarity_search(
+            query, k=k, collection_name=collection, metadata_filter=metadata_filter, retrieval=retrieval,
+            tenant=_tenant(payload, request),
+        )
+    return await run_request(request, search, timeout=get_config()["request_timeout"])
  
 @app.post("/delete")
-async def delete_ids(payload: Dict[str, Any]):
+async def delete_documents(payload: Dict[str, Any], request: Request):
     ids: List[str] = payload.get("ids") or []
-    if not ids:
-        raise HTTPException(status_code=400, detail="Provide 'ids' to delete.")
+    sources: List[str] = payload.get("sources") or []
+    if not ids and not sources:
+        raise HTTPException(status_code=400, detail="Provide 'ids' or 'sources' to delete.")
     collection = payload.get("collection")
-    return delete_ids(ids, collection_name=collection)
+    if sources:
+        work = adelete_sources(sources, collection_name=collection)
+    else:
+        work = adelete_ids(ids, collection_name=collection)
+    return await run_request(request, work, timeout=get_config()["request_timeout"])
+
+@app.get("/documents")
+def fetch_documents(collection: Optional[str] = None):
+    return list_documents(collection)
  
-@app.post("/ask")
-async def askQuestion(payload: Dict[str, Any]):
+async def _ask_params(payload: Dict[str, Any], request: Request) -> Dict[str, Any]:
     question = payload.get("question")
     if not question:
         raise HTTPException(status_code=400, detail="Missing 'question' field.")
+    history = payload.get("history")
+    if history is not None and not isinstance(history, list):
+        raise HTTPException(status_code=400, detail="'history' must be a list of messages.")
     k = int(payload.get("k", 4))
-    collection = payload.get("collection")
-    metadata_filter = payload.get("filter")
-    history = payload.get("history") or []
+    targets = _targets(payload, k)
+    tenant = _tenant(payload, request)
+    session = None
+    conversation_id = payload.get("conversation_id")
+    if conversation_id is not None:
+        # Once the service holds the conversation, callers only send the new question.
+        try:
+            session = await run_blocking(open_session, conversation_id, tenant, history)
+        except UnknownSession as e:
+            raise HTTPException(status_code=409, detail=f"{e} Resend the request with 'history'.")
+    return {
+        "question": question,
+        "k": k,
+        "collection_name": payload.get("collection"),
+        "metadata_filter": payload.get("filter"),
+        "history": history or [],
+        "retrieval": _retrieval_overrides(payload),
+        "tenant": tenant,
+        "session": session,
+        "targets": targets,
+    }
 
-    if not isinstance(history, list):
-        raise HTTPException(status_code=400, detail="'history' must be a list of messages.")
- 
-    return ask(
-        question=question,
-        k=k,
-        collection_name=collection,
-        metadata_filter=metadata_filter,
-        history=history,
-    )
\ No newline at end of file
+@app.post("/ask")
+async def askQuestion(payload: Dict[str, Any], request: Request):
+    return await run_request(request, aask(**(await _ask_params(payload, request))), timeout=get_config()["request_timeout"])
+
+async def _ndjson(frames, timeout: Optional[float]):
+    # Starlette stops iterating (and closes ``frames``) when the client
+    # disconnects, which aborts the underlying Ollama stream.
+    try:
+        async with asyncio.timeout(timeout):
+            async for frame in frames:
+                yield json.dumps(frame, ensure_ascii=False) + "\n"
+    except TimeoutError:
+        yield json.dumps({"type": "error", "detail": f"Request timed out after {timeout:g}s."}) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+async def _resume(first: Dict[str, Any], frames):
+    try:
+        yield first
+        async for frame in frames:
+            yield frame
+    finally:
+        await frames.aclose()
+
+@app.post("/ask/stream")
+async def askQuestionStream(payload: Dict[str, Any], request: Request):
+    params = await _ask_params(payload, request)
+    timeout = get_config()["request_timeout"]
+    stream = aask_stream(**params)
+    # Wait for the ``start`` frame (sent once the generation is admitted) before
+    # committing to a 200, so a full queue is still a 429/503 with Retry-After.
+    first = await run_request(request, stream.__anext__(), timeout=timeout)
+    frames = _ndjson(_resume(first, stream), timeout=timeout)
+    return StreamingResponse(frames, media_type="application/x-ndjson")
+
+@app.post("/ask/batch")
+async def askBatch(payload: Dict[str, Any], request: Request):
+    """Answer a list of questions, streamed as NDJSON; send the same ``run_id`` again to resume."""
+    run_id = payload.get("run_id")
+    spec = None
+    if payload.get("questions") is not None:
+        k = int(payload.get("k", 4))
+        targets = _targets(payload, k)
+        try:
+            questions = parse_questions(payload["questions"], get_config()["batch_max_questions"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        spec = batch_spec(
+            questions, k, payload.get("collection"), payload.get("filter"), _retrieval_overrides(payload), targets,
+        )
+    elif not run_id:
+        raise HTTPException(status_code=400, detail="Missing 'questions' field.")
+    try:
+        run = await run_blocking(open_batch_run, spec, str(run_id) if run_id else None)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown batch run '{run_id}'. Resend it with 'questions'.")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    concurrency = payload.get("concurrency")
+    frames = aask_batch(
+        run,
+        tenant=_tenant(payload, request),
+        concurrency=int(concurrency) if concurrency is not None else None,
+        replay=bool(payload.get("replay", True)),
+    )
+    return StreamingResponse(
+        _ndjson(frames, timeout=get_config()["batch_timeout"] or None), media_type="application/x-ndjson",
+    )
+
+@app.get("/ask/batch/{run_id}")
+async def fetch_batch_run(run_id: str):
+    status = await run_blocking(batch_run_status, run_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch run '{run_id}'.")
+    return status
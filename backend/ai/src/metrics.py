@@ -0,0 +1,125 @@
+import bisect
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+class Histogram:
+    """Cumulative bucket counts, like a Prometheus histogram."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+            running += count
+            cumulative[bound] = running
+        return {"buckets": cumulative, "count": running, "sum": round(total, 6)}
+
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class HistogramFamily:
+    """One ``Histogram`` per label set, created on first use."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self._series: Dict[Labels, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels: str) -> Histogram:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if key not in self._series:
+                self._series[key] = Histogram(self.buckets)
+            return self._series[key]
+
+    def items(self) -> List[Tuple[Labels, Histogram]]:
+        with self._lock:
+            return list(self._series.items())
+
+class CounterFamily:
+    def __init__(self):
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def items(self) -> List[Tuple[Labels, float]]:
+        with self._lock:
+            return list(self._values.items())
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+class Exposition:
+    """Collects samples and renders them in the Prometheus text format.
+
+    Samples may be added in any order; each metric family is written as one
+    group with its TYPE line, as the format requires.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, List[str]]] = {}
+
+    def _lines(self, name: str, kind: str) -> List[str]:
+        if name not in self._families:
+            self._families[name] = (kind, [])
+        return self._families[name][1]
+
+    def sample(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None, kind: str = "gauge") -> None:
+        name = _metric_name(name)
+        self._lines(name, kind).append(f"{name}{_format_labels(labels or {})} {float(value)!r}")
+
+    def histogram(self, name: str, data: Dict[str, Any], labels: Optional[Dict[str, Any]] = None) -> None:
+        """Add a histogram given as ``Histogram.to_dict()``."""
+        name = _metric_name(name)
+        labels = labels or {}
+        lines = self._lines(name, "histogram")
+        for bound, count in data["buckets"].items():
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {float(data['sum'])!r}")
+        lines.append(f"{name}_count{_format_labels(labels)} {data['count']}")
+
+    def stats(self, prefix: str, stats: Optional[Dict[str, Any]], labels: Optional[Dict[str, Any]] = None) -> None:
+        """Flatten a ``stats()`` dict: numbers become gauges, ``to_dict()`` histograms stay histograms."""
+        for key, value in (stats or {}).items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, bool):
+                self.sample(name, int(value), labels)
+            elif isinstance(value, (int, float)):
+                self.sample(name, value, labels)
+            elif isinstance(value, dict) and "buckets" in value:
+                self.histogram(name, value, labels)
+            elif isinstance(value, dict):
+                self.stats(name, value, labels)
+
+    def render(self) -> str:
+        out: List[str] = []
+        for name, (kind, lines) in self._families.items():
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
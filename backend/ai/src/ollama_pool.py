@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Collection, Dict, Iterator, List, Optional, TypeVar
+
+import httpx
+from fastapi import HTTPException
+from langchain_core.embeddings import Embeddings
+
+T = TypeVar("T")
+
+KINDS = ("chat", "embed")
+
+logger = logging.getLogger(__name__)
+
+def is_outage(error: BaseException) -> bool:
+    """Whether a failed call says the server is down (unreachable, timing out, 5xx) rather than the call was bad.
+
+    Model errors, such as an unknown model name, are 4xx responses and say
+    nothing about the server.
+    """
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+class Endpoint:
+    """One Ollama server: calls in flight and recent latency per kind, health and breaker state."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.checked: Optional[float] = None
+        self.outstanding = {kind: 0 for kind in KINDS}
+        self.latency_ms = {kind: 0.0 for kind in KINDS}
+        self.requests = {kind: 0 for kind in KINDS}
+        self.failures = {kind: 0 for kind in KINDS}
+        self.consecutive_failures = 0
+        # The breaker is open until ``open_until``; after that one trial call ("probing") may go through.
+        self.open_until = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def state(self, now: float) -> str:
+        if not self.open_until:
+            return "closed"
+        return "open" if now < self.open_until else "half_open"
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "breaker": self.state(now),
+            "breaker_open": self.state(now) == "open",
+            "breaker_trips": self.trips,
+            "consecutive_failures": self.consecutive_failures,
+            "outstanding": dict(self.outstanding),
+            "latency_ms": {kind: round(ms, 1) for kind, ms in self.latency_ms.items()},
+            "requests": dict(self.requests),
+            "failures": dict(self.failures),
+        }
+
+class OllamaPool:
+    """Routes Ollama calls over one or more servers.
+
+    A call goes to the endpoint with the fewest calls of the same kind in
+    flight; chat and embedding calls are counted apart, since one long
+    generation says little about how fast a box embeds. Ties go to the lower
+    recent latency, then round robin.
+
+    ``failure_threshold`` consecutive outages (see ``is_outage``) open an
+    endpoint's circuit breaker for ``cooldown_s``; then a single trial call
+    decides whether it closes again. A lone endpoint has nothing to fail over
+    to, so its breaker never opens. Endpoints failing their health check are
+    used only when no healthy one is left. With every breaker open calls fail
+    fast with 503.
+
+    ``call`` can hedge: if the first endpoint has not answered within
+    ``hedge_after_ms``, the same call starts on the next best endpoint and
+    the first success wins.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        failure_threshold: int = 3,
+        cooldown_s: float = 30.0,
+        health_interval_s: float = 10.0,
+        health_timeout_s: float = 2.0,
+        hedge_after_ms: float = 0.0,
+    ):
+        if not urls:
+            raise ValueError("At least one Ollama URL is required.")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_s = cooldown_s
+        self.health_interval_s = health_interval_s
+        self.health_timeout_s = health_timeout_s
+        self.hedge_after_ms = hedge_after_ms
+        self._lock = threading.Lock()
+        self._turn = 0
+        self._health_task: Optional[asyncio.Task] = None
+        self.rejected = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def urls(self) -> List[str]:
+        return [ep.url for ep in self.endpoints]
+
+    def _allowed(self, ep: Endpoint, now: float) -> bool:
+        state = ep.state(now)
+        return state == "closed" or (state == "half_open" and not ep.probing)
+
+    def _candidates(self, now: float, exclude: Collection[str]) -> List[Endpoint]:
+        allowed = [ep for ep in self.endpoints if ep.url not in exclude and self._allowed(ep, now)]
+        return [ep for ep in allowed if ep.healthy] or allowed
+
+    def _unavailable(self, now: float) -> HTTPException:
+        self.rejected += 1
+        reopen = min((ep.open_until for ep in self.endpoints if ep.open_until), default=now + 1)
+        retry = max(1, math.ceil(reopen - now))
+        return HTTPException(
+            status_code=503, detail="No Ollama server is available.", headers={"Retry-After": str(retry)},
+        )
+
+    def _acquire(self, kind: str, exclude: Collection[str] = ()) -> Endpoint:
+        with self._lock:
+            now = time.monotonic()
+            candidates = self._candidates(now, exclude)
+            if not candidates:
+                raise self._unavailable(now)
+            self._turn += 1
+            n = len(self.endpoints)
+            order = {ep.url: (i - self._turn) % n for i, ep in enumerate(self.endpoints)}
+            ep = min(candidates, key=lambda e: (e.outstanding[kind], e.latency_ms[kind], order[e.url]))
+            if ep.state(now) == "half_open":
+                ep.probing = True
+            ep.outstanding[kind] += 1
+            ep.requests[kind] += 1
+            return ep
+
+    def _release(self, ep: Endpoint, kind: str, started: float, ok: Optional[bool]) -> None:
+        """``ok`` is False for an outage and None for a call that says nothing about the endpoint
+        (cancelled, or rejected by the server as a bad request)."""
+        with self._lock:
+            ep.outstanding[kind] -= 1
+            if ok is None:
+                ep.probing = False
+                return
+            now = time.monotonic()
+            if ok:
+                elapsed_ms = (now - started) * 1000
+                previous = ep.latency_ms[kind]
+                ep.latency_ms[kind] = elapsed_ms if not previous else 0.8 * previous + 0.2 * elapsed_ms
+                ep.consecutive_failures = 0
+                ep.open_until = 0.0
+            else:
+                ep.failures[kind] += 1
+                ep.consecutive_failures += 1
+                tripped = ep.probing or ep.consecutive_failures >= self.failure_threshold
+                if tripped and len(self.endpoints) > 1:
+                    if ep.state(now) != "open":
+                        ep.trips += 1
+                    ep.open_until = now + self.cooldown_s
+            ep.probing = False
+
+    def _failed(self, ep: Endpoint, kind: str, started: float, error: Exception) -> None:
+        if is_outage(error):
+            self._release(ep, kind, started, False)
+            return
+        with self._lock:
+            ep.failures[kind] += 1
+        self._release(ep, kind, started, None)
+
+    def spare(self, exclude: Collection[str]) -> bool:
+        """Whether an endpoint outside ``exclude`` could take a call now."""
+        with self._lock:
+            return bool(self._candidates(time.monotonic(), exclude))
+
+    @contextmanager
+    def lease(self, kind: str, exclude: Collection[str] = ()) -> Iterator[str]:
+        """URL of the endpoint to use for one ``kind`` call ("chat" or "embed"); the outcome feeds the breaker."""
+        ep = self._acquire(kind, exclude)
+        started = time.monotonic()
+        try:
+            yield ep.url
+        except GeneratorExit:
+            self._release(ep, kind, started, None)
+            raise
+        except Exception as e:
+            self._failed(ep, kind, started, e)
+            raise
+        self._release(ep, kind, started, True)
+
+    @asynccontextmanager
+    async def alease(self, kind: str, exclude: Collection[str] = ()) -> AsyncIterator[str]:
+        ep = self._acquire(kind, exclude)
+        started = time.monotonic()
+        try:
+            yield ep.url
+        except (asyncio.CancelledError, GeneratorExit):
+            self._release(ep, kind, started, None)
+            raise
+        except Exception as e:
+            self._failed(ep, kind, started, e)
+            raise
+        self._release(ep, kind, started, True)
+
+    def run(self, kind: str, fn: Callable[[str], T]) -> T:
+        """``fn(url)`` on the best endpoint, retried once on another if it hits an outage."""
+        tried: set = set()
+        try:
+            with self.lease(kind) as url:
+                tried.add(url)
+                return fn(url)
+        except Exception as e:
+            if not tried or not is_outage(e) or not self.spare(tried):
+                raise
+        with self.lease(kind, tried) as url:
+            return fn(url)
+
+    async def call(self, kind: str, fn: Callable[[str], Awaitable[T]], hedge: bool = False) -> T:
+        """Async ``run``; with ``hedge`` a slow first attempt is raced against a second endpoint."""
+        tried: set = set()
+
+        async def attempt() -> T:
+            async with self.alease(kind, tried) as url:
+                tried.add(url)
+                return await fn(url)
+
+        tasks = [asyncio.ensure_future(attempt())]
+        delay = self.hedge_after_ms / 1000 if hedge and self.hedge_after_ms > 0 and len(self.endpoints) > 1 else None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if not self.spare(tried):
+                    return await tasks[0]
+                self.hedged += 1
+                tasks.append(asyncio.ensure_future(attempt()))
+                pending = set(tasks)
+                error: Optional[BaseException] = None
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is tasks[1]:
+                                self.hedge_wins += 1
+                            return task.result()
+                        error = task.exception()
+                raise error
+            error = tasks[0].exception()
+            if error is None or not tried or not is_outage(error) or not self.spare(tried):
+                return tasks[0].result()
+            return await attempt()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def check(self) -> None:
+        """Probe every endpoint's ``/api/version`` once."""
+        async with httpx.AsyncClient(timeout=self.health_timeout_s) as client:
+            await asyncio.gather(*(self._probe(client, ep) for ep in self.endpoints))
+
+    async def _probe(self, client: httpx.AsyncClient, ep: Endpoint) -> None:
+        try:
+            healthy = (await client.get(f"{ep.url}/api/version")).status_code == 200
+        except Exception as e:
+            logger.warning("Health check of %s failed: %r", ep.url, e)
+            healthy = False
+        with self._lock:
+            ep.healthy = healthy
+            ep.checked = time.time()
+
+    async def _health_loop(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                # A dead loop would leave unhealthy endpoints unhealthy for good.
+                logger.exception("Ollama health check failed")
+            await asyncio.sleep(self.health_interval_s)
+
+    def start(self) -> None:
+        """Start periodic health checks on the running event loop (no-op when the interval is 0)."""
+        if self.health_interval_s > 0 and self._health_task is None:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        task, self._health_task = self._health_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "endpoints": {ep.url: ep.to_dict(now) for ep in self.endpoints},
+                "available": len(self._candidates(now, ())),
+                "rejected": self.rejected,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            }
+
+class PooledEmbeddings(Embeddings):
+    """Embeddings spread over a pool; async calls are hedged when the pool has ``hedge_after_ms`` set."""
+
+    def __init__(self, pool: OllamaPool, model: str, make: Callable[[str], Embeddings]):
+        self.pool = pool
+        self.model = model
+        self._make = make
+        self._clients: Dict[str, Embeddings] = {}
+
+    def _client(self, url: str) -> Embeddings:
+        client = self._clients.get(url)
+        if client is None:
+            client = self._clients.setdefault(url, self._make(url))
+        return client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.pool.run("embed", lambda url: self._client(url).embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.pool.run("embed", lambda url: self._client(url).embed_query(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.pool.call("embed", lambda url: self._client(url).aembed_documents(texts), hedge=True)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.pool.call("embed", lambda url: self._client(url).aembed_query(text), hedge=True)
@@ -0,0 +1,139 @@
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.documents import Document
+from langchain_core.documents.base import Blob
+
+# Same document-level defaults PyMuPDFLoader puts on every page.
+_DEFAULT_METADATA = {"producer": "PyMuPDF", "creator": "PyMuPDF", "creationdate": ""}
+_PDF_DATE_FORMAT = "D:%Y%m%d%H%M%S%z"
+
+def page_count(data: bytes) -> int:
+    import pymupdf
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        return len(doc)
+
+def _document_metadata(doc: Any, source: str) -> Dict[str, Any]:
+    """Document-level metadata in PyMuPDFLoader's shape: lower-case keys, ISO dates, raw PDF dates kept."""
+    metadata: Dict[str, Any] = {**_DEFAULT_METADATA, "source": source, "file_path": source, "total_pages": len(doc)}
+    for key, value in doc.metadata.items():
+        if not isinstance(value, (str, int)):
+            continue
+        key = key.lower()
+        if key in ("creationdate", "moddate"):
+            try:
+                value = datetime.strptime(value.replace("'", ""), _PDF_DATE_FORMAT).isoformat("T")
+            except ValueError:
+                pass
+        elif isinstance(value, str):
+            value = value.strip()
+        metadata[key] = value
+    for key in ("modDate", "creationDate"):
+        if key in doc.metadata:
+            metadata[key] = doc.metadata[key]
+    return metadata
+
+def extract_pages(pdf: Union[bytes, str], source: str, start: int, stop: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """Text and metadata of pages [start, stop) of ``pdf`` (bytes or a file path), as PyMuPDFLoader would produce them.
+
+    Runs in a worker process; returns plain tuples because they pickle cheaper than Documents.
+    """
+    import pymupdf
+
+    with (pymupdf.open(pdf) if isinstance(pdf, str) else pymupdf.open(stream=pdf, filetype="pdf")) as doc:
+        metadata = _document_metadata(doc, source)
+        return [(doc[i].get_text().strip(), {**metadata, "page": i}) for i in range(start, stop)]
+
+def _import_parsers() -> None:
+    import pymupdf  # noqa: F401
+
+def _fallback_pages(data: bytes, source: str) -> Iterator[Document]:
+    from langchain_community.document_loaders.parsers import PyPDFParser
+    yield from PyPDFParser().lazy_parse(Blob.from_data(data, path=source))
+
+class PdfPageReader:
+    """Parse PDFs from memory, spreading page ranges over a pool of worker processes.
+
+    PyMuPDF holds the GIL (and langchain's parser adds a global lock), so
+    threads cannot parse in parallel; processes can. Each document is cut into
+    at most ``2 * workers`` ranges of at least ``pages_per_task`` pages and
+    written once to a temporary file that every worker opens, so the bytes
+    are not pickled into each task. Pages come back in document order. With ``workers <= 1`` pages are parsed in the calling thread. If
+    PyMuPDF fails on a document, at any page, pypdf parses the pages not
+    yielded yet.
+    """
+
+    def __init__(self, workers: int, pages_per_task: int = 16):
+        self.workers = workers
+        self.pages_per_task = max(1, pages_per_task)
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # "spawn": forking a process that already runs threads can deadlock the child.
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def warm(self) -> None:
+        """Start the workers (and their imports) in the background, ahead of the first upload."""
+        if self.workers > 1:
+            pool = self._executor()
+            for _ in range(self.workers):
+                pool.submit(_import_parsers)
+
+    def ranges(self, pages: int) -> List[Tuple[int, int]]:
+        tasks = max(1, min(math.ceil(pages / self.pages_per_task), 2 * max(self.workers, 1)))
+        size = math.ceil(pages / tasks) if pages else 0
+        return [(start, min(start + size, pages)) for start in range(0, pages, size)] if size else []
+
+    def iter_pages(self, data: bytes, source: str) -> Iterator[Document]:
+        done = 0
+        try:
+            for page in self._iter_pymupdf(data, source):
+                yield page
+                done += 1
+        except Exception:
+            for i, page in enumerate(_fallback_pages(data, source)):
+                if i >= done:
+                    yield page
+
+    def _iter_pymupdf(self, data: bytes, source: str) -> Iterator[Document]:
+        ranges = self.ranges(page_count(data))
+        if self.workers <= 1 or len(ranges) <= 1:
+            for start, stop in ranges:
+                for text, metadata in extract_pages(data, source, start, stop):
+                    yield Document(page_content=text, metadata=metadata)
+            return
+        pool = self._executor()
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        futures: List[Future] = []
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            futures = [pool.submit(extract_pages, path, source, start, stop) for start, stop in ranges]
+            for future in futures:
+                for text, metadata in future.result():
+                    yield Document(page_content=text, metadata=metadata)
+        finally:
+            for future in futures:
+                future.cancel()
+            # Ranges already being parsed finish with the file before it goes.
+            wait(futures)
+            os.remove(path)
+
+    def load(self, data: bytes, source: str) -> List[Document]:
+        return list(self.iter_pages(data, source))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
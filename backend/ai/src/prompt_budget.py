@@ -0,0 +1,122 @@
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+CHARS_PER_TOKEN = 4.0
+
+FORMULA_BLOCK_RE = re.compile(
+    r"\\\[.*?\\\]|\$\$.*?\$\$|\\begin\{(?P<env>[A-Za-z]+\*?)\}.*?\\end\{(?P=env)\}",
+    re.S,
+)
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z\\(\[])|\n\s*\n")
+FORMULA_START = ("\\[", "$$", "\\begin{")
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token on English/LaTeX text)."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1 if text else 0
+
+def _sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_BREAK_RE.split(text) if s and s.strip()]
+
+def split_units(text: str) -> List[str]:
+    """Split a chunk into sentences, keeping display formulas and environments whole."""
+    units: List[str] = []
+    last = 0
+    for m in FORMULA_BLOCK_RE.finditer(text):
+        units += _sentences(text[last:m.start()])
+        units.append(m.group(0).strip())
+        last = m.end()
+    units += _sentences(text[last:])
+    return units
+
+def _join_units(units: List[str]) -> str:
+    out: List[str] = []
+    for unit in units:
+        if out:
+            formula = unit.startswith(FORMULA_START) or out[-1].startswith(FORMULA_START)
+            out.append("\n" if formula else " ")
+        out.append(unit)
+    return "".join(out)
+
+def context_heading(i: int, doc: Document) -> str:
+    md = doc.metadata or {}
+    src = md.get("source") or md.get("file_path") or md.get("source_id") or "doc"
+    page = md.get("page")
+    return f"[S{i}] source={src}" + (f" page={page}" if page is not None else "")
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+class ContextPlan:
+    """Fits retrieved chunks into a token budget for the RAG prompt.
+
+    If all chunks fit, the context is the plain numbered list. Otherwise the
+    chunks are split into sentences and formula blocks, ``pending`` lists the
+    texts to embed in one batch (the question first when no query vector is
+    known), and ``finish`` keeps the units most similar to the question. Kept
+    units stay in document order under their original ``[S#]`` heading, so
+    citations still map onto the full source list.
+    """
+
+    def __init__(
+        self,
+        question: str,
+        docs: List[Document],
+        budget: Optional[int],
+        query_vector: Optional[Sequence[float]] = None,
+    ):
+        self.question = question
+        self.docs = docs
+        self.budget = None if budget is None else max(budget, 0)
+        self.query_vector = query_vector
+        self.headings = [context_heading(i, d) for i, d in enumerate(docs, start=1)]
+        self.full = "\n".join(f"{h}\n{d.page_content}\n" for h, d in zip(self.headings, docs))
+        self.fits = self.budget is None or estimate_tokens(self.full) <= self.budget
+        self.units: List[Tuple[int, str]] = []
+        if not self.fits:
+            self.units = [(i, u) for i, d in enumerate(docs) for u in split_units(d.page_content)]
+
+    def pending(self) -> List[str]:
+        if not self.units:
+            return []
+        texts = [u for _, u in self.units]
+        return texts if self.query_vector else [self.question] + texts
+
+    def finish(self, vectors: Sequence[Sequence[float]]) -> Tuple[str, Dict[str, Any]]:
+        stats = {"compressed": False, "units": len(self.units), "units_kept": len(self.units)}
+        if not self.units:
+            return self.full, {**stats, "context_tokens": estimate_tokens(self.full)}
+
+        if self.query_vector:
+            query = self.query_vector
+        else:
+            query, vectors = vectors[0], vectors[1:]
+        scores = _normalize(np.asarray(vectors, dtype=np.float32)) @ _normalize(np.asarray(query, dtype=np.float32))
+
+        kept = set()
+        opened = set()
+        used = 0
+        for idx in np.argsort(-scores, kind="stable"):
+            doc_idx, unit = self.units[idx]
+            cost = estimate_tokens(unit)
+            if doc_idx not in opened:
+                cost += estimate_tokens(self.headings[doc_idx]) + 1
+            # Skip units that don't fit; a shorter, less similar one still might.
+            if used + cost > self.budget:
+                continue
+            kept.add(int(idx))
+            opened.add(doc_idx)
+            used += cost
+
+        blocks = []
+        for doc_idx, heading in enumerate(self.headings):
+            units = [u for idx, (i, u) in enumerate(self.units) if i == doc_idx and idx in kept]
+            if units:
+                blocks.append(f"{heading}\n{_join_units(units)}\n")
+        context = "\n".join(blocks)
+        stats.update(compressed=True, units_kept=len(kept), context_tokens=estimate_tokens(context))
+        return context, stats
@@ -0,0 +1,224 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .metrics import Histogram
+
+_Key = Tuple[int, str]
+
+class _Waiter:
+    __slots__ = ("key", "enqueued", "grant", "granted")
+
+    def __init__(self, key: _Key, grant: Callable[[], None]):
+        self.key = key
+        self.enqueued = time.monotonic()
+        self.grant = grant
+        self.granted = False
+
+class _Queue(deque):
+    def __init__(self, since: float):
+        super().__init__()
+        # When this queue last got a slot (or first started waiting).
+        self.since = since
+
+class Scheduler:
+    """Admission control for Ollama work (generation and embedding).
+
+    At most ``max_concurrent`` slots are held at once. Everyone else waits in
+    a FIFO per (priority, tenant); the queue that has gone longest without a
+    slot is served next, so one busy user cannot starve the others. A lower
+    priority number wins, but a queue gains one level per ``aging_s`` seconds
+    of waiting so batch work still moves under steady interactive load.
+
+    Async callers are rejected with 429 when the queue (or their tenant's
+    share of it) is full, and with 503 when they are not admitted before their
+    timeout; both carry a Retry-After estimate. Blocking callers (ingest
+    worker threads) are never rejected for a full queue.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_queue_per_tenant: int, aging_s: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant or max_queue
+        self.aging_s = aging_s
+        self._lock = threading.Lock()
+        self._queues: "OrderedDict[_Key, _Queue]" = OrderedDict()
+        self._per_tenant: Dict[str, int] = {}
+        self._hold_s = 1.0
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_ms = Histogram([1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000])
+
+    def _retry_after(self) -> int:
+        slots = max(self.max_concurrent, 1)
+        return max(1, math.ceil(self._hold_s * (self.waiting + 1) / slots))
+
+    def _reject(self, status: int, detail: str) -> HTTPException:
+        return HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(self._retry_after())})
+
+    def _full(self, tenant: str) -> Optional[HTTPException]:
+        if self.waiting >= self.max_queue:
+            return self._reject(429, "Generation queue is full.")
+        if self._per_tenant.get(tenant, 0) >= self.max_queue_per_tenant:
+            return self._reject(429, "Too many queued requests for this user.")
+        return None
+
+    def _free(self) -> bool:
+        return self.max_concurrent <= 0 or (self.running < self.max_concurrent and self.waiting == 0)
+
+    def _enqueue(self, tenant: str, priority: int, grant: Callable[[], None], bounded: bool) -> Optional[_Waiter]:
+        """Take a slot now (returns None) or queue a waiter; call with the lock held."""
+        if self._free():
+            self.running += 1
+            self.admitted += 1
+            self.wait_ms.observe(0.0)
+            return None
+        if bounded:
+            error = self._full(tenant)
+            if error is not None:
+                self.rejected += 1
+                raise error
+        key = (priority, tenant)
+        waiter = _Waiter(key, grant)
+        if key not in self._queues:
+            self._queues[key] = _Queue(waiter.enqueued)
+        self._queues[key].append(waiter)
+        self._per_tenant[tenant] = self._per_tenant.get(tenant, 0) + 1
+        self.waiting += 1
+        return waiter
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.key]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.key]
+        self._forget(waiter)
+
+    def _forget(self, waiter: _Waiter) -> None:
+        tenant = waiter.key[1]
+        self._per_tenant[tenant] -= 1
+        if not self._per_tenant[tenant]:
+            del self._per_tenant[tenant]
+        self.waiting -= 1
+
+    def _next(self) -> Optional[_Waiter]:
+        if not self._queues:
+            return None
+        now = time.monotonic()
+
+        def rank(item: Tuple[_Key, _Queue]) -> Tuple[float, float]:
+            (priority, _), queue = item
+            age = now - queue.since
+            return (priority - age / self.aging_s if self.aging_s > 0 else priority, -age)
+
+        key, queue = min(self._queues.items(), key=rank)
+        waiter = queue.popleft()
+        del self._queues[key]
+        if queue:
+            queue.since = now
+            self._queues[key] = queue
+        self._forget(waiter)
+        waiter.granted = True
+        self.admitted += 1
+        self.wait_ms.observe((now - waiter.enqueued) * 1000.0)
+        return waiter
+
+    def release(self, held_s: float = 0.0) -> None:
+        with self._lock:
+            if held_s > 0:
+                self._hold_s = 0.8 * self._hold_s + 0.2 * held_s
+            waiter = self._next()
+            if waiter is None:
+                self.running -= 1
+        # The slot passes straight to the next waiter.
+        if waiter is not None:
+            waiter.grant()
+
+    def _expired(self, waiter: _Waiter) -> bool:
+        """Drop a waiter that gave up; False if it was granted a slot in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._dequeue(waiter)
+            self.expired += 1
+            return True
+
+    async def acquire(self, tenant: str, priority: int = 0, timeout: Optional[float] = None) -> float:
+        """Wait for a slot; returns the seconds spent queued."""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def grant() -> None:
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+        with self._lock:
+            waiter = self._enqueue(tenant, priority, grant, bounded=True)
+        if waiter is None:
+            return 0.0
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            if self._expired(waiter):
+                with self._lock:
+                    raise self._reject(503, f"Not admitted within {timeout:g}s; the model is busy.")
+        except asyncio.CancelledError:
+            if not self._expired(waiter):
+                self.release()
+            raise
+        return time.monotonic() - waiter.enqueued
+
+    def acquire_blocking(self, tenant: str, priority: int = 0) -> float:
+        ready = threading.Event()
+        with self._lock:
+            waiter = self._enqueue(tenant, priority, ready.set, bounded=False)
+        if waiter is None:
+            return 0.0
+        ready.wait()
+        return time.monotonic() - waiter.enqueued
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, priority: int = 0, timeout: Optional[float] = None) -> AsyncIterator[float]:
+        """Hold a slot for the block; yields the seconds spent queued."""
+        waited = await self.acquire(tenant, priority, timeout)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    @contextmanager
+    def blocking_slot(self, tenant: str, priority: int = 0) -> Iterator[float]:
+        waited = self.acquire_blocking(tenant, priority)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_priority: Dict[int, int] = {}
+            for (priority, _), queue in self._queues.items():
+                by_priority[priority] = by_priority.get(priority, 0) + len(queue)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "waiting": self.waiting,
+                "waiting_by_priority": by_priority,
+                "tenants_waiting": len(self._per_tenant),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "retry_after_s": self._retry_after(),
+                "wait_ms": self.wait_ms.to_dict(),
+            }
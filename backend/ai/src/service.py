@@ -1,105 +1,448 @@
+import asyncio
+import hashlib
 import os
-import tempfile
-from typing import Dict, List, Optional, Any, Tuple
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 import re
+import zipfile
  
 from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from .answer_cache import AnswerCache, Scope, SqliteAnswerCache, make_scope, normalize_question
+from .batch_runs import BatchRunStore, chunk_key
+from .concurrency import run_blocking
+from .diversify import select_diverse
+from .doc_registry import DocumentRegistry, SourceSync
+from .embed_batcher import EmbeddingBatcher
+from .embedding_cache import CachedEmbeddings, EmbeddingStore
+from .fanout import Target, cosine_scores, merge_hits, rank_scores
+from .ingest_jobs import FileProgress, IngestJobManager, JobStore
+from .instrumentation import (
+    LLM_TOKENS, LLM_TOKENS_PER_SECOND, REQUEST_SECONDS, STAGE_SECONDS, SamplingProfiler, record_generation,
+    record_stage, stage,
+)
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .local_vectors import LocalStore, LocalVectorClient
+from .metrics import Exposition
+from .model_registry import LRURegistry
+from .ollama_pool import OllamaPool, PooledEmbeddings
+from .pdf_pages import PdfPageReader
+from .prompt_budget import CHARS_PER_TOKEN, ContextPlan, context_heading, estimate_tokens
+from .scheduler import Scheduler
+from .sessions import Session, SessionStore, SqliteSessionStore
+from .single_flight import SingleFlight
+
  
-def get_config() -> Dict[str, Any]:
+def _load_config() -> Dict[str, Any]:
+    state_dir = os.getenv("AI_STATE_DIR", "state")
     return {
         "chroma_host": os.getenv("CHROMA_HOST", "chroma"),
         "chroma_port": int(os.getenv("CHROMA_PORT", "8000")),
         "collection_name": os.getenv("CHROMA_COLLECTION", "my_collection"),
         "ollama_base_url": os.getenv("OLLAMA_BASE_URL", "http://192.168.88.224:11434"),
+        "ollama_base_urls": [u.strip() for u in os.getenv("OLLAMA_BASE_URLS", "").split(",") if u.strip()],
+        "ollama_failure_threshold": int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3")),
+        "ollama_cooldown": float(os.getenv("OLLAMA_COOLDOWN_S", "30")),
+        "ollama_health_interval": float(os.getenv("OLLAMA_HEALTH_INTERVAL_S", "10")),
+        "ollama_hedge_after_ms": float(os.getenv("OLLAMA_HEDGE_AFTER_MS", "0")),
         "ollama_embed_model": os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text"),
         "ollama_llm_model": os.getenv("OLLAMA_LLM_MODEL", "llama3.1:8b"),
         "chunk_size": int(os.getenv("CHUNK_SIZE", "900")),
         "chunk_overlap": int(os.getenv("CHUNK_OVERLAP", "150")),
         "add_start_index": os.getenv("ADD_START_INDEX", "true").lower() == "true",
+        "request_timeout": float(os.getenv("REQUEST_TIMEOUT_S", "180")),
+        "ingest_timeout": float(os.getenv("INGEST_TIMEOUT_S", "900")),
+        "state_dir": state_dir,
+        "embed_cache_enabled": os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true",
+        "embed_cache_path": os.getenv("EMBED_CACHE_PATH", os.path.join(state_dir, "embeddings.sqlite")),
+        "embed_cache_max_entries": int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "100000")),
+        "ingest_batch_size": int(os.getenv("INGEST_BATCH_SIZE", "64")),
+        "ingest_queue_size": int(os.getenv("INGEST_QUEUE_SIZE", "4")),
+        "ingest_max_jobs": int(os.getenv("INGEST_MAX_JOBS", "2")),
+        "answer_cache_enabled": os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true",
+        "answer_cache_max_entries": int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024")),
+        "answer_cache_max_mb": int(os.getenv("ANSWER_CACHE_MAX_MB", "64")),
+        "answer_cache_ttl": float(os.getenv("ANSWER_CACHE_TTL_S", "3600")),
+        "answer_cache_semantic_threshold": float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0")),
+        "retrieval_mode": os.getenv("RETRIEVAL_MODE", "vector"),
+        "retrieval_fetch_k": int(os.getenv("RETRIEVAL_FETCH_K", "20")),
+        "rrf_k": int(os.getenv("RRF_K", "60")),
+        "mmr_lambda": float(os.getenv("MMR_LAMBDA", "1.0")),
+        "dedup_threshold": float(os.getenv("DEDUP_THRESHOLD", "0.95")),
+        "prompt_token_budget": int(os.getenv("PROMPT_TOKEN_BUDGET", "3000")),
+        "history_token_budget": int(os.getenv("HISTORY_TOKEN_BUDGET", "600")),
+        "history_max_messages": int(os.getenv("HISTORY_MAX_MESSAGES", "12")),
+        "lexical_index_path": os.getenv("LEXICAL_INDEX_PATH", os.path.join(state_dir, "lexical.sqlite")),
+        "embed_batch_enabled": os.getenv("EMBED_BATCH_ENABLED", "true").lower() == "true",
+        "embed_batch_window_ms": float(os.getenv("EMBED_BATCH_WINDOW_MS", "5")),
+        "embed_batch_max_size": int(os.getenv("EMBED_BATCH_MAX_SIZE", "32")),
+        "model_cache_size": int(os.getenv("MODEL_CACHE_SIZE", "4")),
+        "store_cache_size": int(os.getenv("STORE_CACHE_SIZE", "32")),
+        "coalesce_enabled": os.getenv("COALESCE_REQUESTS", "true").lower() == "true",
+        "llm_max_concurrent": int(os.getenv("LLM_MAX_CONCURRENT", "2")),
+        "llm_queue_size": int(os.getenv("LLM_QUEUE_SIZE", "32")),
+        "llm_queue_per_tenant": int(os.getenv("LLM_QUEUE_PER_TENANT", "8")),
+        "llm_queue_timeout": float(os.getenv("LLM_QUEUE_TIMEOUT_S", "30")),
+        "scheduler_aging_s": float(os.getenv("SCHEDULER_AGING_S", "10")),
+        "embed_max_concurrent": int(os.getenv("EMBED_MAX_CONCURRENT", "4")),
+        "embed_queue_size": int(os.getenv("EMBED_QUEUE_SIZE", "64")),
+        "ask_priority": int(os.getenv("ASK_PRIORITY", "0")),
+        "query_priority": int(os.getenv("QUERY_PRIORITY", "1")),
+        "ingest_priority": int(os.getenv("INGEST_PRIORITY", "2")),
+        "profile_slow_ms": float(os.getenv("PROFILE_SLOW_MS", "0")),
+        "profile_interval_ms": float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+        "profile_dir": os.getenv("PROFILE_DIR", os.path.join(state_dir, "profiles")),
+        "vector_backend": os.getenv("VECTOR_BACKEND", "chroma"),
+        "local_vector_path": os.getenv("LOCAL_VECTOR_PATH", os.path.join(state_dir, "vectors")),
+        "local_vector_dtype": os.getenv("LOCAL_VECTOR_DTYPE", "float32"),
+        "hnsw_min_size": int(os.getenv("HNSW_MIN_SIZE", "0")),
+        "prefilter_dim": int(os.getenv("PREFILTER_DIM", "0")),
+        "prefilter_int8": os.getenv("PREFILTER_INT8", "true").lower() == "true",
+        "prefilter_candidates": int(os.getenv("PREFILTER_CANDIDATES", "200")),
+        "max_upload_mb": float(os.getenv("MAX_UPLOAD_MB", "100")),
+        "pdf_parse_workers": int(os.getenv("PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1)))),
+        "pdf_pages_per_task": int(os.getenv("PDF_PAGES_PER_TASK", "16")),
+        "session_max": int(os.getenv("SESSION_MAX", "10000")),
+        "session_ttl": float(os.getenv("SESSION_TTL_S", "86400")),
+        "session_summary_enabled": os.getenv("SESSION_SUMMARY", "true").lower() == "true",
+        "session_summary_tokens": int(os.getenv("SESSION_SUMMARY_TOKENS", "250")),
+        "summary_priority": int(os.getenv("SUMMARY_PRIORITY", "3")),
+        "shared_state": os.getenv("SHARED_STATE", "false").lower() == "true",
+        "answer_cache_path": os.getenv("ANSWER_CACHE_PATH", os.path.join(state_dir, "answers.sqlite")),
+        "session_path": os.getenv("SESSION_PATH", os.path.join(state_dir, "sessions.sqlite")),
+        "job_store_path": os.getenv("JOB_STORE_PATH", os.path.join(state_dir, "jobs.sqlite")),
+        "fanout_max_collections": int(os.getenv("FANOUT_MAX_COLLECTIONS", "8")),
+        "batch_runs_path": os.getenv("BATCH_RUNS_PATH", os.path.join(state_dir, "batch_runs.sqlite")),
+        "batch_keep_runs": int(os.getenv("BATCH_KEEP_RUNS", "50")),
+        "batch_max_questions": int(os.getenv("BATCH_MAX_QUESTIONS", "2000")),
+        "batch_concurrency": int(os.getenv("BATCH_CONCURRENCY", "2")),
+        "batch_priority": int(os.getenv("BATCH_PRIORITY", "2")),
+        "batch_queue_timeout": float(os.getenv("BATCH_QUEUE_TIMEOUT_S", "0")),
+        "batch_timeout": float(os.getenv("BATCH_TIMEOUT_S", "3600")),
     }
 
-_EMB = None
-_LLM = None
-_SPLITTER = None
-_STORES: Dict[Tuple[str, int, str], Chroma] = {}
+_CONFIG: Optional[Dict[str, Any]] = None
+
+def get_config() -> Dict[str, Any]:
+    """Settings read from the environment once per process; callers get a copy they may modify."""
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = _load_config()
+    return dict(_CONFIG)
+
+# Collection metadata keys that override the global settings for that collection.
+COLLECTION_SETTINGS = {
+    "embed_model": "ollama_embed_model",
+    "llm_model": "ollama_llm_model",
+    "chunk_size": "chunk_size",
+    "chunk_overlap": "chunk_overlap",
+}
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+_INSTANCES: Dict[str, LRURegistry] = {}
+_EMBED_STORE: Optional[EmbeddingStore] = None
+_ANSWER_CACHE: Optional[Union[AnswerCache, SqliteAnswerCache]] = None
+_JOBS: Optional[IngestJobManager] = None
+_REGISTRY: Optional[DocumentRegistry] = None
+_LEXICAL: Optional[LexicalIndex] = None
+_LEXICAL_READY: set = set()
+_FLIGHTS: Optional[SingleFlight] = None
+_SCHEDULER: Optional[Scheduler] = None
+_EMBED_SCHEDULER: Optional[Scheduler] = None
+_PROFILER: Optional[SamplingProfiler] = None
+_LOCAL_VECTORS: Optional[LocalVectorClient] = None
+_PDF_READER: Optional[PdfPageReader] = None
+_SESSIONS: Optional[Union[SessionStore, SqliteSessionStore]] = None
+_SUMMARY_TASKS: set = set()
+_OLLAMA_POOL: Optional[OllamaPool] = None
+_BATCH_RUNS: Optional[BatchRunStore] = None
 
 from chromadb import Client
 from chromadb.config import Settings
+from chromadb.errors import NotFoundError
+
+_CHROMA_CLIENT: Optional[Client] = None
+
+def get_chroma_client() -> Client:
+    # Connecting checks that the server is up, so it is left to the first use.
+    global _CHROMA_CLIENT
+    if _CHROMA_CLIENT is None:
+        cfg = get_config()
+        _CHROMA_CLIENT = Client(Settings(
+            chroma_api_impl="chromadb.api.fastapi.FastAPI",
+            chroma_server_host=cfg["chroma_host"],
+            chroma_server_http_port=cfg["chroma_port"],
+            allow_reset=False,
+        ))
+    return _CHROMA_CLIENT
+
+def _local_vectors() -> LocalVectorClient:
+    global _LOCAL_VECTORS
+    if _LOCAL_VECTORS is None:
+        cfg = get_config()
+        _LOCAL_VECTORS = LocalVectorClient(
+            cfg["local_vector_path"],
+            dtype=cfg["local_vector_dtype"],
+            hnsw_min_size=cfg["hnsw_min_size"],
+            prefilter_dim=cfg["prefilter_dim"],
+            prefilter_int8=cfg["prefilter_int8"],
+            prefilter_candidates=cfg["prefilter_candidates"],
+        )
+    return _LOCAL_VECTORS
+
+def get_vector_client():
+    """The Chroma client, or the embedded store when VECTOR_BACKEND=local."""
+    backend = get_config()["vector_backend"]
+    if backend == "local":
+        return _local_vectors()
+    if backend != "chroma":
+        raise ValueError(f"Unknown vector backend '{backend}'; use 'chroma' or 'local'.")
+    return get_chroma_client()
+
+def _instances(kind: str) -> LRURegistry:
+    if kind not in _INSTANCES:
+        cfg = get_config()
+        size = cfg["store_cache_size"] if kind in ("stores", "collections") else cfg["model_cache_size"]
+        _INSTANCES.setdefault(kind, LRURegistry(kind, size))
+    return _INSTANCES[kind]
 
-chroma_client = Client(Settings(
-    chroma_api_impl="chromadb.api.fastapi.FastAPI",
-    chroma_server_host=os.getenv("CHROMA_HOST", "chroma"),
-    chroma_server_http_port=int(os.getenv("CHROMA_PORT", "8000")),
-    allow_reset=False,
-))
+def _collection_metadata(collection_name: str) -> Dict[str, Any]:
+    def load() -> Dict[str, Any]:
+        return dict(get_vector_client().get_collection(name=collection_name).metadata or {})
+    try:
+        return _instances("collections").get(collection_name, load)
+    except (NotFoundError, ValueError):
+        # Not cached: another worker may create it, with its own settings, at any moment.
+        return {}
 
-def create_collection(collection_name):
-    collection = chroma_client.get_or_create_collection(name=collection_name)
+def resolve_config(collection_name: Optional[str] = None) -> Dict[str, Any]:
+    """Global settings with the collection's own models and chunking (from its metadata) applied."""
+    cfg = get_config()
+    if collection_name:
+        cfg["collection_name"] = collection_name
+    metadata = _collection_metadata(cfg["collection_name"])
+    for key, setting in COLLECTION_SETTINGS.items():
+        if metadata.get(key) is not None:
+            cfg[setting] = metadata[key]
+    return cfg
+
+def create_collection(collection_name, settings: Optional[Dict[str, Any]] = None):
+    """Create a collection; ``settings`` (see COLLECTION_SETTINGS) only apply to a new collection."""
+    metadata = {key: settings[key] for key in COLLECTION_SETTINGS if settings and settings.get(key) is not None}
+    collection = get_vector_client().get_or_create_collection(name=collection_name, metadata=metadata or None)
+    _instances("collections").invalidate(collection_name)
     return {
-        "id": collection.id,"name": collection.name
+        "id": collection.id,"name": collection.name, "metadata": collection.metadata
     }
 
 def get_collections():
-    collections = chroma_client.list_collections()
+    collections = get_vector_client().list_collections()
     return collections
 
-def get_collection_data(collection_name):
-    collection = chroma_client.get_or_create_collection(name=collection_name)
-    collection_data = collection.get(include=["documents", "metadatas", "uris"])
+COLLECTION_FIELDS = {"documents": "document", "metadatas": "metadata", "uris": "uri", "embeddings": "embedding"}
+DEFAULT_COLLECTION_FIELDS = ["documents", "metadatas", "uris"]
+
+def get_collection_data(
+    collection_name: str,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    include: Optional[List[str]] = None,
+    where: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """One page of a collection; ``next_offset`` is None on the last page."""
+    include = list(include or DEFAULT_COLLECTION_FIELDS)
+    unknown = [field for field in include if field not in COLLECTION_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}.")
+    collection = get_vector_client().get_or_create_collection(name=collection_name)
+    data = collection.get(include=include, limit=limit, offset=offset or None, where=where or None)
 
-    return collection_data
+    page: Dict[str, Any] = {"ids": data["ids"]}
+    for field in include:
+        values = data[field]
+        page[field] = [v.tolist() for v in values] if field == "embeddings" else values
+    full = limit is not None and len(data["ids"]) == limit
+    page.update(included=include, limit=limit, offset=offset, next_offset=offset + limit if full else None)
+    return page
 
-def get_embeddings(ollama_base_url: str, model: str) -> OllamaEmbeddings:
-    global _EMB
-    if _EMB is None:
-        _EMB = OllamaEmbeddings(base_url=ollama_base_url, model=model)
-    return _EMB
+async def aexport_collection(
+    collection_name: str,
+    include: Optional[List[str]] = None,
+    where: Optional[Dict[str, Any]] = None,
+    batch_size: int = 500,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield one record per chunk, reading the collection ``batch_size`` rows at a time.
+
+    Pages are fetched by offset, so chunks added or deleted during the export
+    may be skipped or repeated.
+    """
+    include = list(include or DEFAULT_COLLECTION_FIELDS)
+    offset: Optional[int] = 0
+    while offset is not None:
+        page = await run_blocking(
+            get_collection_data, collection_name, limit=batch_size, offset=offset, include=include, where=where,
+        )
+        for i, cid in enumerate(page["ids"]):
+            yield {"id": cid, **{COLLECTION_FIELDS[field]: page[field][i] for field in include}}
+        offset = page["next_offset"]
+
+def _embedding_store() -> EmbeddingStore:
+    global _EMBED_STORE
+    if _EMBED_STORE is None:
+        cfg = get_config()
+        _EMBED_STORE = EmbeddingStore(cfg["embed_cache_path"], max_entries=cfg["embed_cache_max_entries"])
+    return _EMBED_STORE
+
+def get_ollama_pool() -> OllamaPool:
+    """Ollama servers from OLLAMA_BASE_URLS (or just OLLAMA_BASE_URL), shared by every chat and embedding call."""
+    global _OLLAMA_POOL
+    if _OLLAMA_POOL is None:
+        cfg = get_config()
+        _OLLAMA_POOL = OllamaPool(
+            cfg["ollama_base_urls"] or [cfg["ollama_base_url"]],
+            failure_threshold=cfg["ollama_failure_threshold"],
+            cooldown_s=cfg["ollama_cooldown"],
+            health_interval_s=cfg["ollama_health_interval"],
+            hedge_after_ms=cfg["ollama_hedge_after_ms"],
+        )
+    return _OLLAMA_POOL
+
+def ollama_stats() -> Dict[str, Any]:
+    return get_ollama_pool().stats()
+
+def _build_embeddings(ollama_base_url: str, model: str) -> Embeddings:
+    # ``ollama_base_url`` only keys the instance; the pool decides which server embeds.
+    emb: Embeddings = PooledEmbeddings(
+        get_ollama_pool(), model, lambda url: OllamaEmbeddings(base_url=url, model=model),
+    )
+    if get_config()["embed_cache_enabled"]:
+        # One cache file for all models: keys already include the model name.
+        emb = CachedEmbeddings(emb, model, _embedding_store())
+    return emb
+
+def get_embeddings(ollama_base_url: str, model: str) -> Embeddings:
+    return _instances("embeddings").get(
+        (ollama_base_url, model), lambda: _build_embeddings(ollama_base_url, model),
+    )
  
 def get_llm(ollama_base_url: str, model: str) -> ChatOllama:
-    global _LLM
-    if _LLM is None:
-        _LLM = ChatOllama(base_url=ollama_base_url, model=model, temperature=0.0)
-    return _LLM
+    return _instances("llms").get(
+        (ollama_base_url, model), lambda: ChatOllama(base_url=ollama_base_url, model=model, temperature=0.0),
+    )
  
+def get_scheduler() -> Scheduler:
+    """Admission control for Ollama generations (see ``Scheduler``)."""
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        cfg = get_config()
+        _SCHEDULER = Scheduler(
+            max_concurrent=cfg["llm_max_concurrent"],
+            max_queue=cfg["llm_queue_size"],
+            max_queue_per_tenant=cfg["llm_queue_per_tenant"],
+            aging_s=cfg["scheduler_aging_s"],
+        )
+    return _SCHEDULER
+
+def get_embed_scheduler() -> Scheduler:
+    """Admission control for embedding calls, kept apart so they never wait behind generations."""
+    global _EMBED_SCHEDULER
+    if _EMBED_SCHEDULER is None:
+        cfg = get_config()
+        _EMBED_SCHEDULER = Scheduler(
+            max_concurrent=cfg["embed_max_concurrent"],
+            max_queue=cfg["embed_queue_size"],
+            max_queue_per_tenant=0,
+            aging_s=cfg["scheduler_aging_s"],
+        )
+    return _EMBED_SCHEDULER
+
+@asynccontextmanager
+async def _ollama_slot(
+    cfg: Dict[str, Any],
+    kind: str,
+    tenant: Optional[str] = None,
+    embed: bool = False,
+) -> AsyncIterator[None]:
+    """Async slot for Ollama work of ``kind`` ("ask", "query", "ingest", "summary" or "batch").
+
+    Tenants default to the collection. A kind with its own ``<kind>_queue_timeout``
+    setting waits that long instead of ``llm_queue_timeout``. Embedding calls
+    (``embed``) take their slot from the embedding scheduler.
+    """
+    scheduler = get_embed_scheduler() if embed else get_scheduler()
+    timeout = cfg.get(f"{kind}_queue_timeout", cfg["llm_queue_timeout"])
+    async with scheduler.slot(tenant or cfg["collection_name"], cfg[f"{kind}_priority"], timeout or None) as waited:
+        record_stage(kind, "queue", waited)
+        yield
+
+@contextmanager
+def _blocking_ollama_slot(
+    cfg: Dict[str, Any],
+    kind: str,
+    tenant: Optional[str] = None,
+    embed: bool = False,
+) -> Iterator[None]:
+    scheduler = get_embed_scheduler() if embed else get_scheduler()
+    with scheduler.blocking_slot(tenant or cfg["collection_name"], cfg[f"{kind}_priority"]) as waited:
+        record_stage(kind, "queue", waited)
+        yield
+
 def get_splitter(chunk_size: int, chunk_overlap: int, add_start_index: bool) -> RecursiveCharacterTextSplitter:
-    global _SPLITTER
-    if _SPLITTER is None:
-        _SPLITTER = RecursiveCharacterTextSplitter(
+    return _instances("splitters").get(
+        (chunk_size, chunk_overlap, add_start_index),
+        lambda: RecursiveCharacterTextSplitter(
             chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=add_start_index,
-        )
-    return _SPLITTER
+        ),
+    )
  
 def get_store(
     collection_name: str,
     chroma_host: str,
     chroma_port: int,
-    embeddings: OllamaEmbeddings
+    embeddings: Embeddings
 ) -> Chroma:
-    key = (chroma_host, chroma_port, collection_name)
-    if key not in _STORES:
-        _STORES[key] = Chroma(
+    if get_config()["vector_backend"] == "local":
+        return _instances("stores").get(
+            ("local", collection_name, getattr(embeddings, "model", None)),
+            lambda: LocalStore(_local_vectors().get_or_create_collection(name=collection_name), embeddings),
+        )
+    key = (chroma_host, chroma_port, collection_name, getattr(embeddings, "model", None))
+    return _instances("stores").get(
+        key,
+        lambda: Chroma(
             collection_name=collection_name,
             embedding_function=embeddings,
             host=chroma_host,
             port=chroma_port,
-        )
-    return _STORES[key]
+        ),
+    )
  
-def load_pdf(path: str) -> List[Document]:
-    try:
-        from langchain_community.document_loaders import PyMuPDFLoader 
-        loader = PyMuPDFLoader(path)
-        return loader.load()
-    except Exception:
-        from langchain_community.document_loaders import PyPDFLoader
-        loader = PyPDFLoader(path)
-        return loader.load()
+def get_pdf_reader() -> PdfPageReader:
+    global _PDF_READER
+    if _PDF_READER is None:
+        cfg = get_config()
+        _PDF_READER = PdfPageReader(cfg["pdf_parse_workers"], cfg["pdf_pages_per_task"])
+    return _PDF_READER
+
+def load_pdf(file_bytes: bytes, filename: str) -> List[Document]:
+    """All pages of an in-memory PDF, parsed in parallel page ranges (see ``PdfPageReader``)."""
+    return get_pdf_reader().load(file_bytes, os.path.basename(filename))
+
+def iter_pdf_pages(path: str) -> Iterator[Document]:
+    """Page-by-page variant of ``load_pdf`` for the bulk ingestion pipeline."""
+    with open(path, "rb") as f:
+        data = f.read()
+    yield from get_pdf_reader().iter_pages(data, os.path.basename(path))
 
 RAG_PROMPT = ChatPromptTemplate.from_template(
     """You are a helpful math assistant.
@@ -138,57 +481,446 @@ Answer (in ENGLISH only):"""
 )
 
  
+_TEMPLATE_TOKENS = estimate_tokens(RAG_PROMPT.format(question="", context="", chat_history=""))
+
 def _format_context(docs: List[Document]) -> str:
     lines = []
     for i, d in enumerate(docs, start=1):
-        md = d.metadata or {}
-        src = md.get("source") or md.get("file_path") or md.get("source_id") or "doc"
-        page = md.get("page")
-        heading = f"[S{i}] source={src}" + (f" page={page}" if page is not None else "")
-        lines.append(f"{heading}\n{d.page_content}\n")
+        lines.append(f"{context_heading(i, d)}\n{d.page_content}\n")
     return "\n".join(lines)
 
+def _split_pdf(
+    file_bytes: bytes,
+    filename: str,
+    splitter: RecursiveCharacterTextSplitter,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> List[Document]:
+    docs = splitter.split_documents(load_pdf(file_bytes, filename))
+    for d in docs:
+        md = d.metadata or {}
+        # The registry is keyed on the upload name, without any client-side directories.
+        md["source"] = os.path.basename(filename)
+        md.pop("file_path", None)
+        if metadata:
+            md = {**metadata, **md}
+        d.metadata = md
+    return docs
+
+def _add_embedded(
+    store: Chroma,
+    docs: List[Document],
+    vectors: List[List[float]],
+    kept: Optional[List[Document]] = None,
+) -> List[str]:
+    """Upsert ``docs`` with their vectors; ``kept`` chunks only get their metadata refreshed."""
+    ids = [d.id or str(uuid.uuid4()) for d in docs]
+    if docs:
+        store._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=[d.page_content for d in docs],
+            metadatas=[d.metadata for d in docs],
+        )
+        get_lexical_index().add(store._collection.name, ids, [d.page_content for d in docs])
+    if kept:
+        store._collection.update(ids=[d.id for d in kept], metadatas=[d.metadata for d in kept])
+    return ids
+
+def _remove_chunks(store: Chroma, ids: List[str]) -> None:
+    store.delete(ids=ids)
+    get_lexical_index().remove(store._collection.name, ids)
+
+def get_registry() -> DocumentRegistry:
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = DocumentRegistry(os.path.join(get_config()["state_dir"], "registry.sqlite"))
+    return _REGISTRY
+
+def _plan_document(
+    file_bytes: bytes,
+    filename: str,
+    collection_name: str,
+    splitter: RecursiveCharacterTextSplitter,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Tuple[Optional[SourceSync], List[Document], List[Document], str]:
+    """Diff an upload against the registry: returns (sync, new, kept, digest); sync is None if unchanged."""
+    source = os.path.basename(filename)
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    registry = get_registry()
+    if registry.file_hash(collection_name, source) == digest:
+        return None, [], [], digest
+    sync = SourceSync(registry, collection_name, source)
+    new, kept = sync.assign(_split_pdf(file_bytes, filename, splitter, metadata))
+    return sync, new, kept, digest
+
+def _apply_document(
+    store: Chroma,
+    sync: SourceSync,
+    new: List[Document],
+    vectors: List[List[float]],
+    kept: List[Document],
+    digest: str,
+) -> List[str]:
+    _add_embedded(store, new, vectors, kept)
+    removed = sync.removed()
+    if removed:
+        _remove_chunks(store, removed)
+    sync.commit(digest)
+    _collection_changed(sync.collection)
+    return removed
+
+def _ingest_result(
+    collection_name: str,
+    filename: str,
+    sync: Optional[SourceSync],
+    new: List[Document],
+    kept: List[Document],
+    removed: List[str],
+) -> Dict[str, Any]:
+    source = os.path.basename(filename)
+    ids = list(sync.seen) if sync is not None else get_registry().chunk_ids(collection_name, source)
+    return {
+        "collection": collection_name,
+        "source": source,
+        "unchanged": sync is None,
+        "added": len(new),
+        "kept": len(kept),
+        "removed": len(removed),
+        "ids": ids,
+    }
+
 def ingest_pdf_bytes(
     file_bytes: bytes,
     filename: str,
     collection_name: Optional[str] = None,
     metadata: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
-    cfg = get_config()
+    """Idempotently (re-)ingest one PDF: only changed chunks are embedded, vanished ones are deleted."""
+    cfg = resolve_config(collection_name)
  
     emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
-    store = get_store(collection_name, cfg["chroma_host"], cfg["chroma_port"], emb)
+    store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
     splitter = get_splitter(cfg["chunk_size"], cfg["chunk_overlap"], cfg["add_start_index"])
-    with tempfile.NamedTemporaryFile(delete=True, suffix=f"_{filename}") as tmp:
-        tmp.write(file_bytes)
-        tmp.flush()
-        raw_docs = load_pdf(tmp.name)
 
-    docs = splitter.split_documents(raw_docs)
-    for d in docs:
-        md = d.metadata or {}
-        if "source" not in md:
-            md["source"] = os.path.basename(filename)
-        if metadata:
-            md = {**metadata, **md}
-        d.metadata = md
- 
-    ids = store.add_documents(docs)
-    return {"collection": collection_name, "added": len(ids), "ids": ids}
+    with stage("ingest", "parse"):
+        sync, new, kept, digest = _plan_document(file_bytes, filename, cfg["collection_name"], splitter, metadata)
+    removed: List[str] = []
+    if sync is not None:
+        with _blocking_ollama_slot(cfg, "ingest", embed=True), stage("ingest", "embed"):
+            vectors = emb.embed_documents([d.page_content for d in new]) if new else []
+        with stage("ingest", "upsert"):
+            removed = _apply_document(store, sync, new, vectors, kept, digest)
+    return _ingest_result(cfg["collection_name"], filename, sync, new, kept, removed)
  
+def _embed_batch(collection_name: str, texts: List[str]) -> List[List[float]]:
+    cfg = resolve_config(collection_name)
+    with _blocking_ollama_slot(cfg, "ingest", embed=True), stage("ingest", "embed"):
+        return get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"]).embed_documents(texts)
+
+def _upsert_batch(
+    collection_name: str,
+    docs: List[Document],
+    vectors: List[List[float]],
+    kept: List[Document],
+) -> None:
+    cfg = resolve_config(collection_name)
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = get_store(collection_name, cfg["chroma_host"], cfg["chroma_port"], emb)
+    with stage("ingest", "upsert"):
+        _add_embedded(store, docs, vectors, kept)
+
+def _delete_chunks(collection_name: str, ids: List[str]) -> None:
+    cfg = resolve_config(collection_name)
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = get_store(collection_name, cfg["chroma_host"], cfg["chroma_port"], emb)
+    _remove_chunks(store, ids)
+
+def get_job_manager() -> IngestJobManager:
+    global _JOBS
+    if _JOBS is None:
+        cfg = get_config()
+        _JOBS = IngestJobManager(
+            iter_pages=iter_pdf_pages,
+            embed=_embed_batch,
+            upsert=_upsert_batch,
+            delete=_delete_chunks,
+            registry=get_registry(),
+            on_change=_collection_changed,
+            batch_size=cfg["ingest_batch_size"],
+            queue_size=cfg["ingest_queue_size"],
+            max_jobs=cfg["ingest_max_jobs"],
+            store=JobStore(cfg["job_store_path"]) if cfg["shared_state"] else None,
+        )
+    return _JOBS
+
+def _save_upload(workdir: str, index: int, name: str, stream: BinaryIO) -> str:
+    path = os.path.join(workdir, f"{index:04d}_{os.path.basename(name)}")
+    with open(path, "wb") as out:
+        shutil.copyfileobj(stream, out)
+    return path
+
+def start_ingest_job(
+    uploads: List[Tuple[str, BinaryIO]],
+    collection_name: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Spool PDFs (or PDFs inside zip archives) to disk and queue them as one job."""
+    cfg = resolve_config(collection_name)
+
+    workdir = os.path.join(cfg["state_dir"], "jobs", uuid.uuid4().hex)
+    os.makedirs(workdir, exist_ok=True)
+    files: List[FileProgress] = []
+    try:
+        for name, stream in uploads:
+            lower = (name or "").lower()
+            if lower.endswith(".pdf"):
+                files.append(FileProgress(os.path.basename(name), _save_upload(workdir, len(files), name, stream)))
+            elif lower.endswith(".zip"):
+                with zipfile.ZipFile(stream) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or not member.filename.lower().endswith(".pdf"):
+                            continue
+                        with archive.open(member) as src:
+                            path = _save_upload(workdir, len(files), member.filename, src)
+                        files.append(FileProgress(os.path.basename(member.filename), path))
+            else:
+                raise ValueError(f"Unsupported file '{name}': only PDF and zip files are accepted.")
+        if not files:
+            raise ValueError("No PDF files found in the upload.")
+    except (ValueError, zipfile.BadZipFile):
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    splitter = get_splitter(cfg["chunk_size"], cfg["chunk_overlap"], cfg["add_start_index"])
+    job = get_job_manager().submit(cfg["collection_name"], files, workdir, splitter, metadata)
+    return job.to_dict()
+
+def get_ingest_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return get_job_manager().status(job_id)
+
+def list_ingest_jobs() -> List[Dict[str, Any]]:
+    return [{k: v for k, v in job.items() if k != "files"} for job in get_job_manager().statuses()]
+
+def get_lexical_index() -> LexicalIndex:
+    global _LEXICAL
+    if _LEXICAL is None:
+        _LEXICAL = LexicalIndex(get_config()["lexical_index_path"])
+    return _LEXICAL
+
+def _ensure_lexical(store: Chroma) -> None:
+    """Backfill the lexical index for collections that were ingested before it existed."""
+    name = store._collection.name
+    if name in _LEXICAL_READY:
+        return
+    index = get_lexical_index()
+    if index.count(name) == 0:
+        offset = 0
+        while True:
+            batch = store._collection.get(include=["documents"], limit=500, offset=offset)
+            if not batch["ids"]:
+                break
+            index.add(name, batch["ids"], batch["documents"])
+            offset += len(batch["ids"])
+    _LEXICAL_READY.add(name)
+
+def _get_documents(store: Chroma, ids: List[str], metadata_filter: Optional[Dict[str, Any]]) -> List[Document]:
+    """Fetch chunks by ID, keeping the order of ``ids`` and applying the metadata filter."""
+    if not ids:
+        return []
+    got = store._collection.get(ids=ids, where=metadata_filter or None, include=["documents", "metadatas"])
+    found = {
+        cid: Document(page_content=text, metadata=md or {}, id=cid)
+        for cid, text, md in zip(got["ids"], got["documents"], got["metadatas"])
+    }
+    return [found[cid] for cid in ids if cid in found]
+
+def _retrieval_params(cfg: Dict[str, Any], overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    params = {
+        "mode": cfg["retrieval_mode"],
+        "fetch_k": cfg["retrieval_fetch_k"],
+        "rrf_k": cfg["rrf_k"],
+        "mmr_lambda": cfg["mmr_lambda"],
+        "dedup_threshold": cfg["dedup_threshold"],
+    }
+    params.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    if params["mode"] not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{params['mode']}'.")
+    return params
+
+def _diversifying(params: Dict[str, Any]) -> bool:
+    return params["mmr_lambda"] < 1.0 or params["dedup_threshold"] < 1.0
+
+def _needs_vector(params: Dict[str, Any]) -> bool:
+    # Near-duplicate pruning alone only compares candidates with each other.
+    return params["mode"] != "lexical" or params["mmr_lambda"] < 1.0
+
+def _candidates(
+    store: Chroma,
+    query: str,
+    vector: List[float],
+    n: int,
+    metadata_filter: Optional[Dict[str, Any]],
+    params: Dict[str, Any],
+) -> List[Document]:
+    """Top-n chunks by vector similarity, BM25, or both fused with reciprocal rank fusion."""
+    mode = params["mode"]
+    if mode == "vector":
+        return store.similarity_search_by_vector(vector, k=n, filter=metadata_filter)
+
+    _ensure_lexical(store)
+    fetch_k = max(n, params["fetch_k"])
+    hits = get_lexical_index().search(store._collection.name, query, fetch_k)
+    lexical = _get_documents(store, [cid for cid, _ in hits], metadata_filter)
+    if mode == "lexical":
+        return lexical[:n]
+
+    dense = store.similarity_search_by_vector(vector, k=fetch_k, filter=metadata_filter)
+    by_id = {d.id: d for d in lexical}
+    by_id.update((d.id, d) for d in dense)
+    fused = reciprocal_rank_fusion([[d.id for d in dense], [d.id for d in lexical]], k=params["rrf_k"])
+    return [by_id[cid] for cid in fused[:n]]
+
+def _candidates_with_vectors(
+    store: Chroma,
+    query: str,
+    vector: List[float],
+    n: int,
+    metadata_filter: Optional[Dict[str, Any]],
+    params: Dict[str, Any],
+) -> Tuple[List[Document], List[List[float]]]:
+    if params["mode"] == "vector":
+        got = store._collection.query(
+            query_embeddings=[vector],
+            n_results=n,
+            where=metadata_filter or None,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        docs = [
+            Document(page_content=text, metadata=md or {}, id=cid)
+            for cid, text, md in zip(got["ids"][0], got["documents"][0], got["metadatas"][0])
+        ]
+        return docs, list(got["embeddings"][0])
+
+    docs = _candidates(store, query, vector, n, metadata_filter, params)
+    if not docs:
+        return [], []
+    got = store._collection.get(ids=[d.id for d in docs], include=["embeddings"])
+    by_id = dict(zip(got["ids"], got["embeddings"]))
+    docs = [d for d in docs if d.id in by_id]
+    return docs, [by_id[d.id] for d in docs]
+
+def _search(
+    store: Chroma,
+    query: str,
+    vector: List[float],
+    k: int,
+    metadata_filter: Optional[Dict[str, Any]],
+    params: Dict[str, Any],
+) -> Tuple[List[Document], Dict[str, Any]]:
+    """Return the top-k chunks and a summary of how they were retrieved.
+
+    When diversification is on, ``fetch_k`` candidates are fetched with their
+    embeddings and reduced to ``k`` by MMR and near-duplicate pruning.
+    """
+    docs, _, info = _search_with_vectors(store, query, vector, k, metadata_filter, params)
+    return docs, info
+
+def _search_with_vectors(
+    store: Chroma,
+    query: str,
+    vector: List[float],
+    k: int,
+    metadata_filter: Optional[Dict[str, Any]],
+    params: Dict[str, Any],
+    with_vectors: bool = False,
+) -> Tuple[List[Document], Optional[List[List[float]]], Dict[str, Any]]:
+    """``_search`` plus the chunks' embeddings: those fetched for diversification, or, with ``with_vectors``,
+    fetched along with the candidates. None when neither applies."""
+    info = {"mode": params["mode"], "candidates": 0, "pruned": 0}
+    if not _diversifying(params):
+        if with_vectors:
+            docs, vectors = _candidates_with_vectors(store, query, vector, k, metadata_filter, params)
+        else:
+            docs, vectors = _candidates(store, query, vector, k, metadata_filter, params), None
+        info["candidates"] = len(docs)
+        return docs, vectors, info
+
+    docs, vectors = _candidates_with_vectors(store, query, vector, max(k, params["fetch_k"]), metadata_filter, params)
+    selected, pruned = select_diverse(vector, vectors, k, params["mmr_lambda"], params["dedup_threshold"])
+    info["candidates"] = len(docs)
+    info["pruned"] = pruned
+    return [docs[i] for i in selected], [vectors[i] for i in selected], info
+
+def _embed_key(cfg: Dict[str, Any]) -> Tuple[str, str]:
+    return cfg["ollama_base_url"], cfg["ollama_embed_model"]
+
+def _search_target(
+    target: Target,
+    cfg: Dict[str, Any],
+    query: str,
+    vector: List[float],
+    params: Dict[str, Any],
+    by_rank: bool = False,
+) -> Tuple[List[Document], List[float], Dict[str, Any]]:
+    """One collection of a fan-out search: its top ``target.k`` chunks, their scores and retrieval info.
+
+    In vector mode the score is the chunk's cosine similarity to the query,
+    which is comparable across collections that share an embedding model.
+    BM25 and fused scores are not, so lexical and hybrid hits are scored by
+    rank within their collection instead, as are vector hits when ``by_rank``
+    says the other collections use a different embedding model.
+    """
+    started = time.perf_counter()
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
+    by_vector = params["mode"] == "vector"
+    docs, vectors, info = _search_with_vectors(
+        store, query, vector, target.k, target.metadata_filter, params, with_vectors=by_vector,
+    )
+    if by_vector and not by_rank:
+        scores = cosine_scores(vector, vectors)
+    else:
+        scores = rank_scores(len(docs))
+    info["search_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return docs, scores, info
+
 def similarity_search(
     query: str,
     k: int = 4,
     collection_name: Optional[str] = None,
     metadata_filter: Optional[Dict[str, Any]] = None,
+    retrieval: Optional[Dict[str, Any]] = None,
+    tenant: Optional[str] = None,
 ) -> Dict[str, Any]:
-    cfg = get_config()
-    if collection_name:
-        cfg["collection_name"] = collection_name
+    cfg = resolve_config(collection_name)
+    params = _retrieval_params(cfg, retrieval)
  
     emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
     store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
-    docs = store.similarity_search(query, k=k, filter=metadata_filter)
+    vector = []
+    if _needs_vector(params):
+        with _blocking_ollama_slot(cfg, "query", tenant, embed=True), stage("query", "embed"):
+            vector = emb.embed_query(query)
+    with stage("query", "search"):
+        docs, info = _search(store, query, vector, k, metadata_filter, params)
+    return {
+        "collection": cfg["collection_name"],
+        "k": k,
+        "retrieval": info,
+        "matches": [{"page_content": d.page_content, "metadata": d.metadata} for d in docs],
+    }
+
+def similarity_search_by_vector(
+    vector: List[float],
+    k: int = 4,
+    collection_name: Optional[str] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    cfg = resolve_config(collection_name)
+
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
+    docs = store.similarity_search_by_vector(vector, k=k, filter=metadata_filter)
     return {
         "collection": cfg["collection_name"],
         "k": k,
@@ -199,25 +931,339 @@ def delete_ids(
     ids: List[str],
     collection_name: Optional[str] = None,
 ) -> Dict[str, Any]:
-    cfg = get_config()
-    if collection_name:
-        cfg["collection_name"] = collection_name
+    cfg = resolve_config(collection_name)
  
     emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
     store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
-    store.delete(ids=ids)
+    _remove_chunks(store, ids)
+    get_registry().forget_chunks(cfg["collection_name"], ids)
+    _collection_changed(cfg["collection_name"])
     return {"collection": cfg["collection_name"], "deleted": ids}
 
-def _format_chat_history(history: List[Dict[str, str]], limit:int=12) -> str:
+def delete_sources(
+    sources: List[str],
+    collection_name: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Delete whole documents by source name in one batched store call."""
+    cfg = resolve_config(collection_name)
+
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
+    registry = get_registry()
+    ids = [cid for source in sources for cid in registry.chunk_ids(cfg["collection_name"], source)]
+    if ids:
+        _remove_chunks(store, ids)
+    registry.remove(cfg["collection_name"], sources)
+    _collection_changed(cfg["collection_name"])
+    return {"collection": cfg["collection_name"], "sources": sources, "deleted": ids}
+
+def list_documents(collection_name: Optional[str] = None) -> Dict[str, Any]:
+    cfg = resolve_config(collection_name)
+    return {"collection": cfg["collection_name"], "documents": get_registry().documents(cfg["collection_name"])}
+
+def _format_chat_history(history: List[Dict[str, str]], limit:int=12, max_tokens: Optional[int] = None) -> str:
+    """Format the last ``limit`` messages; with ``max_tokens`` the oldest ones are dropped until it fits."""
     out = []
-    for m in (history or [])[-limit:]:
+    used = 0
+    for m in reversed((history or [])[-limit:]):
         role = (m.get("role") or "user").upper()
         content = (m.get("content") or "").strip()
-        if content:
-            out.append(f"{role}: {content}")
-    return "\n".join(out)
+        if not content:
+            continue
+        line = f"{role}: {content}"
+        used += estimate_tokens(line) + 1
+        if max_tokens is not None and used > max_tokens:
+            break
+        out.append(line)
+    return "\n".join(reversed(out))
+
+def _history_text(
+    history: Optional[List[Dict[str, str]]],
+    cfg: Dict[str, Any],
+    session: Optional[Session] = None,
+) -> str:
+    """The chat history block: the session's summary and recent messages if it has one, else ``history``."""
+    budget = cfg["history_token_budget"] or None
+    if session is None:
+        return _format_chat_history(history or [], limit=cfg["history_max_messages"], max_tokens=budget)
+    summary, recent = session.snapshot()
+    head = f"SUMMARY OF EARLIER CONVERSATION: {summary}" if summary else ""
+    if head and budget is not None:
+        budget = max(budget - estimate_tokens(head) - 1, 0)
+    text = _format_chat_history(recent, limit=cfg["history_max_messages"], max_tokens=budget)
+    return "\n".join(part for part in (head, text) if part)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    """You maintain a running summary of a conversation between a student and a math assistant.
+
+Rewrite the summary so it also covers the new messages. Keep it under {max_words} words, in ENGLISH.
+Keep what later questions may refer to: the topics, definitions, formulas (as LaTeX), results and the student's goals.
+Leave out greetings and repetition. Output only the summary.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+)
+
+def get_sessions() -> Union[SessionStore, SqliteSessionStore]:
+    global _SESSIONS
+    if _SESSIONS is None:
+        cfg = get_config()
+        limits = dict(
+            max_sessions=cfg["session_max"],
+            ttl=cfg["session_ttl"],
+            max_recent=cfg["history_max_messages"],
+            max_pending=4 * cfg["history_max_messages"] if cfg["session_summary_enabled"] else 0,
+        )
+        # With several worker processes the next turn may land anywhere, so the sessions live in a file.
+        _SESSIONS = SqliteSessionStore(cfg["session_path"], **limits) if cfg["shared_state"] else SessionStore(**limits)
+    return _SESSIONS
+
+def open_session(
+    conversation_id: str,
+    tenant: Optional[str] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> Session:
+    """The server-side session of a conversation (see ``SessionStore.open``); raises ``UnknownSession``."""
+    return get_sessions().open((tenant or "", str(conversation_id)), history)
 
-from .latex_postprocess import enforce_tex
+def session_stats() -> Dict[str, Any]:
+    return get_sessions().stats()
+
+def _add_turn(
+    session: Session, cfg: Dict[str, Any], question: str, answer: str,
+) -> Optional[Tuple[str, List[Tuple[str, str]]]]:
+    session.add_turn(question, answer)
+    return session.take_pending() if cfg["session_summary_enabled"] else None
+
+async def _record_turn(session: Session, cfg: Dict[str, Any], tenant: Optional[str], question: str, answer: str) -> None:
+    """Append a turn and, if older messages are waiting, fold them into the summary in the background."""
+    # A shared session lives in SQLite, so it is written off the event loop.
+    claim = await run_blocking(_add_turn, session, cfg, question, answer)
+    if claim is None:
+        return
+    task = asyncio.get_running_loop().create_task(_refresh_summary(session, cfg, tenant, *claim))
+    _SUMMARY_TASKS.add(task)
+    task.add_done_callback(_SUMMARY_TASKS.discard)
+
+async def _refresh_summary(
+    session: Session,
+    cfg: Dict[str, Any],
+    tenant: Optional[str],
+    summary: str,
+    messages: List[Tuple[str, str]],
+) -> None:
+    max_tokens = cfg["session_summary_tokens"]
+    inputs = {
+        "summary": summary or "(empty)",
+        "messages": _format_chat_history([{"role": r, "content": c} for r, c in messages], limit=len(messages)),
+        "max_words": int(max_tokens * 0.75),
+    }
+    updated = None
+    try:
+        async with _ollama_slot(cfg, "summary", tenant), get_ollama_pool().alease("chat") as url:
+            with stage("summary", "generate"):
+                message = await (SUMMARY_PROMPT | get_llm(url, cfg["ollama_llm_model"])).ainvoke(inputs)
+        record_generation("summary", cfg["ollama_llm_model"], message.response_metadata)
+        updated = StrOutputParser().invoke(message).strip()[:int(max_tokens * CHARS_PER_TOKEN)]
+        get_sessions().count("summaries")
+    except Exception:
+        # The messages stay pending and are retried after the next turn.
+        get_sessions().count("summary_failures")
+    finally:
+        await run_blocking(session.finish_summary, updated, len(messages))
+
+from .latex_postprocess import enforce_tex, TexStreamer
+
+def get_answer_cache() -> Optional[Union[AnswerCache, SqliteAnswerCache]]:
+    global _ANSWER_CACHE
+    cfg = get_config()
+    if not cfg["answer_cache_enabled"]:
+        return None
+    if _ANSWER_CACHE is None:
+        limits = dict(
+            max_entries=cfg["answer_cache_max_entries"],
+            max_bytes=cfg["answer_cache_max_mb"] * 1024 * 1024,
+            ttl=cfg["answer_cache_ttl"],
+            semantic_threshold=cfg["answer_cache_semantic_threshold"] or None,
+        )
+        if cfg["shared_state"]:
+            _ANSWER_CACHE = SqliteAnswerCache(cfg["answer_cache_path"], **limits)
+        else:
+            _ANSWER_CACHE = AnswerCache(**limits)
+    return _ANSWER_CACHE
+
+def _collection_changed(collection_name: str) -> None:
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.invalidate(collection_name)
+
+def cache_stats() -> Dict[str, Any]:
+    cache = get_answer_cache()
+    return {
+        "answers": cache.stats() if cache is not None else None,
+        "embeddings": {
+            emb.model: emb.stats() for emb in _instances("embeddings").values() if isinstance(emb, CachedEmbeddings)
+        },
+        "instances": {kind: registry.stats() for kind, registry in _INSTANCES.items()},
+        "coalescing": _FLIGHTS.stats() if _FLIGHTS is not None else None,
+    }
+
+def scheduler_stats() -> Dict[str, Any]:
+    return {**get_scheduler().stats(), "embed": get_embed_scheduler().stats()}
+
+def get_profiler() -> Optional[SamplingProfiler]:
+    """Sampling profiler for slow requests; None unless PROFILE_SLOW_MS is set."""
+    global _PROFILER
+    cfg = get_config()
+    if cfg["profile_slow_ms"] <= 0:
+        return None
+    if _PROFILER is None:
+        _PROFILER = SamplingProfiler(interval_s=cfg["profile_interval_ms"] / 1000.0)
+    return _PROFILER
+
+def render_metrics() -> str:
+    """Everything above (stages, tokens, caches, queues) in the Prometheus text format."""
+    out = Exposition()
+    for labels, hist in REQUEST_SECONDS.items():
+        out.histogram("ai_request_seconds", hist.to_dict(), dict(labels))
+    for labels, hist in STAGE_SECONDS.items():
+        out.histogram("ai_stage_seconds", hist.to_dict(), dict(labels))
+    for labels, value in LLM_TOKENS.items():
+        out.sample("ai_llm_tokens_total", value, dict(labels), kind="counter")
+    for labels, hist in LLM_TOKENS_PER_SECOND.items():
+        out.histogram("ai_llm_tokens_per_second", hist.to_dict(), dict(labels))
+
+    caches = cache_stats()
+    out.stats("ai_answer_cache", caches["answers"])
+    for model, stats in caches["embeddings"].items():
+        out.stats("ai_embedding_cache", stats, {"model": model})
+    for kind, stats in caches["instances"].items():
+        out.stats("ai_instances", stats, {"kind": kind})
+    out.stats("ai_coalescing", caches["coalescing"])
+    for model, stats in batcher_stats()["models"].items():
+        out.stats("ai_embed_batcher", stats, {"model": model})
+    out.stats("ai_scheduler", scheduler_stats())
+    pool = ollama_stats()
+    for url, stats in pool.pop("endpoints").items():
+        out.stats("ai_ollama", stats, {"url": url})
+    out.stats("ai_ollama_pool", pool)
+    out.stats("ai_sessions", session_stats())
+    return out.render()
+
+def _prompt_plan(
+    question: str,
+    docs: List[Document],
+    history_text: str,
+    vector: List[float],
+    cfg: Dict[str, Any],
+) -> ContextPlan:
+    budget = cfg["prompt_token_budget"]
+    fixed = _TEMPLATE_TOKENS + estimate_tokens(question) + estimate_tokens(history_text)
+    return ContextPlan(question, docs, budget - fixed if budget else None, vector or None)
+
+def _rag_inputs(
+    plan: ContextPlan,
+    history_text: str,
+    vectors: List[List[float]],
+    cfg: Dict[str, Any],
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """Finish the context under the budget; returns (prompt inputs, prompt size report)."""
+    context, stats = plan.finish(vectors)
+    history_tokens = estimate_tokens(history_text)
+    tokens = _TEMPLATE_TOKENS + estimate_tokens(plan.question) + history_tokens + stats["context_tokens"]
+    budget = cfg["prompt_token_budget"]
+    report = {
+        "budget": budget or None,
+        "tokens": tokens,
+        "budget_used": round(tokens / budget, 3) if budget else None,
+        "history_tokens": history_tokens,
+        **stats,
+    }
+    inputs = {"question": plan.question, "context": context, "chat_history": history_text}
+    return inputs, report
+
+def _build_prompt(
+    question: str,
+    docs: List[Document],
+    history_text: str,
+    vector: List[float],
+    cfg: Dict[str, Any],
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    plan = _prompt_plan(question, docs, history_text, vector, cfg)
+    texts = plan.pending()
+    vectors: List[List[float]] = []
+    if texts:
+        emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+        vectors = emb.embed_documents(texts)
+    return _rag_inputs(plan, history_text, vectors, cfg)
+
+def _format_sources(docs: List[Document]) -> List[Dict[str, Any]]:
+    return [{"snippet": d.page_content[:500], "metadata": d.metadata} for d in docs]
+
+def _retrieve(
+    question: str,
+    k: int,
+    cfg: Dict[str, Any],
+    metadata_filter: Optional[Dict[str, Any]],
+    scope: Scope,
+    params: Dict[str, Any],
+    tenant: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], List[Document], List[float], Dict[str, Any]]:
+    """Return (cached_answer, docs, query_vector, retrieval_info); docs are only searched on a cache miss."""
+    cache = get_answer_cache()
+    if cache is not None:
+        with stage("ask", "cache"):
+            hit = cache.get(scope, question)
+        if hit is not None:
+            return {**hit, "cached": "exact"}, [], [], {}
+
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
+    if _needs_vector(params):
+        with _blocking_ollama_slot(cfg, "ask", tenant, embed=True), stage("ask", "embed"):
+            vector = emb.embed_query(question)
+    else:
+        vector = []
+    if cache is not None:
+        hit = cache.get_similar(scope, vector) if vector else None
+        if hit is not None:
+            return {**hit, "cached": "semantic"}, [], vector, {}
+        cache.miss()
+
+    with stage("ask", "search"):
+        docs, info = _search(store, question, vector, k, metadata_filter, params)
+    return None, docs, vector, info
+
+def _cache_generation(scope: Scope) -> Optional[Tuple[int, ...]]:
+    """Taken before retrieval, so an answer built from a collection that changed meanwhile is not cached."""
+    cache = get_answer_cache()
+    return cache.generation(scope) if cache is not None else None
+
+def _remember_answer(
+    scope: Scope,
+    question: str,
+    result: Dict[str, Any],
+    vector: List[float],
+    generation: Optional[Tuple[int, ...]] = None,
+) -> Dict[str, Any]:
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.put(scope, question, result, vector or None, generation)
+    return {**result, "cached": False}
+
+async def _aremember_answer(
+    scope: Scope,
+    question: str,
+    result: Dict[str, Any],
+    vector: List[float],
+    generation: Optional[Tuple[int, ...]] = None,
+) -> Dict[str, Any]:
+    return await run_blocking(_remember_answer, scope, question, result, vector, generation)
 
 def ask(
     question: str,
@@ -225,22 +1271,652 @@ def ask(
     collection_name: Optional[str] = None,
     metadata_filter: Optional[Dict[str, Any]] = None,
     history: Optional[List[Dict[str, str]]] = None,
+    retrieval: Optional[Dict[str, Any]] = None,
+    tenant: Optional[str] = None,
 ) -> Dict[str, Any]:
-    cfg = get_config()
-    if collection_name:
-        cfg["collection_name"] = collection_name
+    cfg = resolve_config(collection_name)
+    params = _retrieval_params(cfg, retrieval)
  
-    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
-    llm = get_llm(cfg["ollama_base_url"], cfg["ollama_llm_model"])
-    store = get_store(cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
- 
-    docs = store.similarity_search(question, k=k, filter=metadata_filter)
-    chat_history_str = _format_chat_history(history or [])
+    history_text = _history_text(history, cfg)
+    scope = make_scope(cfg["collection_name"], k, metadata_filter, history_text, params)
+
+    generation = _cache_generation(scope)
+    cached, docs, vector, info = _retrieve(question, k, cfg, metadata_filter, scope, params, tenant)
+    if cached is not None:
+        return cached
 
-    context = _format_context(docs)
-    chain = RAG_PROMPT | llm | StrOutputParser()
-    answer = chain.invoke({"question": question, "context": context, "chat_history": chat_history_str}).strip()
-    answer = enforce_tex(answer)
+    with _blocking_ollama_slot(cfg, "ask", tenant):
+        with stage("ask", "prompt"):
+            inputs, prompt = _build_prompt(question, docs, history_text, vector, cfg)
+        with get_ollama_pool().lease("chat") as url, stage("ask", "generate"):
+            message = (RAG_PROMPT | get_llm(url, cfg["ollama_llm_model"])).invoke(inputs)
+    record_generation("ask", cfg["ollama_llm_model"], message.response_metadata)
+    with stage("ask", "tex"):
+        answer = enforce_tex(StrOutputParser().invoke(message).strip())
  
-    sources = [{"snippet": d.page_content[:500], "metadata": d.metadata} for d in docs]
-    return {"collection": cfg["collection_name"], "k": k, "answer": answer, "sources": sources}
+    sources = _format_sources(docs)
+    result = {
+        "collection": cfg["collection_name"],
+        "k": k,
+        "answer": answer,
+        "sources": sources,
+        "retrieval": info,
+        "prompt": prompt,
+    }
+    return _remember_answer(scope, question, result, vector, generation)
+
+# Async service layer: used by the FastAPI handlers so that a slow generation
+# never blocks the event loop. Ollama calls are native async (and therefore
+# cancellable); Chroma access and CPU-bound work go through the bounded pool.
+
+def _query_batcher(cfg: Dict[str, Any]) -> EmbeddingBatcher:
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    return _instances("batchers").get(
+        (cfg["ollama_base_url"], cfg["ollama_embed_model"]),
+        lambda: EmbeddingBatcher(
+            emb,
+            max_batch=cfg["embed_batch_max_size"],
+            window_ms=cfg["embed_batch_window_ms"],
+            # One slot per merged call, not per query; the batch is shared, so the model is the tenant.
+            slot=lambda: _ollama_slot(cfg, "query", cfg["ollama_embed_model"], embed=True),
+        ),
+    )
+
+async def _aembed_query(cfg: Dict[str, Any], text: str, tenant: Optional[str] = None) -> List[float]:
+    """Embed a query, batched with queries from concurrent requests for the same model."""
+    if not cfg["embed_batch_enabled"]:
+        emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+        async with _ollama_slot(cfg, "query", tenant, embed=True):
+            return await emb.aembed_query(text)
+    return await _query_batcher(cfg).embed_query(text)
+
+def get_flights() -> SingleFlight:
+    """Coalesces identical concurrent questions (same scope, same normalized text)."""
+    global _FLIGHTS
+    if _FLIGHTS is None:
+        _FLIGHTS = SingleFlight()
+    return _FLIGHTS
+
+def batcher_stats() -> Dict[str, Any]:
+    batchers = _INSTANCES.get("batchers")
+    return {
+        "enabled": get_config()["embed_batch_enabled"],
+        "models": {getattr(b.embeddings, "model", "?"): b.stats() for b in (batchers.values() if batchers else [])},
+    }
+
+async def aingest_pdf_bytes(
+    file_bytes: bytes,
+    filename: str,
+    collection_name: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    cfg = await run_blocking(resolve_config, collection_name)
+
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = await run_blocking(get_store, cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
+    splitter = get_splitter(cfg["chunk_size"], cfg["chunk_overlap"], cfg["add_start_index"])
+
+    with stage("ingest", "parse"):
+        sync, new, kept, digest = await run_blocking(
+            _plan_document, file_bytes, filename, cfg["collection_name"], splitter, metadata,
+        )
+    removed: List[str] = []
+    if sync is not None:
+        vectors = []
+        if new:
+            async with _ollama_slot(cfg, "ingest", embed=True):
+                with stage("ingest", "embed"):
+                    vectors = await emb.aembed_documents([d.page_content for d in new])
+        with stage("ingest", "upsert"):
+            removed = await run_blocking(_apply_document, store, sync, new, vectors, kept, digest)
+    return _ingest_result(cfg["collection_name"], filename, sync, new, kept, removed)
+
+async def asimilarity_search(
+    query: str,
+    k: int = 4,
+    collection_name: Optional[str] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    retrieval: Optional[Dict[str, Any]] = None,
+    tenant: Optional[str] = None,
+) -> Dict[str, Any]:
+    cfg = await run_blocking(resolve_config, collection_name)
+    params = _retrieval_params(cfg, retrieval)
+
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = await run_blocking(get_store, cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
+    vector = []
+    if _needs_vector(params):
+        with stage("query", "embed"):
+            vector = await _aembed_query(cfg, query, tenant)
+    with stage("query", "search"):
+        docs, info = await run_blocking(_search, store, query, vector, k, metadata_filter, params)
+    return {
+        "collection": cfg["collection_name"],
+        "k": k,
+        "retrieval": info,
+        "matches": [{"page_content": d.page_content, "metadata": d.metadata} for d in docs],
+    }
+
+async def adelete_ids(
+    ids: List[str],
+    collection_name: Optional[str] = None,
+) -> Dict[str, Any]:
+    return await run_blocking(delete_ids, ids, collection_name=collection_name)
+
+async def adelete_sources(
+    sources: List[str],
+    collection_name: Optional[str] = None,
+) -> Dict[str, Any]:
+    return await run_blocking(delete_sources, sources, collection_name=collection_name)
+
+async def _aembed_targets(
+    query: str,
+    cfgs: List[Dict[str, Any]],
+    params: Dict[str, Any],
+    tenant: Optional[str] = None,
+) -> Dict[Tuple[str, str], List[float]]:
+    """The query embedded once per distinct embedding model among ``cfgs``, concurrently."""
+    if not _needs_vector(params):
+        return {}
+    models: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for cfg in cfgs:
+        models.setdefault(_embed_key(cfg), cfg)
+
+    vectors = await asyncio.gather(*(_aembed_query(cfg, query, tenant) for cfg in models.values()))
+    return dict(zip(models, vectors))
+
+async def _asearch_targets(
+    query: str,
+    k: int,
+    targets: List[Target],
+    cfgs: List[Dict[str, Any]],
+    vectors: Dict[Tuple[str, str], List[float]],
+    params: Dict[str, Any],
+) -> Tuple[List[Document], List[float], Dict[str, Any]]:
+    """Search all targets at once and merge them into one top-``k`` (docs, scores, retrieval info).
+
+    Each returned chunk names its collection in ``metadata["collection"]``.
+    Cosine scores from different embedding models are not comparable, so
+    when the targets don't share one, every collection is scored by rank.
+    """
+    by_rank = len({_embed_key(cfg) for cfg in cfgs}) > 1
+    results = await asyncio.gather(*(
+        run_blocking(_search_target, target, cfg, query, vectors.get(_embed_key(cfg), []), params, by_rank)
+        for target, cfg in zip(targets, cfgs)
+    ))
+    merged = merge_hits([(target.name, docs, scores) for target, (docs, scores, _) in zip(targets, results)], k)
+    docs = [
+        Document(page_content=doc.page_content, metadata={**doc.metadata, "collection": name}, id=doc.id)
+        for name, doc, _ in merged
+    ]
+    per_collection = {target.name: {**info, "hits": 0} for target, (_, _, info) in zip(targets, results)}
+    for name, _, _ in merged:
+        per_collection[name]["hits"] += 1
+    info = {
+        "mode": params["mode"],
+        "scores": "cosine" if params["mode"] == "vector" and not by_rank else "rank",
+        "candidates": sum(i["candidates"] for i in per_collection.values()),
+        "pruned": sum(i["pruned"] for i in per_collection.values()),
+        "collections": per_collection,
+    }
+    return docs, [score for _, _, score in merged], info
+
+async def asimilarity_search_many(
+    query: str,
+    targets: List[Target],
+    k: int = 4,
+    retrieval: Optional[Dict[str, Any]] = None,
+    tenant: Optional[str] = None,
+) -> Dict[str, Any]:
+    """``asimilarity_search`` over several collections, merged into a single top-``k``."""
+    cfgs = list(await asyncio.gather(*(run_blocking(resolve_config, t.name) for t in targets)))
+    params = _retrieval_params(cfgs[0], retrieval)
+    with stage("query", "embed"):
+        vectors = await _aembed_targets(query, cfgs, params, tenant)
+    with stage("query", "search"):
+        docs, scores, info = await _asearch_targets(query, k, targets, cfgs, vectors, params)
+    return {
+        "collections": [t.to_dict() for t in targets],
+        "k": k,
+        "retrieval": info,
+        "matches": [
+            {"page_content": d.page_content, "metadata": d.metadata, "score": round(score, 4)}
+            for d, score in zip(docs, scores)
+        ],
+    }
+
+async def _aretrieve(
+    question: str,
+    k: int,
+    cfg: Dict[str, Any],
+    metadata_filter: Optional[Dict[str, Any]],
+    scope: Scope,
+    params: Dict[str, Any],
+    targets: Optional[List[Target]] = None,
+    tenant: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], List[Document], List[float], Dict[str, Any]]:
+    # With shared state the answer cache is a SQLite file, so every lookup goes through the pool.
+    cache = get_answer_cache()
+    if cache is not None:
+        with stage("ask", "cache"):
+            hit = await run_blocking(cache.get, scope, question)
+        if hit is not None:
+            return {**hit, "cached": "exact"}, [], [], {}
+
+    if targets:
+        cfgs = list(await asyncio.gather(*(run_blocking(resolve_config, t.name) for t in targets)))
+        with stage("ask", "embed"):
+            vectors = await _aembed_targets(question, cfgs, params, tenant)
+        vector = vectors.get(_embed_key(cfg), [])
+    else:
+        emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+        store = await run_blocking(get_store, cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb)
+        with stage("ask", "embed"):
+            vector = await _aembed_query(cfg, question, tenant) if _needs_vector(params) else []
+    if cache is not None:
+        hit = await run_blocking(cache.get_similar, scope, vector) if vector else None
+        if hit is not None:
+            return {**hit, "cached": "semantic"}, [], vector, {}
+        await run_blocking(cache.miss)
+
+    with stage("ask", "search"):
+        if targets:
+            docs, _, info = await _asearch_targets(question, k, targets, cfgs, vectors, params)
+        else:
+            docs, info = await run_blocking(_search, store, question, vector, k, metadata_filter, params)
+    return None, docs, vector, info
+
+def _answer_scope(
+    cfg: Dict[str, Any],
+    k: int,
+    metadata_filter: Optional[Dict[str, Any]],
+    history_text: str,
+    params: Dict[str, Any],
+    targets: Optional[List[Target]],
+) -> Scope:
+    if not targets:
+        return make_scope(cfg["collection_name"], k, metadata_filter, history_text, params)
+    # A fan-out answer is invalidated by a change to any of its collections (see AnswerCache.invalidate).
+    names = ",".join(t.name for t in targets)
+    return make_scope(names, k, {"targets": [t.to_dict() for t in targets]}, history_text, params)
+
+def _answer_collections(cfg: Dict[str, Any], targets: Optional[List[Target]]) -> Dict[str, Any]:
+    head: Dict[str, Any] = {"collection": cfg["collection_name"]}
+    if targets:
+        head["collections"] = [t.name for t in targets]
+    return head
+
+async def _abuild_prompt(
+    question: str,
+    docs: List[Document],
+    history_text: str,
+    vector: List[float],
+    cfg: Dict[str, Any],
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    plan = await run_blocking(_prompt_plan, question, docs, history_text, vector, cfg)
+    texts = plan.pending()
+    vectors: List[List[float]] = []
+    if texts:
+        emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+        vectors = await emb.aembed_documents(texts)
+    return await run_blocking(_rag_inputs, plan, history_text, vectors, cfg)
+
+async def aask(
+    question: str,
+    k: int = 4,
+    collection_name: Optional[str] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    retrieval: Optional[Dict[str, Any]] = None,
+    tenant: Optional[str] = None,
+    session: Optional[Session] = None,
+    targets: Optional[List[Target]] = None,
+) -> Dict[str, Any]:
+    """Answer ``question``; with a ``session`` its history replaces ``history`` and the turn is recorded.
+
+    With ``targets`` the context comes from all of those collections (see
+    ``asimilarity_search_many``) and the first one's models answer.
+    """
+    cfg = await run_blocking(resolve_config, targets[0].name if targets else collection_name)
+    params = _retrieval_params(cfg, retrieval)
+    history_text = await run_blocking(_history_text, history, cfg, session)
+    scope = _answer_scope(cfg, k, metadata_filter, history_text, params, targets)
+
+    answer = lambda: _aanswer(question, k, cfg, metadata_filter, history_text, scope, params, tenant, targets)
+    if not cfg["coalesce_enabled"]:
+        result = await answer()
+    else:
+        result, leader = await get_flights().do((scope, normalize_question(question)), answer)
+        result = result if leader else {**result, "coalesced": True}
+    if session is not None:
+        await _record_turn(session, cfg, tenant, question, result["answer"])
+    return result
+
+async def _agenerate(
+    op: str,
+    question: str,
+    docs: List[Document],
+    history_text: str,
+    vector: List[float],
+    cfg: Dict[str, Any],
+    tenant: Optional[str] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Prompt and generate the answer to ``question`` from ``docs``; returns (answer, prompt report)."""
+    async with _ollama_slot(cfg, op, tenant):
+        with stage(op, "prompt"):
+            inputs, prompt = await _abuild_prompt(question, docs, history_text, vector, cfg)
+        async with get_ollama_pool().alease("chat") as url:
+            with stage(op, "generate"):
+                message = await (RAG_PROMPT | get_llm(url, cfg["ollama_llm_model"])).ainvoke(inputs)
+    record_generation(op, cfg["ollama_llm_model"], message.response_metadata)
+    with stage(op, "tex"):
+        answer = await run_blocking(enforce_tex, StrOutputParser().invoke(message).strip())
+    return answer, prompt
+
+async def _aanswer(
+    question: str,
+    k: int,
+    cfg: Dict[str, Any],
+    metadata_filter: Optional[Dict[str, Any]],
+    history_text: str,
+    scope: Scope,
+    params: Dict[str, Any],
+    tenant: Optional[str] = None,
+    targets: Optional[List[Target]] = None,
+) -> Dict[str, Any]:
+    generation = await run_blocking(_cache_generation, scope)
+    cached, docs, vector, info = await _aretrieve(question, k, cfg, metadata_filter, scope, params, targets, tenant)
+    if cached is not None:
+        return cached
+
+    answer, prompt = await _agenerate("ask", question, docs, history_text, vector, cfg, tenant)
+    sources = _format_sources(docs)
+    result = {
+        **_answer_collections(cfg, targets),
+        "k": k,
+        "answer": answer,
+        "sources": sources,
+        "retrieval": info,
+        "prompt": prompt,
+    }
+    return await _aremember_answer(scope, question, result, vector, generation)
+
+async def aask_stream(
+    question: str,
+    k: int = 4,
+    collection_name: Optional[str] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    retrieval: Optional[Dict[str, Any]] = None,
+    tenant: Optional[str] = None,
+    session: Optional[Session] = None,
+    targets: Optional[List[Target]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Streaming variant of ``aask``.
+
+    Yields a ``start`` frame, then ``token`` frames carrying post-processed
+    answer text as soon as it is closed (see ``TexStreamer``), and finally a
+    ``done`` frame with the full answer and the sources. Closing the
+    generator aborts the Ollama stream once no other request shares it.
+    """
+    cfg = await run_blocking(resolve_config, targets[0].name if targets else collection_name)
+    params = _retrieval_params(cfg, retrieval)
+    history_text = await run_blocking(_history_text, history, cfg, session)
+    scope = _answer_scope(cfg, k, metadata_filter, history_text, params, targets)
+
+    frames = lambda: _aanswer_stream(
+        question, k, cfg, metadata_filter, history_text, scope, params, tenant, targets,
+    )
+    if cfg["coalesce_enabled"]:
+        stream = get_flights().stream((scope, normalize_question(question)), frames)
+    else:
+        stream = frames()
+    try:
+        async for frame in stream:
+            if session is not None and frame["type"] == "done":
+                await _record_turn(session, cfg, tenant, question, frame["answer"])
+            yield frame
+    finally:
+        await stream.aclose()
+
+async def _aanswer_stream(
+    question: str,
+    k: int,
+    cfg: Dict[str, Any],
+    metadata_filter: Optional[Dict[str, Any]],
+    history_text: str,
+    scope: Scope,
+    params: Dict[str, Any],
+    tenant: Optional[str] = None,
+    targets: Optional[List[Target]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    generation = await run_blocking(_cache_generation, scope)
+    cached, docs, vector, info = await _aretrieve(question, k, cfg, metadata_filter, scope, params, targets, tenant)
+    start = {"type": "start", **_answer_collections(cfg, targets), "k": k}
+    if cached is not None:
+        yield start
+        yield {"type": "token", "text": cached["answer"]}
+        yield {"type": "done", **cached}
+        return
+
+    # ``start`` is only sent once admitted and given a server, so a rejection can still be a plain HTTP error.
+    async with _ollama_slot(cfg, "ask", tenant), get_ollama_pool().alease("chat") as url:
+        yield start
+        with stage("ask", "prompt"):
+            inputs, prompt = await _abuild_prompt(question, docs, history_text, vector, cfg)
+        parser = StrOutputParser()
+        streamer = TexStreamer()
+        parts: List[str] = []
+        with stage("ask", "generate"):
+            async for chunk in (RAG_PROMPT | get_llm(url, cfg["ollama_llm_model"])).astream(inputs):
+                if chunk.response_metadata.get("eval_count"):
+                    record_generation("ask", cfg["ollama_llm_model"], chunk.response_metadata)
+                text = streamer.feed(parser.invoke(chunk))
+                if text:
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+            text = streamer.flush()
+            if text:
+                parts.append(text)
+                yield {"type": "token", "text": text}
+
+    result = {
+        **_answer_collections(cfg, targets),
+        "k": k,
+        "answer": "".join(parts),
+        "sources": _format_sources(docs),
+        "retrieval": info,
+        "prompt": prompt,
+    }
+    yield {"type": "done", **(await _aremember_answer(scope, question, result, vector, generation))}
+
+def get_batch_runs() -> BatchRunStore:
+    global _BATCH_RUNS
+    if _BATCH_RUNS is None:
+        cfg = get_config()
+        _BATCH_RUNS = BatchRunStore(cfg["batch_runs_path"], keep_runs=cfg["batch_keep_runs"])
+    return _BATCH_RUNS
+
+def batch_spec(
+    questions: List[Dict[str, str]],
+    k: int = 4,
+    collection_name: Optional[str] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    retrieval: Optional[Dict[str, Any]] = None,
+    targets: Optional[List[Target]] = None,
+) -> Dict[str, Any]:
+    """Everything that decides a batch's answers; a resumed run must repeat it exactly (or leave it out)."""
+    return {
+        "questions": questions,
+        "k": k,
+        "collection": None if targets else collection_name,
+        "collections": [t.to_dict() for t in targets] if targets else None,
+        "filter": metadata_filter,
+        "retrieval": {key: value for key, value in (retrieval or {}).items() if value is not None},
+    }
+
+def open_batch_run(spec: Optional[Dict[str, Any]], run_id: Optional[str] = None) -> Dict[str, Any]:
+    return get_batch_runs().open(spec, run_id)
+
+def batch_run_status(run_id: str) -> Optional[Dict[str, Any]]:
+    return get_batch_runs().status(run_id)
+
+async def _aembed_many(
+    texts: List[str],
+    cfgs: List[Dict[str, Any]],
+    params: Dict[str, Any],
+    tenant: Optional[str] = None,
+) -> Dict[Tuple[str, str], List[List[float]]]:
+    """``texts`` embedded in one call per distinct embedding model among ``cfgs``."""
+    if not texts or not _needs_vector(params):
+        return {}
+    models: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for cfg in cfgs:
+        models.setdefault(_embed_key(cfg), cfg)
+
+    async def embed(cfg: Dict[str, Any]) -> List[List[float]]:
+        async with _ollama_slot(cfg, "batch", tenant, embed=True):
+            return await get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"]).aembed_documents(texts)
+
+    vectors = await asyncio.gather(*(embed(cfg) for cfg in models.values()))
+    return dict(zip(models, vectors))
+
+async def aask_batch(
+    run: Dict[str, Any],
+    tenant: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    replay: bool = True,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Answer the questions of a batch ``run`` (see ``BatchRunStore.open``), yielding frames as answers finish.
+
+    Frames are ``start``, then a ``chunk`` the first time a source chunk
+    appears, a ``result`` per question whose ``sources`` are chunk ids (or an
+    ``error``), and ``done``. With ``replay`` the answers saved by earlier
+    attempts of the run are sent first; only the others are generated.
+
+    Questions that miss the answer cache are embedded in one call per
+    embedding model and searched concurrently; generations run at most
+    ``concurrency`` at a time (capped by BATCH_CONCURRENCY), and a question
+    asked twice is answered once. Every answer is saved before it is sent, so
+    closing the stream only loses the generations still in flight.
+    """
+    spec = run["spec"]
+    questions = spec["questions"]
+    saved = run["results"]
+    targets = [Target(t["name"], t["k"], t["filter"]) for t in spec["collections"]] if spec["collections"] else None
+    cfg = await run_blocking(resolve_config, targets[0].name if targets else spec["collection"])
+    cfgs = list(await asyncio.gather(*(run_blocking(resolve_config, t.name) for t in targets))) if targets else [cfg]
+    params = _retrieval_params(cfg, spec["retrieval"])
+    k, metadata_filter = spec["k"], spec["filter"]
+    scope = _answer_scope(cfg, k, metadata_filter, "", params, targets)
+    emb = get_embeddings(cfg["ollama_base_url"], cfg["ollama_embed_model"])
+    store = None if targets else await run_blocking(
+        get_store, cfg["collection_name"], cfg["chroma_host"], cfg["chroma_port"], emb,
+    )
+    cache = get_answer_cache()
+    semaphore = asyncio.Semaphore(max(1, min(concurrency or cfg["batch_concurrency"], cfg["batch_concurrency"])))
+    sent: set = set()
+
+    def frames(index: int, result: Dict[str, Any], **extra: Any) -> Iterator[Dict[str, Any]]:
+        keys = []
+        for source in result["sources"]:
+            key = chunk_key(source)
+            keys.append(key)
+            if key not in sent:
+                sent.add(key)
+                yield {"type": "chunk", "id": key, **source}
+        yield {"type": "result", "index": index, **questions[index], **result, "sources": keys, **extra}
+
+    async def answer(
+        indices: List[int],
+        question: str,
+        hit: Optional[Dict[str, Any]],
+        vectors: Dict[Tuple[str, str], List[float]],
+    ) -> Tuple[List[int], Optional[Dict[str, Any]], Optional[str]]:
+        try:
+            result = hit
+            vector = vectors.get(_embed_key(cfg), [])
+            if result is None and cache is not None and vector:
+                similar = await run_blocking(cache.get_similar, scope, vector)
+                result = {**similar, "cached": "semantic"} if similar is not None else None
+            if result is None:
+                if cache is not None:
+                    await run_blocking(cache.miss)
+                generation = await run_blocking(_cache_generation, scope)
+                with stage("batch", "search"):
+                    if targets:
+                        docs, _, info = await _asearch_targets(question, k, targets, cfgs, vectors, params)
+                    else:
+                        docs, info = await run_blocking(_search, store, question, vector, k, metadata_filter, params)
+                async with semaphore:
+                    text, prompt = await _agenerate("batch", question, docs, "", vector, cfg, tenant)
+                result = await _aremember_answer(scope, question, {
+                    **_answer_collections(cfg, targets),
+                    "k": k,
+                    "answer": text,
+                    "sources": _format_sources(docs),
+                    "retrieval": info,
+                    "prompt": prompt,
+                }, vector, generation)
+            await run_blocking(get_batch_runs().save, run["id"], indices, result)
+            return indices, result, None
+        except Exception as e:
+            return indices, None, getattr(e, "detail", None) or str(e) or type(e).__name__
+
+    yield {
+        "type": "start",
+        "run_id": run["id"],
+        **_answer_collections(cfg, targets),
+        "k": k,
+        "total": len(questions),
+        "saved": len(saved),
+    }
+    if replay:
+        for index in sorted(saved):
+            for frame in frames(index, saved[index], replayed=True):
+                yield frame
+
+    # The same question (after normalization) is answered once for all its indices.
+    groups: Dict[str, List[int]] = {}
+    for index, q in enumerate(questions):
+        if index not in saved:
+            groups.setdefault(normalize_question(q["question"]), []).append(index)
+    texts = [questions[indices[0]]["question"] for indices in groups.values()]
+    hits: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+    if cache is not None and texts:
+        with stage("batch", "cache"):
+            cached = await run_blocking(lambda: [cache.get(scope, t) for t in texts])
+            hits = [{**hit, "cached": "exact"} if hit else None for hit in cached]
+    misses = [i for i, hit in enumerate(hits) if hit is None]
+    with stage("batch", "embed"):
+        embedded = await _aembed_many([texts[i] for i in misses], cfgs, params, tenant)
+    vectors: List[Dict[Tuple[str, str], List[float]]] = [{} for _ in texts]
+    for position, i in enumerate(misses):
+        vectors[i] = {key: model_vectors[position] for key, model_vectors in embedded.items()}
+
+    answered = failed = 0
+    tasks = [
+        asyncio.ensure_future(answer(indices, text, hit, vecs))
+        for indices, text, hit, vecs in zip(groups.values(), texts, hits, vectors)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indices, result, error = await next_done
+            for index in indices:
+                if error is None:
+                    answered += 1
+                    for frame in frames(index, result):
+                        yield frame
+                else:
+                    failed += 1
+                    yield {"type": "error", "index": index, **questions[index], "detail": error}
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield {
+        "type": "done",
+        "run_id": run["id"],
+        "total": len(questions),
+        "answered": len(saved) + answered,
+        "failed": failed,
+    }
@@ -0,0 +1,323 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .sqlite_util import transaction
+
+Message = Tuple[str, str]
+
+class UnknownSession(LookupError):
+    """The conversation is not (or no longer) held here and the caller sent no history to rebuild it."""
+
+def _append(recent: List[Message], pending: List[Message], message: Message, max_recent: int, max_pending: int) -> int:
+    """Append to ``recent``, moving overflow to ``pending``; returns how many pending messages were dropped."""
+    recent.append(message)
+    while len(recent) > max_recent:
+        pending.append(recent.pop(0))
+    dropped = max(len(pending) - max_pending, 0)
+    # Summaries are failing or falling behind; forget the oldest rather than grow.
+    del pending[:dropped]
+    return dropped
+
+def _history_messages(history: List[Dict[str, str]]) -> List[Message]:
+    messages = [(m.get("role") or m.get("user") or "user", (m.get("content") or "").strip()) for m in history]
+    return [m for m in messages if m[1]]
+
+class Session:
+    """Recent messages of one conversation plus a rolling summary of the older ones.
+
+    ``recent`` keeps the last ``max_recent`` messages verbatim. Messages that
+    fall out of it wait in ``pending`` until a background summarization folds
+    them into ``summary``; a session never holds more than that, so building
+    its history block costs the same on the 5th turn as on the 500th.
+    """
+
+    def __init__(self, key: Hashable, max_recent: int, max_pending: int = 0):
+        self.key = key
+        self.recent: List[Message] = []
+        self.max_recent = max(max_recent, 1)
+        self.max_pending = max(max_pending, 0)
+        self.pending: List[Message] = []
+        self.summary = ""
+        self.summarizing = False
+        self.turns = 0
+        self.dropped = 0
+        self.touched = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, role: str, content: str) -> None:
+        content = (content or "").strip()
+        if not content:
+            return
+        with self._lock:
+            self.dropped += _append(self.recent, self.pending, (role, content), self.max_recent, self.max_pending)
+
+    def add_turn(self, question: str, answer: str) -> None:
+        self.add("user", question)
+        self.add("assistant", answer)
+        self.turns += 1
+
+    def snapshot(self) -> Tuple[str, List[Dict[str, str]]]:
+        """(summary, recent messages) as of now."""
+        with self._lock:
+            return self.summary, [{"role": role, "content": content} for role, content in self.recent]
+
+    def take_pending(self) -> Optional[Tuple[str, List[Message]]]:
+        """Claim the pending messages for one summarization; None if there is nothing to do or one runs."""
+        with self._lock:
+            if self.summarizing or not self.pending:
+                return None
+            self.summarizing = True
+            return self.summary, list(self.pending)
+
+    def finish_summary(self, summary: Optional[str], folded: int) -> None:
+        """Store the new summary (None on failure) and drop the ``folded`` messages it covers."""
+        with self._lock:
+            self.summarizing = False
+            if summary is not None:
+                self.summary = summary
+                del self.pending[:folded]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "recent": len(self.recent),
+                "pending": len(self.pending),
+                "summary_chars": len(self.summary),
+                "dropped": self.dropped,
+            }
+
+class SessionStore:
+    """Conversations keyed by (tenant, conversation id), LRU-evicted beyond ``max_sessions`` and after ``ttl`` idle seconds."""
+
+    def __init__(self, max_sessions: int, ttl: float, max_recent: int, max_pending: int):
+        self.max_sessions = max(max_sessions, 1)
+        self.ttl = ttl
+        self.max_recent = max_recent
+        self.max_pending = max_pending
+        self._sessions: "OrderedDict[Hashable, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "created": 0, "restored": 0, "hits": 0, "unknown": 0, "evictions": 0, "expired": 0,
+            "summaries": 0, "summary_failures": 0,
+        }
+
+    def _expire(self, now: float) -> None:
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if not self.ttl or now - session.touched < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._stats["expired"] += 1
+
+    def open(self, key: Hashable, history: Optional[List[Dict[str, str]]] = None) -> Session:
+        """The session for ``key``; an unknown one is (re)built from ``history``, or UnknownSession is raised."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                session.touched = now
+                self._stats["hits"] += 1
+                return session
+            if history is None:
+                self._stats["unknown"] += 1
+                raise UnknownSession(f"Unknown conversation {key[-1] if isinstance(key, tuple) else key!r}.")
+            session = Session(key, self.max_recent, self.max_pending)
+            self._stats["restored" if history else "created"] += 1
+            self._sessions[key] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._stats["evictions"] += 1
+        for role, content in _history_messages(history):
+            session.add(role, content)
+        return session
+
+    def count(self, event: str) -> None:
+        with self._lock:
+            self._stats[event] += 1
+
+    def drop(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._sessions.pop(key, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "summarizing": sum(1 for s in self._sessions.values() if s.summarizing),
+                **self._stats,
+            }
+
+class SqliteSession:
+    """A ``Session`` whose state lives in the ``SqliteSessionStore`` file; every call is one transaction."""
+
+    def __init__(self, store: "SqliteSessionStore", key: Hashable):
+        self.store = store
+        self.key = key
+
+    def _update(self, change) -> Any:
+        return self.store._update(self.key, change)
+
+    def add(self, role: str, content: str) -> None:
+        content = (content or "").strip()
+        if content:
+            self._update(lambda state: self.store._add(state, [(role, content)]))
+
+    def add_turn(self, question: str, answer: str) -> None:
+        def change(state: Dict[str, Any]) -> None:
+            self.store._add(state, [m for m in (("user", question.strip()), ("assistant", answer.strip())) if m[1]])
+            state["turns"] += 1
+        self._update(change)
+
+    def snapshot(self) -> Tuple[str, List[Dict[str, str]]]:
+        state = self.store._load(self.key)
+        if state is None:
+            return "", []
+        return state["summary"], [{"role": role, "content": content} for role, content in state["recent"]]
+
+    def take_pending(self) -> Optional[Tuple[str, List[Message]]]:
+        def change(state: Dict[str, Any]) -> Optional[Tuple[str, List[Message]]]:
+            now = time.time()
+            if state["lease"] > now or not state["pending"]:
+                return None
+            # A lease rather than a flag, so a worker that dies mid-summary doesn't block the session.
+            state["lease"] = now + self.store.summary_lease_s
+            return state["summary"], [tuple(m) for m in state["pending"]]
+        return self._update(change)
+
+    def finish_summary(self, summary: Optional[str], folded: int) -> None:
+        def change(state: Dict[str, Any]) -> None:
+            state["lease"] = 0.0
+            if summary is not None:
+                state["summary"] = summary
+                del state["pending"][:folded]
+        self._update(change)
+
+    def to_dict(self) -> Dict[str, Any]:
+        state = self.store._load(self.key) or {"turns": 0, "recent": [], "pending": [], "summary": "", "dropped": 0}
+        return {
+            "turns": state["turns"],
+            "recent": len(state["recent"]),
+            "pending": len(state["pending"]),
+            "summary_chars": len(state["summary"]),
+            "dropped": state["dropped"],
+        }
+
+class SqliteSessionStore:
+    """``SessionStore`` in a SQLite file, so every worker process sees the same conversations."""
+
+    _FIELDS = ("recent", "pending", "summary", "lease", "turns", "dropped", "touched")
+
+    def __init__(self, path: str, max_sessions: int, ttl: float, max_recent: int, max_pending: int,
+                 summary_lease_s: float = 300.0):
+        self.path = path
+        self.max_sessions = max(max_sessions, 1)
+        self.ttl = ttl
+        self.max_recent = max(max_recent, 1)
+        self.max_pending = max(max_pending, 0)
+        self.summary_lease_s = summary_lease_s
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " key TEXT PRIMARY KEY, recent TEXT NOT NULL, pending TEXT NOT NULL, summary TEXT NOT NULL,"
+            " lease REAL NOT NULL, turns INTEGER NOT NULL, dropped INTEGER NOT NULL, touched REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS sessions_touched ON sessions(touched);"
+        )
+        self._lock = threading.Lock()
+        self._stats = {
+            "created": 0, "restored": 0, "hits": 0, "unknown": 0, "evictions": 0, "expired": 0,
+            "summaries": 0, "summary_failures": 0,
+        }
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+    def _select(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            f"SELECT {', '.join(self._FIELDS)} FROM sessions WHERE key = ?", (self._key(key),),
+        ).fetchone()
+        if row is None:
+            return None
+        state = dict(zip(self._FIELDS, row))
+        state["recent"] = json.loads(state["recent"])
+        state["pending"] = json.loads(state["pending"])
+        return state
+
+    def _write(self, key: Hashable, state: Dict[str, Any]) -> None:
+        values = {**state, "recent": json.dumps(state["recent"]), "pending": json.dumps(state["pending"])}
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO sessions (key, {', '.join(self._FIELDS)}) VALUES (?{', ?' * len(self._FIELDS)})",
+            (self._key(key), *(values[f] for f in self._FIELDS)),
+        )
+
+    def _add(self, state: Dict[str, Any], messages: List[Message]) -> None:
+        for message in messages:
+            state["dropped"] += _append(state["recent"], state["pending"], message, self.max_recent, self.max_pending)
+
+    def _load(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._select(key)
+
+    def _update(self, key: Hashable, change) -> Any:
+        with self._lock, transaction(self._conn, immediate=True):
+            state = self._select(key)
+            # Evicted by another worker in the meantime: nothing left to update.
+            result = change(state) if state is not None else None
+            if state is not None:
+                self._write(key, state)
+        return result
+
+    def open(self, key: Hashable, history: Optional[List[Dict[str, str]]] = None) -> SqliteSession:
+        now = time.time()
+        with self._lock, transaction(self._conn, immediate=True):
+            if self.ttl:
+                expired = self._conn.execute("DELETE FROM sessions WHERE touched < ?", (now - self.ttl,)).rowcount
+                self._stats["expired"] += expired
+            state = self._select(key)
+            if state is not None:
+                self._conn.execute("UPDATE sessions SET touched = ? WHERE key = ?", (now, self._key(key)))
+                self._stats["hits"] += 1
+            elif history is None:
+                self._stats["unknown"] += 1
+                raise UnknownSession(f"Unknown conversation {key[-1] if isinstance(key, tuple) else key!r}.")
+            else:
+                state = {"recent": [], "pending": [], "summary": "", "lease": 0.0, "turns": 0, "dropped": 0,
+                         "touched": now}
+                self._add(state, _history_messages(history))
+                self._write(key, state)
+                self._stats["restored" if history else "created"] += 1
+                excess = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+                if excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM sessions WHERE key IN (SELECT key FROM sessions ORDER BY touched LIMIT ?)",
+                        (excess,),
+                    )
+                    self._stats["evictions"] += excess
+        return SqliteSession(self, key)
+
+    def count(self, event: str) -> None:
+        with self._lock:
+            self._stats[event] += 1
+
+    def drop(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE key = ?", (self._key(key),)).rowcount > 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions, summarizing = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(lease > ?), 0) FROM sessions", (time.time(),),
+            ).fetchone()
+            return {"sessions": sessions, "max_sessions": self.max_sessions, "summarizing": summarizing, **self._stats}
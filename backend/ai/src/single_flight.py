@@ -0,0 +1,109 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _Stream:
+    def __init__(self):
+        self.frames: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+class SingleFlight:
+    """Coalesces concurrent identical requests onto one in-flight computation.
+
+    The computation runs in its own task, so it is not tied to the request
+    that started it. Every caller waits on it, and it is cancelled only when
+    the last waiter goes away (timeout or client disconnect). Streams are
+    fanned out the same way; a late subscriber first replays the frames it
+    missed.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _Stream] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, leader); ``leader`` is False for callers that joined a running call."""
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), leader
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        s = self._streams.get(key)
+        if s is None:
+            s = _Stream()
+            self._streams[key] = s
+            s.task = asyncio.ensure_future(self._produce(key, s, factory()))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        s.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                async with s.changed:
+                    await s.changed.wait_for(lambda: len(s.frames) > sent or s.done)
+                while sent < len(s.frames):
+                    frame = s.frames[sent]
+                    sent += 1
+                    yield frame
+                if s.done and sent == len(s.frames):
+                    if s.error is not None:
+                        raise s.error
+                    return
+        finally:
+            s.subscribers -= 1
+            if s.subscribers == 0 and not s.task.done():
+                s.task.cancel()
+
+    async def _produce(self, key: Hashable, s: _Stream, frames: AsyncIterator[Any]) -> None:
+        try:
+            async for frame in frames:
+                async with s.changed:
+                    s.frames.append(frame)
+                    s.changed.notify_all()
+        except asyncio.CancelledError:
+            s.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            s.error = e
+        finally:
+            self._forget(self._streams, key, s)
+            await frames.aclose()
+            async with s.changed:
+                s.done = True
+                s.changed.notify_all()
+
+    @staticmethod
+    def _forget(table: Dict[Hashable, Any], key: Hashable, entry: Any) -> None:
+        if table.get(key) is entry:
+            del table[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
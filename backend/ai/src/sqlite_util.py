@@ -0,0 +1,20 @@
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+@contextmanager
+def transaction(conn: sqlite3.Connection, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+    """Explicit transaction on an autocommit (``isolation_level=None``) connection.
+
+    Committed when the block ends, rolled back if the block (or the commit)
+    raises. ``immediate`` takes the write lock up front, so a block that
+    reads before it writes cannot lose a race with another process.
+    """
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
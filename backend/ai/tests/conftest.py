@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the service as ``src.<module>``, like the bench scripts do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
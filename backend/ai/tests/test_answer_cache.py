@@ -0,0 +1,70 @@
+import pytest
+
+from src.answer_cache import AnswerCache, SqliteAnswerCache, make_scope
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return AnswerCache()
+    return SqliteAnswerCache(str(tmp_path / "answers.sqlite"))
+
+def test_exact_hit_ignores_case_and_punctuation(cache):
+    scope = make_scope("lectures", 4, None, "")
+    cache.put(scope, "What is a matrix?", {"answer": "A table."})
+    assert cache.get(scope, "what is a   MATRIX") == {"answer": "A table."}
+    assert cache.get(make_scope("lectures", 5, None, ""), "what is a matrix") is None
+
+def test_put_after_invalidate_is_dropped(cache):
+    scope = make_scope("lectures", 4, None, "")
+    generation = cache.generation(scope)
+    # The collection changes while the answer is being generated.
+    cache.invalidate("lectures")
+    cache.put(scope, "q", {"answer": "stale"}, generation=generation)
+    assert cache.get(scope, "q") is None
+    assert cache.stats()["stale_puts"] == 1
+
+    cache.put(scope, "q", {"answer": "fresh"}, generation=cache.generation(scope))
+    assert cache.get(scope, "q") == {"answer": "fresh"}
+
+def test_multi_collection_answer_goes_stale_with_either_collection(cache):
+    scope = make_scope("lectures,exercises", 4, None, "")
+    generation = cache.generation(scope)
+    cache.invalidate("exercises")
+    cache.put(scope, "q", {"answer": "stale"}, generation=generation)
+    assert cache.get(scope, "q") is None
+
+    cache.put(scope, "q", {"answer": "fresh"}, generation=cache.generation(scope))
+    assert cache.invalidate("lectures") == 1
+    assert cache.get(scope, "q") is None
+
+def test_invalidate_leaves_other_collections_alone(cache):
+    lectures, exercises = make_scope("lectures", 4, None, ""), make_scope("exercises", 4, None, "")
+    cache.put(lectures, "q", {"answer": "l"})
+    cache.put(exercises, "q", {"answer": "e"})
+    cache.invalidate("lecture")
+    cache.invalidate("lectures")
+    assert cache.get(lectures, "q") is None
+    assert cache.get(exercises, "q") == {"answer": "e"}
+
+def test_sqlite_generations_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    worker_a, worker_b = SqliteAnswerCache(path), SqliteAnswerCache(path)
+    scope = make_scope("lectures", 4, None, "")
+    generation = worker_a.generation(scope)
+    worker_b.invalidate("lectures")
+    worker_a.put(scope, "q", {"answer": "stale"}, generation=generation)
+    assert worker_b.get(scope, "q") is None
+
+    worker_a.put(scope, "q", {"answer": "fresh"}, generation=worker_a.generation(scope))
+    assert worker_b.get(scope, "q") == {"answer": "fresh"}
+
+def test_lru_eviction(cache):
+    cache.max_entries = 2
+    scope = make_scope("lectures", 4, None, "")
+    cache.put(scope, "a", {"answer": "a"})
+    cache.put(scope, "b", {"answer": "b"})
+    assert cache.get(scope, "a") is not None
+    cache.put(scope, "c", {"answer": "c"})
+    assert cache.get(scope, "b") is None
+    assert cache.get(scope, "a") is not None
+    assert cache.stats()["evictions"] == 1
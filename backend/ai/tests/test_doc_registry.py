@@ -0,0 +1,52 @@
+from langchain_core.documents import Document
+
+from src.doc_registry import DocumentRegistry, SourceSync, chunk_id
+
+def _docs(*texts: str):
+    return [Document(page_content=text, metadata={"page": i + 1}) for i, text in enumerate(texts)]
+
+def _ingest(registry: DocumentRegistry, *texts: str):
+    sync = SourceSync(registry, "lectures", "notes.pdf")
+    new, kept = sync.assign(_docs(*texts))
+    return sync, new, kept
+
+def test_first_ingest_adds_every_chunk(tmp_path):
+    registry = DocumentRegistry(str(tmp_path / "registry.sqlite"))
+    sync, new, kept = _ingest(registry, "one", "two", "two")
+    assert [d.page_content for d in new] == ["one", "two"]
+    assert kept == []
+    assert sync.added() == sorted(chunk_id("notes.pdf", t) for t in ("one", "two"))
+    assert sync.removed() == []
+    sync.commit("digest-1")
+    assert registry.file_hash("lectures", "notes.pdf") == "digest-1"
+    assert sorted(registry.chunk_ids("lectures", "notes.pdf")) == sync.added()
+
+def test_reingest_reports_added_and_removed_chunks(tmp_path):
+    registry = DocumentRegistry(str(tmp_path / "registry.sqlite"))
+    _ingest(registry, "one", "two", "three")[0].commit("digest-1")
+
+    sync, new, kept = _ingest(registry, "one", "2", "three")
+    assert [d.page_content for d in new] == ["2"]
+    assert [d.page_content for d in kept] == ["one", "three"]
+    assert sync.added() == [chunk_id("notes.pdf", "2")]
+    assert sync.removed() == [chunk_id("notes.pdf", "two")]
+    assert all(d.id == chunk_id("notes.pdf", d.page_content) for d in new + kept)
+
+    sync.commit("digest-2")
+    assert set(registry.chunk_ids("lectures", "notes.pdf")) == {chunk_id("notes.pdf", t) for t in ("one", "2", "three")}
+    assert registry.documents("lectures")[0]["chunks"] == 3
+
+def test_uncommitted_sync_leaves_registry_unchanged(tmp_path):
+    registry = DocumentRegistry(str(tmp_path / "registry.sqlite"))
+    _ingest(registry, "one")[0].commit("digest-1")
+    _ingest(registry, "two")
+    assert registry.chunk_ids("lectures", "notes.pdf") == [chunk_id("notes.pdf", "one")]
+
+def test_remove_and_forget_chunks(tmp_path):
+    registry = DocumentRegistry(str(tmp_path / "registry.sqlite"))
+    _ingest(registry, "one", "two")[0].commit("digest-1")
+    registry.forget_chunks("lectures", [chunk_id("notes.pdf", "one")])
+    [doc] = registry.documents("lectures")
+    assert (doc["chunks"], doc["file_hash"]) == (1, None)
+    assert registry.remove("lectures", ["notes.pdf"]) == [chunk_id("notes.pdf", "two")]
+    assert registry.documents("lectures") == []
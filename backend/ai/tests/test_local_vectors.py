@@ -0,0 +1,107 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from src.local_vectors import LocalCollection
+
+class _FailingWrites:
+    """Connection that fails every ``executemany``, i.e. the row insert of an upsert."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def executemany(self, *args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def _unit(i: int, dim: int = 4) -> list:
+    v = [0.0] * dim
+    v[i] = 1.0
+    return v
+
+def _collection(tmp_path, **kwargs) -> LocalCollection:
+    return LocalCollection(str(tmp_path), "lectures", **kwargs)
+
+def test_upsert_query_and_delete(tmp_path):
+    c = _collection(tmp_path)
+    c.upsert(["a", "b", "c"], [_unit(0), _unit(1), _unit(2)], ["A", "B", "C"], [{"p": 1}, {"p": 2}, {"p": 3}])
+    out = c.query([_unit(1)], n_results=2)
+    assert out["ids"][0][0] == "b"
+    assert out["documents"][0][0] == "B"
+    assert out["distances"][0][0] == pytest.approx(0.0, abs=1e-6)
+    assert c.query([_unit(1)], n_results=3, where={"p": {"$gte": 3}})["ids"] == [["c"]]
+
+    c.upsert(["b"], [_unit(3)], ["B2"], [{"p": 2}])
+    assert c.count() == 3
+    assert c.query([_unit(3)], n_results=1)["documents"] == [["B2"]]
+
+    c.delete(ids=["a"])
+    assert c.count() == 2
+    assert "a" not in c.query([_unit(0)], n_results=3)["ids"][0]
+    assert c.get(ids=["a"])["ids"] == []
+
+def test_deleted_slots_are_reused(tmp_path):
+    c = _collection(tmp_path)
+    c.upsert(["a", "b", "c"], [_unit(0), _unit(1), _unit(2)])
+    slot = c._slot_of["b"]
+    rows = len(c._matrix)
+    c.delete(ids=["b"])
+    c.upsert(["d"], [_unit(3)])
+    assert c._slot_of["d"] == slot
+    assert len(c._matrix) == rows
+    assert c.query([_unit(3)], n_results=1)["ids"] == [["d"]]
+    assert c.query([_unit(1)], n_results=4)["ids"][0][-1] != "b"
+
+def test_failed_upsert_keeps_free_slots(tmp_path):
+    c = _collection(tmp_path)
+    c.upsert(["a", "b"], [_unit(0), _unit(1)])
+    c.delete(ids=["a"])
+    free = list(c._free)
+    c._conn = _FailingWrites(c._conn)
+    with pytest.raises(sqlite3.OperationalError):
+        c.upsert(["x", "y"], [_unit(2), _unit(3)])
+    c._conn = c._conn._conn
+    assert c._free == free
+    assert c.count() == 1
+    assert "x" not in c._slot_of
+
+    c.upsert(["x"], [_unit(2)])
+    assert c._slot_of["x"] in free
+    assert _collection(tmp_path).get()["ids"] == c.get()["ids"]
+
+def test_failed_first_upsert_leaves_dimension_unset(tmp_path):
+    c = _collection(tmp_path)
+    c._conn = _FailingWrites(c._conn)
+    with pytest.raises(sqlite3.OperationalError):
+        c.upsert(["a"], [_unit(0)])
+    c._conn = c._conn._conn
+    assert c.dim is None
+    c.upsert(["a"], [_unit(0, dim=8)])
+    assert c.dim == 8
+
+def test_dimension_mismatch_is_rejected(tmp_path):
+    c = _collection(tmp_path)
+    c.upsert(["a"], [_unit(0)])
+    with pytest.raises(ValueError):
+        c.upsert(["b"], [_unit(0, dim=8)])
+    assert c.count() == 1
+
+def test_reopened_collection_sees_rows_and_computes_norms_lazily(tmp_path):
+    c = _collection(tmp_path, dtype="float16")
+    c.upsert(["a", "b"], [[3.0, 0.0, 0.0, 0.0], [0.0, 2.0, 0.0, 0.0]], ["A", "B"])
+    reopened = _collection(tmp_path)
+    assert reopened.dtype is np.float16
+    assert reopened._norms is None
+    out = reopened.query([[0.0, 1.0, 0.0, 0.0]], n_results=1)
+    assert out["ids"] == [["b"]]
+    assert out["distances"][0][0] == pytest.approx(0.0, abs=1e-3)
+
+def test_writes_from_another_process_are_picked_up(tmp_path):
+    worker_a, worker_b = _collection(tmp_path), _collection(tmp_path)
+    worker_a.upsert(["a"], [_unit(0)])
+    assert worker_b.count() == 1
+    worker_b.delete(ids=["a"])
+    assert worker_a.query([_unit(0)], n_results=1)["ids"] == [[]]
@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from src.ollama_pool import OllamaPool
+
+A, B = "http://a:11434", "http://b:11434"
+
+class ModelError(Exception):
+    status_code = 404
+
+def _fail(pool: OllamaPool, error: Exception, times: int = 1, exclude=(B,)) -> None:
+    for _ in range(times):
+        with pytest.raises(type(error)):
+            with pool.lease("chat", exclude):
+                raise error
+
+def _endpoint(pool: OllamaPool, url: str):
+    return next(ep for ep in pool.endpoints if ep.url == url)
+
+def test_outages_open_the_breaker_then_one_trial_closes_it():
+    pool = OllamaPool([A, B], failure_threshold=2, cooldown_s=0.05)
+    a = _endpoint(pool, A)
+    _fail(pool, httpx.ConnectError("refused"))
+    assert a.state(time.monotonic()) == "closed"
+    _fail(pool, httpx.ConnectError("refused"))
+    assert a.state(time.monotonic()) == "open"
+    with pytest.raises(HTTPException) as e:
+        with pool.lease("chat", {B}):
+            pass
+    assert e.value.status_code == 503
+    with pool.lease("chat") as url:
+        assert url == B
+
+    time.sleep(0.06)
+    assert a.state(time.monotonic()) == "half_open"
+    with pool.lease("chat", {B}) as url:
+        assert url == A
+        # Only one trial call at a time.
+        with pytest.raises(HTTPException):
+            with pool.lease("chat", {B}):
+                pass
+    assert a.state(time.monotonic()) == "closed"
+    assert a.trips == 1
+
+def test_failed_trial_reopens_the_breaker():
+    pool = OllamaPool([A, B], failure_threshold=1, cooldown_s=0.05)
+    a = _endpoint(pool, A)
+    _fail(pool, httpx.ConnectError("refused"))
+    time.sleep(0.06)
+    _fail(pool, httpx.ReadTimeout("slow"))
+    assert a.state(time.monotonic()) == "open"
+    assert a.trips == 2
+
+def test_server_errors_count_but_model_errors_do_not():
+    pool = OllamaPool([A, B], failure_threshold=1)
+    a = _endpoint(pool, A)
+    _fail(pool, ModelError("model 'nope' not found"), times=3)
+    assert a.state(time.monotonic()) == "closed"
+    assert (a.consecutive_failures, a.failures["chat"]) == (0, 3)
+
+    error = httpx.HTTPStatusError(
+        "boom", request=httpx.Request("POST", A), response=httpx.Response(500, request=httpx.Request("POST", A)),
+    )
+    _fail(pool, error)
+    assert a.state(time.monotonic()) == "open"
+
+def test_single_endpoint_breaker_never_opens():
+    pool = OllamaPool([A], failure_threshold=1)
+    _fail(pool, httpx.ConnectError("refused"), times=3, exclude=())
+    assert pool.endpoints[0].state(time.monotonic()) == "closed"
+    with pool.lease("chat") as url:
+        assert url == A
+
+def test_run_retries_an_outage_elsewhere_but_not_a_model_error():
+    pool = OllamaPool([A, B])
+    calls = []
+
+    def flaky(url: str) -> str:
+        calls.append(url)
+        if len(calls) == 1:
+            raise httpx.ConnectError("refused")
+        return url
+
+    assert pool.run("embed", flaky) != calls[0]
+    assert len(calls) == 2
+
+    def bad_model(url: str) -> str:
+        calls.append(url)
+        raise ModelError("not found")
+
+    calls.clear()
+    with pytest.raises(ModelError):
+        pool.run("embed", bad_model)
+    assert len(calls) == 1
+
+def test_cancelled_call_does_not_count_as_failure():
+    async def main() -> None:
+        pool = OllamaPool([A, B], failure_threshold=1)
+
+        async def slow(url: str) -> str:
+            await asyncio.sleep(10)
+            return url
+
+        task = asyncio.ensure_future(pool.call("chat", slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for ep in pool.endpoints:
+            assert (ep.outstanding["chat"], ep.consecutive_failures, ep.state(time.monotonic())) == (0, 0, "closed")
+
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.scheduler import Scheduler
+
+async def _queue(scheduler: Scheduler, order: list, tenant: str, priority: int = 0) -> asyncio.Task:
+    async def run() -> None:
+        async with scheduler.slot(tenant, priority):
+            order.append(tenant)
+
+    task = asyncio.ensure_future(run())
+    await asyncio.sleep(0)
+    return task
+
+def test_full_queue_is_rejected_with_429():
+    async def main() -> None:
+        scheduler = Scheduler(max_concurrent=1, max_queue=1, max_queue_per_tenant=0)
+        await scheduler.acquire("a")
+        waiter = await _queue(scheduler, [], "b")
+        with pytest.raises(HTTPException) as e:
+            await scheduler.acquire("c")
+        assert e.value.status_code == 429
+        assert int(e.value.headers["Retry-After"]) >= 1
+        assert scheduler.stats()["rejected"] == 1
+        scheduler.release()
+        await waiter
+
+    asyncio.run(main())
+
+def test_tenant_share_of_the_queue_is_capped():
+    async def main() -> None:
+        scheduler = Scheduler(max_concurrent=1, max_queue=10, max_queue_per_tenant=1)
+        await scheduler.acquire("a")
+        waiters = [await _queue(scheduler, [], "a")]
+        with pytest.raises(HTTPException) as e:
+            await scheduler.acquire("a")
+        assert e.value.status_code == 429
+        waiters.append(await _queue(scheduler, [], "b"))
+        assert scheduler.stats()["waiting"] == 2
+        scheduler.release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+
+def test_waiter_not_admitted_in_time_gets_503():
+    async def main() -> None:
+        scheduler = Scheduler(max_concurrent=1, max_queue=10, max_queue_per_tenant=0)
+        await scheduler.acquire("a")
+        with pytest.raises(HTTPException) as e:
+            await scheduler.acquire("b", timeout=0.05)
+        assert e.value.status_code == 503
+        assert "Retry-After" in e.value.headers
+        stats = scheduler.stats()
+        assert (stats["expired"], stats["waiting"], stats["running"]) == (1, 0, 1)
+        scheduler.release()
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(main())
+
+def test_cancelled_waiter_leaves_no_trace():
+    async def main() -> None:
+        scheduler = Scheduler(max_concurrent=1, max_queue=10, max_queue_per_tenant=0)
+        await scheduler.acquire("a")
+        waiter = await _queue(scheduler, [], "b")
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["waiting"] == 0
+        scheduler.release()
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(main())
+
+def test_tenants_take_turns():
+    async def main() -> None:
+        scheduler = Scheduler(max_concurrent=1, max_queue=10, max_queue_per_tenant=0)
+        order: list = []
+        await scheduler.acquire("holder")
+        waiters = [await _queue(scheduler, order, t) for t in ("a", "a", "a", "b")]
+        scheduler.release()
+        await asyncio.gather(*waiters)
+        assert order == ["a", "b", "a", "a"]
+
+    asyncio.run(main())
+
+@pytest.mark.parametrize("aging_s, first", [(0.0, "interactive"), (0.02, "batch")])
+def test_waiting_batch_work_ages_past_interactive(aging_s, first):
+    async def main() -> None:
+        scheduler = Scheduler(max_concurrent=1, max_queue=10, max_queue_per_tenant=0, aging_s=aging_s)
+        order: list = []
+        await scheduler.acquire("holder")
+        waiters = [await _queue(scheduler, order, "batch", priority=1)]
+        await asyncio.sleep(0.1)
+        waiters.append(await _queue(scheduler, order, "interactive", priority=0))
+        scheduler.release()
+        await asyncio.gather(*waiters)
+        assert order[0] == first
+
+    asyncio.run(main())
+
+def test_blocking_slots_are_never_rejected():
+    async def main() -> None:
+        scheduler = Scheduler(max_concurrent=1, max_queue=1, max_queue_per_tenant=0)
+        await scheduler.acquire("a")
+        waiter = await _queue(scheduler, [], "b")
+
+        def ingest() -> float:
+            with scheduler.blocking_slot("ingest") as waited:
+                return waited
+
+        worker = asyncio.get_running_loop().run_in_executor(None, ingest)
+        while scheduler.stats()["waiting"] < 2:
+            await asyncio.sleep(0.01)
+        scheduler.release()
+        await waiter
+        assert await worker > 0
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(main())
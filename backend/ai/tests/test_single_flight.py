@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from src.single_flight import SingleFlight
+
+def test_identical_calls_share_one_computation():
+    async def main() -> None:
+        flight, runs = SingleFlight(), []
+
+        async def compute() -> str:
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(flight.do("q", compute), flight.do("q", compute))
+        assert results == [("answer", True), ("answer", False)]
+        assert len(runs) == 1
+        assert flight.stats() == {"in_flight": 0, "started": 1, "coalesced": 1}
+
+    asyncio.run(main())
+
+def test_computation_survives_while_a_waiter_remains():
+    async def main() -> None:
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def compute() -> str:
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.ensure_future(flight.do("q", compute))
+        follower = asyncio.ensure_future(flight.do("q", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == ("answer", False)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(main())
+
+def test_last_waiter_leaving_cancels_the_computation():
+    async def main() -> None:
+        flight, cancelled = SingleFlight(), asyncio.Event()
+
+        async def compute() -> str:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "answer"
+
+        waiters = [asyncio.ensure_future(flight.do("q", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+def test_errors_reach_every_waiter_and_are_not_kept():
+    async def main() -> None:
+        flight, runs = SingleFlight(), []
+
+        async def compute() -> str:
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("model failed")
+
+        results = await asyncio.gather(flight.do("q", compute), flight.do("q", compute), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await flight.do("q", compute)
+        assert len(runs) == 2
+
+    asyncio.run(main())
+
+def test_late_stream_subscriber_replays_missed_frames():
+    async def main() -> None:
+        flight, step = SingleFlight(), asyncio.Event()
+
+        async def frames():
+            yield 1
+            await step.wait()
+            yield 2
+
+        async def collect() -> list:
+            return [frame async for frame in flight.stream("q", frames)]
+
+        first = asyncio.ensure_future(collect())
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(collect())
+        await asyncio.sleep(0.01)
+        step.set()
+        assert await first == [1, 2]
+        assert await second == [1, 2]
+        assert flight.stats()["coalesced"] == 1
+
+    asyncio.run(main())
+
+def test_stream_is_cancelled_when_every_subscriber_leaves():
+    async def main() -> None:
+        flight, closed = SingleFlight(), asyncio.Event()
+
+        async def frames():
+            try:
+                yield 1
+                await asyncio.sleep(10)
+                yield 2
+            finally:
+                closed.set()
+
+        async def consume() -> None:
+            async for _ in flight.stream("q", frames):
+                pass
+
+        subscribers = [asyncio.ensure_future(consume()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for subscriber in subscribers:
+            subscriber.cancel()
+        await asyncio.wait_for(closed.wait(), 1)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
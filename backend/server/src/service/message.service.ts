@@ -7,6 +7,7 @@ import { Conversation } from 'src/entities/conversation.entity';
 import { ConfigService } from '@nestjs/config';
 import { HttpService } from '@nestjs/axios';
 import { lastValueFrom } from 'rxjs';
+import { AxiosError, AxiosResponse } from 'axios';
 
 @Injectable()
 export class MessageService {
@@ -24,6 +25,25 @@ export class MessageService {
     });
   }
 
+  private async conversationHistory(
+    conversation: Conversation,
+    question: string,
+  ) {
+    const messages = await this.messageRepository.find({
+      where: { conversation: { id: conversation.id } },
+      order: { id: 'ASC' },
+    });
+    // The question being answered is already stored as the last prompt.
+    const last = messages[messages.length - 1];
+    if (last && last.isPrompt && last.content === question) {
+      messages.pop();
+    }
+    return messages.map((m) => ({
+      role: m.isPrompt ? 'user' : 'assistant',
+      content: m.content,
+    }));
+  }
+
   async create(message: CreateMessageDto, userId: number) {
     let conversation: Conversation;
     if (message.conversationId == null) {
@@ -40,21 +60,38 @@ export class MessageService {
     }
 
     if (!message.isPrompt) {
-      const conversationMessages = await this.messageRepository.find({
-        where: { conversation: conversation },
-      });
-      const conversationHistory = conversationMessages.map((message) => ({
-        content: message.content,
-        user: message.isPrompt ? 'user' : 'assistant',
-      }));
       const aiUrl = `${this.configService.get<string>('AI_SERVICE_URL')}/ask`;
-      const response$ = this.httpService.post(aiUrl, {
+      const request = {
         question: message.content,
         collection: message.collectionName,
         k: 4,
-        history: conversationHistory,
-      });
-      let result = await lastValueFrom(response$);
+        user_id: userId,
+        conversation_id: String(conversation.id),
+      };
+      // The AI service keeps the conversation history itself; it only needs
+      // ours for a new conversation, or after it restarted or evicted it (409).
+      let result: AxiosResponse<any>;
+      try {
+        result = await lastValueFrom(
+          this.httpService.post(
+            aiUrl,
+            message.conversationId == null
+              ? { ...request, history: [] }
+              : request,
+          ),
+        );
+      } catch (error) {
+        if (!(error instanceof AxiosError) || error.response?.status !== 409) {
+          throw error;
+        }
+        const history = await this.conversationHistory(
+          conversation,
+          message.content,
+        );
+        result = await lastValueFrom(
+          this.httpService.post(aiUrl, { ...request, history }),
+        );
+      }
       message.content = result.data.answer;
     }
 